@@ -4,9 +4,154 @@ Module that defines some basic properties of the app.
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Backend
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import User, Backend, RequestProfile, WebhookDelivery
+from .webhooks import dispatch_due_deliveries
 
 # Register your models here.
 
-admin.site.register(User, UserAdmin)
+
+class QlueUserAdmin(UserAdmin):
+    """
+    The admin of the users, which also allows us to set their share of the queues.
+    """
+
+    fieldsets = UserAdmin.fieldsets + (
+        ("Queue", {"fields": ("queue_weight", "queue_priority")}),
+        ("Callbacks", {"fields": ("callback_url", "callback_secret")}),
+    )
+    list_display = UserAdmin.list_display + ("queue_weight", "queue_priority")
+
+
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    """
+    The admin of the notifications about finished jobs, where the dead letters can be
+    sent again.
+    """
+
+    list_display = ("job_id", "username", "url", "state", "attempts", "last_error")
+    list_filter = ("state", "backend")
+    search_fields = ("job_id", "username")
+    exclude = ("secret",)
+    actions = ["retry"]
+
+    @admin.action(description="Send the selected notifications again")
+    def retry(self, request, queryset):
+        """
+        Put the selected notifications back into the delivery.
+        """
+        num_retried = queryset.exclude(state="WAITING").update(
+            state="PENDING", attempts=0, next_attempt=timezone.now()
+        )
+        transaction.on_commit(dispatch_due_deliveries)
+        self.message_user(request, f"{num_retried} notifications are sent again.")
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    """
+    The admin of the profiles of single requests, from which the sampled stacks and
+    the statistics of cProfile can be downloaded.
+    """
+
+    list_display = (
+        "created",
+        "username",
+        "method",
+        "path",
+        "status_code",
+        "duration",
+        "num_samples",
+    )
+    search_fields = ("path", "username")
+    exclude = ("folded_stacks", "stats")
+    readonly_fields = (
+        "created",
+        "username",
+        "method",
+        "path",
+        "status_code",
+        "duration",
+        "num_samples",
+        "downloads",
+        "summary_text",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                "<int:profile_id>/folded/",
+                self.admin_site.admin_view(self.folded_view),
+                name="backends_requestprofile_folded",
+            ),
+            path(
+                "<int:profile_id>/cprofile/",
+                self.admin_site.admin_view(self.cprofile_view),
+                name="backends_requestprofile_cprofile",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    @staticmethod
+    @admin.display(description="Downloads")
+    def downloads(obj):
+        """
+        The links to the files of the profile.
+        """
+        return format_html(
+            '<a href="{}">stacks for flamegraphs</a> | <a href="{}">cProfile stats</a>',
+            reverse("admin:backends_requestprofile_folded", args=[obj.id]),
+            reverse("admin:backends_requestprofile_cprofile", args=[obj.id]),
+        )
+
+    @staticmethod
+    @admin.display(description="Summary")
+    def summary_text(obj):
+        """
+        The summary of cProfile with its layout.
+        """
+        return format_html("<pre>{}</pre>", obj.summary)
+
+    @staticmethod
+    def folded_view(request, profile_id: int):
+        """
+        Download the sampled stacks.
+        """
+        # pylint: disable=W0613
+        profile = get_object_or_404(RequestProfile, id=profile_id)
+        response = HttpResponse(profile.folded_stacks, content_type="text/plain")
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="profile-{profile_id}.folded"'
+        return response
+
+    @staticmethod
+    def cprofile_view(request, profile_id: int):
+        """
+        Download the statistics of cProfile.
+        """
+        # pylint: disable=W0613
+        profile = get_object_or_404(RequestProfile, id=profile_id)
+        response = HttpResponse(
+            bytes(profile.stats), content_type="application/octet-stream"
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="profile-{profile_id}.prof"'
+        return response
+
+
+admin.site.register(User, QlueUserAdmin)
 admin.site.register(Backend)
+admin.site.register(WebhookDelivery, WebhookDeliveryAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
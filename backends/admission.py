@@ -0,0 +1,135 @@
+"""
+The module that decides if a backend accepts new jobs. It protects the queues from
+growing without bounds and only looks at counters, such that the protection does not
+add any load on the storage.
+"""
+import math
+from typing import Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Backend, QueueEntry, SubmitBucket
+from .queue_stats import count_running_jobs, drain_time, get_queue_stats
+
+# pylint: disable=E1101
+
+# the time after which we ask clients to retry, if we never saw the queue drain
+DEFAULT_RETRY_AFTER = 60
+MAX_RETRY_AFTER = 3600
+
+
+def submit_token_wait(backend: Backend, username: str, num_tokens: int = 1) -> float:
+    """
+    Look into the bucket of the user without taking a token, such that a submission
+    only uses up its tokens once its jobs are stored.
+
+    Args:
+        backend: The backend to which the user submits
+        username: The user that submits
+        num_tokens: The number of jobs that the user submits
+
+    Returns:
+        0 if the tokens are available, otherwise the time in seconds until they are
+        available.
+    """
+    bucket = SubmitBucket.objects.filter(backend=backend, username=username).first()
+    if bucket is None:
+        tokens = backend.submit_burst
+    else:
+        tokens = _refilled_tokens(backend, bucket, timezone.now())
+    if tokens < num_tokens:
+        return (num_tokens - tokens) / backend.submit_rate
+    return 0
+
+
+def take_submit_token(backend: Backend, username: str, num_tokens: int = 1) -> float:
+    """
+    Take tokens from the bucket of the user. The bucket holds up to `submit_burst`
+    tokens and is refilled with `submit_rate` tokens per second. The tokens are taken
+    even if the bucket does not hold enough of them, because the jobs are already
+    stored. The debt then delays the next submissions of the user.
+
+    Args:
+        backend: The backend to which the user submits
+        username: The user that submits
+        num_tokens: The number of jobs that were stored
+
+    Returns:
+        0 if the bucket held the tokens, otherwise the time in seconds until they
+        would have been available.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        bucket, _ = SubmitBucket.objects.select_for_update().get_or_create(
+            backend=backend,
+            username=username,
+            defaults={"tokens": backend.submit_burst, "updated": now},
+        )
+        tokens = _refilled_tokens(backend, bucket, now)
+        bucket.tokens = tokens - num_tokens
+        bucket.updated = now
+        bucket.save()
+    if tokens < num_tokens:
+        return (num_tokens - tokens) / backend.submit_rate
+    return 0
+
+
+def check_admission(
+    backend: Backend, username: str, num_jobs: int = 1
+) -> Optional[Tuple[str, int]]:
+    """
+    Check if the backend admits more jobs of the user.
+
+    Args:
+        backend: The backend to which the jobs are submitted
+        username: The user that submits the jobs
+        num_jobs: The number of jobs in the submission
+
+    Returns:
+        None if the jobs are admitted. Otherwise the reason of the rejection and the
+        number of seconds after which the client should retry.
+    """
+    stats = get_queue_stats(backend)
+    if (
+        backend.max_queue_depth is not None
+        and stats.queued + num_jobs > backend.max_queue_depth
+    ):
+        wait = drain_time(stats, stats.queued + num_jobs - backend.max_queue_depth)
+        return "The queue of the backend is full!", _retry_after(wait)
+
+    if backend.max_jobs_per_user is not None:
+        user_jobs = QueueEntry.objects.filter(
+            backend=backend, username=username
+        ).count() + count_running_jobs(stats, username)
+        if user_jobs + num_jobs > backend.max_jobs_per_user:
+            wait = drain_time(stats, user_jobs + num_jobs - backend.max_jobs_per_user)
+            return "You have too many jobs in the queue!", _retry_after(wait)
+
+    if backend.submit_rate:
+        if num_jobs > backend.submit_burst:
+            return (
+                f"You can submit at most {backend.submit_burst} jobs at once!",
+                _retry_after(backend.submit_burst / backend.submit_rate),
+            )
+        wait = submit_token_wait(backend, username, num_jobs)
+        if wait > 0:
+            return "You submit jobs too quickly!", _retry_after(wait)
+    return None
+
+
+def _refilled_tokens(backend: Backend, bucket: SubmitBucket, now) -> float:
+    """
+    The tokens in the bucket after it was refilled until now.
+    """
+    elapsed = (now - bucket.updated).total_seconds()
+    return min(bucket.tokens + elapsed * backend.submit_rate, backend.submit_burst)
+
+
+def _retry_after(wait: Optional[float]) -> int:
+    """
+    The value of the Retry-After header in seconds.
+    """
+    if wait is None:
+        return DEFAULT_RETRY_AFTER
+    return min(max(math.ceil(wait), 1), MAX_RETRY_AFTER)
@@ -1,14 +1,78 @@
 """
 Module that defines the user api v1 which goes through django-ninja.
 """
-from typing import List
-from ninja import NinjaAPI
+import asyncio
+import functools
+import json
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
 
-from .schemas import BackendSchemaOut
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from dropbox.exceptions import ApiError, AuthError
+from ninja import File, Form, NinjaAPI
+from ninja.files import UploadedFile
+
+from .schemas import BackendSchemaOut, QueueStatsSchemaOut
 from .models import Backend
+from .admission import check_admission
+from .archive import (
+    aload_job_status,
+    archived_bundles,
+    archived_job_ids,
+    is_archived,
+    load_archived_result,
+)
+from .export import EXPORT_MEDIA_TYPE, stream_export
+from .encodings import (
+    UNACCEPTABLE_MESSAGE,
+    decode_payload,
+    encoded_response,
+    negotiate_media_type,
+    pack_result,
+    unpack_result,
+)
+from .results import (
+    UnknownExperimentError,
+    cache_counts,
+    cached_counts,
+    counts_result,
+    select_experiments,
+)
+from .result_chunks import aload_chunked_result, is_chunked
+from .idempotency import (
+    IDEMPOTENCY_HEADER,
+    claim_idempotency_key,
+    request_fingerprint,
+    settle_idempotency_key,
+)
+from .storage_providers import StorageUnavailable
+from .storage_routing import abackend_storage
+from .webhooks import resolve_callback
+from .jobs import (
+    MAX_JOBS_PER_SUBMISSION,
+    admit_job,
+    annotate_status,
+    check_credentials,
+    error_response,
+    finished_jobs_dir,
+    make_job_id,
+    new_job_response,
+    prepare_jobs,
+    queued_job_path,
+    register_job,
+    register_jobs,
+    result_json_path,
+    status_json_path,
+    unavailable_response,
+)
+from . import queue_stats
 
 api = NinjaAPI(version="1.0.0")
 
+# the number of jobs of a batch submission that are uploaded at the same time
+MAX_PARALLEL_UPLOADS = 16
+
 
 @api.get("{backend_name}/get_config", response=BackendSchemaOut, tags=["Backend"])
 def get_config(request, backend_name: str):
@@ -51,6 +115,16 @@ def get_config(request, backend_name: str):
     return config_dict
 
 
+@api.get("{backend_name}/queue_stats", response=QueueStatsSchemaOut, tags=["Backend"])
+def get_queue_stats(request, backend_name: str):
+    """
+    Returns the statistics of the queue of the backend.
+    """
+    # pylint: disable=W0613, E1101
+    backend = get_object_or_404(Backend, name=backend_name)
+    return queue_stats.summarize_queue_stats(queue_stats.get_queue_stats(backend))
+
+
 @api.get("/backends", response=List[BackendSchemaOut], tags=["Backend"])
 def list_backends(request):
     """
@@ -96,3 +170,525 @@ def list_backends(request):
 
         backend_list.append(config_dict)
     return backend_list
+
+
+# The job endpoints below are asynchronous. They wait for the storage without blocking
+# the worker, such that a single worker can serve many requests at the same time. The
+# database is accessed through `sync_to_async`, as the ORM of django is synchronous.
+
+
+@api.post("{backend_name}/post_job", tags=["Job"])
+async def post_job(
+    request,
+    backend_name: str,
+    *,
+    username: str = Form(...),
+    password: str = Form(...),
+    job_str: str = Form(None, alias="json"),
+    job_file: UploadedFile = File(None),
+    callback_url: str = Form(None),
+    callback_secret: str = Form(None),
+):
+    """
+    Submit a job to the backend. The job is either sent as json string in the form
+    field `json` or as file `job_file` in one of the media types of `CODECS`. The
+    finished job is posted to `callback_url`, signed with `callback_secret`, if they
+    are given or the user has defaults for them.
+    """
+    # pylint: disable=W0613, E1101, R0913
+    job_response_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if job_response_dict["status"] == "ERROR":
+        return JsonResponse(job_response_dict, status=html_status)
+    try:
+        job_str = _read_payload(job_str, job_file)
+        callback = await sync_to_async(resolve_callback)(
+            username, callback_url, callback_secret
+        )
+    except ValueError as err:
+        return error_response(job_response_dict, str(err), 406)
+    return await _run_idempotent(
+        request,
+        username,
+        request_fingerprint(backend_name, job_str),
+        functools.partial(
+            _submit_job, backend_name, username, job_response_dict, job_str, callback
+        ),
+    )
+
+
+async def _submit_job(
+    backend_name: str,
+    username: str,
+    job_response_dict: dict,
+    job_str: str,
+    callback: Optional[Tuple[str, str]],
+) -> JsonResponse:
+    """
+    Store the job of an authenticated submission and put it into the queue.
+    """
+    # pylint: disable=E1101
+    backend = await sync_to_async(Backend.objects.get)(name=backend_name)
+    rejection = await sync_to_async(admit_job)(
+        backend, username, job_response_dict, job_str
+    )
+    if rejection is not None:
+        return rejection
+
+    job_id = make_job_id(backend_name, username)
+    job_response_dict["job_id"] = job_id
+    job_response_dict["status"] = "INITIALIZING"
+    job_response_dict["detail"] = "Got your json."
+    storage_provider = await abackend_storage(backend_name)
+    try:
+        await asyncio.gather(
+            storage_provider.aupload(
+                dump_str=job_str, storage_path=queued_job_path(backend_name, job_id)
+            ),
+            storage_provider.aupload(
+                dump_str=json.dumps(job_response_dict),
+                storage_path=status_json_path(backend_name, job_id),
+            ),
+        )
+    except StorageUnavailable as err:
+        return unavailable_response(job_response_dict, err)
+    except (AuthError, ApiError, OSError):
+        return error_response(
+            job_response_dict, "Error saving json data to database!", 406
+        )
+
+    job_response_dict["estimated_start"] = await sync_to_async(register_job)(
+        backend, username, job_id, callback
+    )
+    return JsonResponse(job_response_dict)
+
+
+@api.post("{backend_name}/post_jobs", tags=["Job"])
+async def post_jobs(
+    request,
+    backend_name: str,
+    *,
+    username: str = Form(...),
+    password: str = Form(...),
+    jobs_str: str = Form(None, alias="json"),
+    job_file: UploadedFile = File(None),
+    callback_url: str = Form(None),
+    callback_secret: str = Form(None),
+):
+    """
+    Submit a list of jobs to the backend at once. Each job is validated on its own,
+    such that an invalid job does not keep the others from being queued. Like for
+    `post_job`, the list may also be sent as file `job_file` and every job is
+    posted to the callback once it is finished.
+    """
+    # pylint: disable=W0613, R0913
+    job_response_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if job_response_dict["status"] == "ERROR":
+        return JsonResponse(job_response_dict, status=html_status)
+    try:
+        jobs_str = _read_payload(jobs_str, job_file)
+        callback = await sync_to_async(resolve_callback)(
+            username, callback_url, callback_secret
+        )
+    except ValueError as err:
+        return error_response(job_response_dict, str(err), 406)
+    return await _run_idempotent(
+        request,
+        username,
+        request_fingerprint(backend_name, jobs_str),
+        functools.partial(
+            _submit_jobs, backend_name, username, job_response_dict, jobs_str, callback
+        ),
+    )
+
+
+async def _submit_jobs(
+    backend_name: str,
+    username: str,
+    job_response_dict: dict,
+    jobs_str: str,
+    callback: Optional[Tuple[str, str]],
+) -> JsonResponse:
+    """
+    Store the valid jobs of an authenticated batch submission and put them into the
+    queue.
+    """
+    # pylint: disable=E1101, R0914
+    try:
+        job_list = json.loads(jobs_str)
+    except json.JSONDecodeError:
+        job_list = None
+    if not isinstance(job_list, list) or not job_list:
+        return error_response(
+            job_response_dict, "The json has to be a non-empty list of jobs!", 406
+        )
+    if len(job_list) > MAX_JOBS_PER_SUBMISSION:
+        return error_response(
+            job_response_dict,
+            f"At most {MAX_JOBS_PER_SUBMISSION} jobs can be submitted at once!",
+            406,
+        )
+
+    backend = await sync_to_async(Backend.objects.get)(name=backend_name)
+    job_responses = await sync_to_async(prepare_jobs)(backend, username, job_list)
+    # every valid job counts towards the limits, not only the request
+    num_valid = sum(
+        job_response["status"] == "INITIALIZING" for job_response in job_responses
+    )
+    if num_valid:
+        rejection = await sync_to_async(check_admission)(backend, username, num_valid)
+        if rejection is not None:
+            response = error_response(job_response_dict, rejection[0], 429)
+            response["Retry-After"] = str(rejection[1])
+            return response
+
+    storage_provider = await abackend_storage(backend_name)
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_UPLOADS)
+
+    async def store_job(job_dict: dict, job_response: dict) -> None:
+        job_id = job_response["job_id"]
+        async with semaphore:
+            try:
+                await asyncio.gather(
+                    storage_provider.aupload(
+                        dump_str=json.dumps(job_dict),
+                        storage_path=queued_job_path(backend_name, job_id),
+                    ),
+                    storage_provider.aupload(
+                        dump_str=json.dumps(job_response),
+                        storage_path=status_json_path(backend_name, job_id),
+                    ),
+                )
+            except (AuthError, ApiError, OSError):
+                job_response.update(new_job_response())
+                job_response["status"] = "ERROR"
+                job_response["detail"] = "Error saving json data to database!"
+                job_response["error_message"] = "Error saving json data to database!"
+
+    await asyncio.gather(
+        *(
+            store_job(job_dict, job_response)
+            for job_dict, job_response in zip(job_list, job_responses)
+            if job_response["status"] == "INITIALIZING"
+        )
+    )
+    stored_responses = [
+        job_response
+        for job_response in job_responses
+        if job_response["status"] == "INITIALIZING"
+    ]
+    job_ids = [job_response["job_id"] for job_response in stored_responses]
+    estimated_starts = await sync_to_async(register_jobs)(
+        backend, username, job_ids, callback
+    )
+    for job_response, start in zip(stored_responses, estimated_starts):
+        job_response["estimated_start"] = start
+    return JsonResponse({"job_ids": job_ids, "jobs": job_responses})
+
+
+def _read_payload(job_str: Optional[str], job_file: Optional[UploadedFile]) -> str:
+    """
+    Get the submitted payload as json string, such that it can be validated and stored
+    like any other job.
+
+    Raises:
+        ValueError: If the payload is missing or cannot be decoded.
+    """
+    if job_file is not None:
+        return json.dumps(decode_payload(job_file.read(), job_file.content_type))
+    if job_str is None:
+        raise ValueError("The job is missing!")
+    return job_str
+
+
+async def _run_idempotent(
+    request,
+    username: str,
+    fingerprint: str,
+    submit: Callable[[], Awaitable[JsonResponse]],
+) -> JsonResponse:
+    """
+    Run a submission at most once for each `Idempotency-Key` of the user.
+
+    Args:
+        request: The request coming in
+        username: The authenticated user
+        fingerprint: The `request_fingerprint` of the submission
+        submit: The submission that stores the job(s)
+
+    Returns:
+        The answer to the submission or to the earlier submission with the same key
+    """
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key is None:
+        return await submit()
+    earlier_response = await sync_to_async(claim_idempotency_key)(
+        username, idempotency_key, fingerprint
+    )
+    if earlier_response is not None:
+        return earlier_response
+    response = None
+    try:
+        response = await submit()
+        return response
+    finally:
+        await sync_to_async(settle_idempotency_key)(username, idempotency_key, response)
+
+
+async def _aload_status(backend_name: str, job_id: str) -> dict:
+    """
+    Load the status of a job from the storage or the archive.
+    """
+    storage_provider = await abackend_storage(backend_name)
+    return await aload_job_status(storage_provider, backend_name, job_id)
+
+
+@api.get("{backend_name}/get_job_status", tags=["Job"])
+async def get_job_status(
+    request, backend_name: str, job_id: str, username: str, password: str
+):
+    """
+    Get the status of a job that was previously submitted to the backend.
+    """
+    # pylint: disable=W0613
+    status_msg_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if status_msg_dict["status"] == "ERROR":
+        return JsonResponse(status_msg_dict, status=html_status)
+    status_msg_dict["job_id"] = job_id
+    if len(job_id.split("-")) < 3:
+        return error_response(
+            status_msg_dict, "Error loading json data from input request!", 406
+        )
+
+    # pylint: disable=W0702
+    try:
+        status_msg_dict = await _aload_status(backend_name, job_id)
+        status_msg_dict = await sync_to_async(annotate_status)(
+            backend_name, status_msg_dict
+        )
+        return JsonResponse(status_msg_dict, status=200)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
+    except:
+        return error_response(
+            status_msg_dict,
+            "Error getting status from database. Maybe invalid JOB ID!",
+            406,
+        )
+
+
+@api.get("{backend_name}/get_job_result", tags=["Job"])
+async def get_job_result(
+    request,
+    backend_name: str,
+    *,
+    job_id: str,
+    username: str,
+    password: str,
+    experiments: str = None,
+    counts: bool = False,
+    packed: bool = False,
+    partial: bool = False,
+):
+    """
+    Get the result of a job that was previously submitted to the backend. The status
+    is returned instead as long as the job is not done. The result is sent in the
+    media type that the `Accept` header asks for.
+
+    `experiments` selects experiments by their index or name as comma separated list.
+    With `counts` the shot memory of each experiment is replaced by the counts of its
+    outcomes. With `packed` the shot memory is sent as packed array of integers
+    instead of a list of strings. With `partial` the experiments that are already
+    done are sent while the job is still running, if the spooler stores the result in
+    chunks.
+    """
+    # pylint: disable=W0613, R0911, R0913
+    status_msg_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if status_msg_dict["status"] == "ERROR":
+        return JsonResponse(status_msg_dict, status=html_status)
+    media_type = negotiate_media_type(request.headers.get("Accept"))
+    if media_type is None:
+        return error_response(status_msg_dict, UNACCEPTABLE_MESSAGE, 406)
+    status_msg_dict["job_id"] = job_id
+    if len(job_id.split("-")) < 3:
+        return error_response(
+            status_msg_dict, "Error loading json data from input request!", 406
+        )
+
+    # the counts of a result do not change, so we do not have to ask the storage again
+    result_dict = cached_counts(backend_name, job_id, experiments) if counts else None
+    if result_dict is None:
+        try:
+            result_dict = await _aload_result(
+                backend_name, job_id, experiments, partial
+            )
+        except UnknownExperimentError as err:
+            return error_response(status_msg_dict, str(err), 406)
+        if isinstance(result_dict, JsonResponse):
+            return result_dict
+        if counts and result_dict.get("partial"):
+            result_dict = counts_result(result_dict)
+        elif counts:
+            result_dict = cache_counts(backend_name, job_id, result_dict, experiments)
+    if packed:
+        result_dict = pack_result(result_dict)
+    else:
+        result_dict = unpack_result(result_dict)
+    return encoded_response(result_dict, media_type)
+
+
+async def _aload_result(
+    backend_name: str, job_id: str, experiments: Optional[str], partial: bool
+) -> Union[dict, JsonResponse]:
+    """
+    Load the selected experiments of the result of a job from the storage. The answer
+    with the status is returned instead as long as the job is not done, or if the
+    status or the result could not be obtained.
+
+    Raises:
+        UnknownExperimentError: If a selected experiment is not part of the result.
+    """
+    # pylint: disable=W0702, R0911
+    status_msg_dict = new_job_response()
+    status_msg_dict["job_id"] = job_id
+    try:
+        status_msg_dict = await _aload_status(backend_name, job_id)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
+    except:
+        return error_response(
+            status_msg_dict,
+            "Error getting status from database. Maybe invalid JOB ID!",
+            406,
+        )
+    chunked = is_chunked(status_msg_dict)
+    if status_msg_dict["status"] != "DONE" and not (partial and chunked):
+        return JsonResponse(status_msg_dict, status=200)
+    storage_provider = await abackend_storage(backend_name)
+    try:
+        if is_archived(status_msg_dict):
+            result_dict = await sync_to_async(load_archived_result)(
+                storage_provider, job_id
+            )
+            return select_experiments(result_dict, experiments)
+        if chunked:
+            return await aload_chunked_result(
+                storage_provider, backend_name, job_id, experiments
+            )
+        result_dict = json.loads(
+            await storage_provider.aget_file_content(
+                storage_path=result_json_path(backend_name, job_id)
+            )
+        )
+    except UnknownExperimentError:
+        raise
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
+    except:
+        return error_response(
+            status_msg_dict, "Error getting result from database!", 406
+        )
+    return select_experiments(result_dict, experiments)
+
+
+@api.get("{backend_name}/get_user_jobs", tags=["Job"])
+async def get_user_jobs(request, backend_name: str, username: str, password: str):
+    """
+    Get the ids of all the finished jobs of the user on the backend.
+    """
+    # pylint: disable=W0613
+    status_msg_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if status_msg_dict["status"] == "ERROR":
+        return JsonResponse(status_msg_dict, status=html_status)
+
+    user_job_dict = {"job_ids": "None"}
+    job_ids = await sync_to_async(archived_job_ids)(backend_name, username)
+    try:
+        job_ids += await _afinished_job_ids(backend_name, username)
+    except StorageUnavailable as err:
+        return unavailable_response(user_job_dict, err)
+    if job_ids:
+        user_job_dict["job_ids"] = sorted(job_ids)
+    return JsonResponse(user_job_dict)
+
+
+async def _afinished_job_ids(backend_name: str, username: str) -> List[str]:
+    """
+    The ids of the finished jobs of a user that are still on the storage.
+
+    Raises:
+        StorageUnavailable: If the storage cannot be reached
+    """
+    # pylint: disable=W0702
+    try:
+        storage_provider = await abackend_storage(backend_name)
+        job_list = await storage_provider.aget_file_queue(
+            finished_jobs_dir(backend_name, username)
+        )
+    except StorageUnavailable:
+        raise
+    except:
+        return []
+    return [name[4:-5] for name in job_list]
+
+
+@api.get("{backend_name}/export_jobs", tags=["Job"])
+async def export_jobs(
+    request,
+    backend_name: str,
+    username: str,
+    password: str,
+    job_ids: str = None,
+):
+    """
+    Download the finished jobs of the user on the backend as a ZIP archive with the
+    payload, the status and the result of each job. `job_ids` selects jobs as comma
+    separated list, otherwise every finished and archived job is exported. The archive
+    is streamed while a few jobs at a time are read from the storage.
+    """
+    # pylint: disable=W0613
+    status_msg_dict, html_status = await sync_to_async(check_credentials)(
+        backend_name, username, password
+    )
+    if status_msg_dict["status"] == "ERROR":
+        return JsonResponse(status_msg_dict, status=html_status)
+
+    bundles = await sync_to_async(archived_bundles)(backend_name, username)
+    try:
+        finished_ids = await _afinished_job_ids(backend_name, username)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
+    user_job_ids = set(bundles) | set(finished_ids)
+    if job_ids is None:
+        selected_ids = sorted(user_job_ids)
+    else:
+        selected_ids = list(
+            dict.fromkeys(job_id.strip() for job_id in job_ids.split(","))
+        )
+        unknown_ids = [job_id for job_id in selected_ids if job_id not in user_job_ids]
+        if unknown_ids:
+            return error_response(
+                status_msg_dict,
+                "Unknown finished jobs: " + ", ".join(unknown_ids) + "!",
+                404,
+            )
+
+    response = StreamingHttpResponse(
+        stream_export(
+            await abackend_storage(backend_name), backend_name, selected_ids, bundles
+        ),
+        content_type=EXPORT_MEDIA_TYPE,
+    )
+    response["Content-Disposition"] = (
+        'attachment; filename="' + backend_name + "-" + username + '-jobs.zip"'
+    )
+    return response
@@ -2,14 +2,15 @@
 Module that configures the app.
 """
 from django.apps import AppConfig
-from .storage_providers import DropboxProvider
+from .storage_registry import LazyProvider
 
 
 class BackendsConfig(AppConfig):
     """
-    Class that defines some basic configuration settings.
+    Class that defines some basic configuration settings. The storage is built from
+    the default configuration of `STORAGE_PROVIDERS` on first use.
     """
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "backends"
-    storage = DropboxProvider()
+    storage = LazyProvider()
@@ -0,0 +1,400 @@
+"""
+The module that applies the retention policy of the backends. Finished jobs that are
+older than the `retention_days` of their backend are packed together with their status
+and their result into compressed bundles:
+
+    /Backend_files/Archive/<backend>/bundle-<timestamp>-<hex>.json.gz
+
+Afterwards, their files are removed from the storage. The `ArchivedJob` index tells us
+in which bundle a job is kept, such that its status and its result stay available.
+Archived jobs are marked by `"result_layout": "archived"` in their status.
+"""
+import datetime
+import gzip
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .jobs import finished_jobs_dir, result_json_path, status_json_path
+from .models import ArchivedJob, Backend
+from .queue_stats import submission_time
+from .result_chunks import chunk_path, is_chunked, manifest_path
+from .storage_providers import StorageProvider
+
+# pylint: disable=E1101
+
+ARCHIVE_DIR = "/Backend_files/Archive/"
+DELETED_JOBS_DIR = "/Backend_files/Deleted_Jobs/"
+ARCHIVED_LAYOUT = "archived"
+# the largest number of jobs in a single bundle
+MAX_JOBS_PER_BUNDLE = 500
+# the number of bundles that are kept in memory for repeated reads
+MAX_CACHED_BUNDLES = 4
+
+# the most recently read bundles, keyed by their path
+_BUNDLE_CACHE: "OrderedDict[str, dict]" = OrderedDict()
+# bundles might be read from several threads at the same time
+_BUNDLE_CACHE_LOCK = threading.Lock()
+
+
+def _list_folder(storage_provider: StorageProvider, folder: str) -> List[str]:
+    """
+    List the files of a folder, which might not exist. Every other failure of the
+    storage is raised, such that it is not mistaken for an empty folder.
+    """
+    try:
+        return storage_provider.get_file_queue(folder)
+    except FileNotFoundError:
+        return []
+
+
+def _read_file(storage_provider: StorageProvider, storage_path: str) -> Optional[str]:
+    """
+    Read a file, which might not exist. Every other failure of the storage is raised,
+    such that it is not mistaken for a missing file.
+    """
+    try:
+        return storage_provider.get_file_content(storage_path)
+    except FileNotFoundError:
+        return None
+
+
+def archive_candidates(
+    storage_provider: StorageProvider, backend: Backend, cutoff: datetime.datetime
+) -> List[Tuple[str, str]]:
+    """
+    Find the finished and the deleted jobs of a backend that were submitted before the
+    cutoff. Queued and running jobs are never archived.
+
+    Args:
+        storage_provider: The storage of the jobs
+        backend: The backend of the jobs
+        cutoff: The jobs that were submitted before are archived
+
+    Returns:
+        The id and the path of the job file of each job that should be archived
+    """
+    candidates = []
+    folders = [
+        finished_jobs_dir(backend.name, username)
+        for username in get_user_model().objects.values_list("username", flat=True)
+    ]
+    folders.append(DELETED_JOBS_DIR)
+    for folder in folders:
+        for job_json_name in _list_folder(storage_provider, folder):
+            job_id = job_json_name[4:-5]
+            split_job_id = job_id.split("-")
+            if len(split_job_id) < 4 or split_job_id[1] != backend.name:
+                continue
+            try:
+                if submission_time(job_id) >= cutoff:
+                    continue
+            except ValueError:
+                continue
+            candidates.append((job_id, folder + job_json_name))
+    return candidates
+
+
+def collect_job(
+    storage_provider: StorageProvider, backend_name: str, job_id: str, job_path: str
+) -> Tuple[dict, List[str]]:
+    """
+    Read everything that belongs to a job that is still on the storage.
+
+    Args:
+        storage_provider: The storage of the job
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        job_path: The path of the job file
+
+    Returns:
+        The entry of the job in a bundle and the paths of its files
+
+    Raises:
+        OSError: If the storage could not tell whether a file of the job exists or a
+            chunk of its result is missing
+        ValueError: If a file of the job is not valid json
+    """
+    paths = [job_path]
+    entry = {"job": _read_file(storage_provider, job_path), "status": None}
+    status_str = _read_file(storage_provider, status_json_path(backend_name, job_id))
+    if status_str is not None:
+        paths.append(status_json_path(backend_name, job_id))
+        entry["status"] = json.loads(status_str)
+
+    if entry["status"] is not None and is_chunked(entry["status"]):
+        manifest_str = _read_file(storage_provider, manifest_path(backend_name, job_id))
+        if manifest_str is not None:
+            manifest = json.loads(manifest_str)
+            chunk_paths = [
+                chunk_path(backend_name, job_id, index)
+                for index in range(len(manifest.get("experiments", [])))
+            ]
+            result_dict = dict(manifest.get("result", {}))
+            # unlike the other files, the chunks that the manifest lists must exist
+            result_dict["results"] = [
+                json.loads(storage_provider.get_file_content(path))
+                for path in chunk_paths
+            ]
+            entry["result"] = result_dict
+            paths += chunk_paths + [manifest_path(backend_name, job_id)]
+    else:
+        result_str = _read_file(
+            storage_provider, result_json_path(backend_name, job_id)
+        )
+        if result_str is not None:
+            paths.append(result_json_path(backend_name, job_id))
+            entry["result"] = json.loads(result_str)
+    return entry, paths
+
+
+def archive_backend(
+    storage_provider: StorageProvider,
+    backend: Backend,
+    now: datetime.datetime = None,
+    dry_run: bool = False,
+) -> int:
+    """
+    Pack the old jobs of a backend into archive bundles and remove their files.
+
+    Every bundle is written and indexed before any file is removed, such that an
+    interrupted run loses nothing. Jobs that are already indexed only have their
+    files removed. A job that cannot be read completely is left alone until the next
+    run, such that a failing storage never replaces a result by an empty archive.
+
+    Args:
+        storage_provider: The storage of the jobs
+        backend: The backend
+        now: The current time
+        dry_run: Only count the jobs that would be archived
+
+    Returns:
+        The number of archived jobs
+
+    Raises:
+        OSError: If the folders of the jobs could not be listed
+    """
+    # pylint: disable=R0914
+    if backend.retention_days is None:
+        return 0
+    if now is None:
+        now = timezone.now()
+    cutoff = now - datetime.timedelta(days=backend.retention_days)
+    candidates = archive_candidates(storage_provider, backend, cutoff)
+    if dry_run:
+        return len(candidates)
+
+    indexed = set(
+        ArchivedJob.objects.filter(
+            job_id__in=[job_id for job_id, _ in candidates]
+        ).values_list("job_id", flat=True)
+    )
+    stale_paths = []
+    new_candidates = []
+    for job_id, job_path in candidates:
+        if job_id in indexed:
+            try:
+                stale_paths += collect_job(
+                    storage_provider, backend.name, job_id, job_path
+                )[1]
+            except (OSError, ValueError):
+                continue
+        else:
+            new_candidates.append((job_id, job_path))
+    if stale_paths:
+        storage_provider.delete_files(stale_paths)
+
+    num_archived = 0
+    for start in range(0, len(new_candidates), MAX_JOBS_PER_BUNDLE):
+        bundle = {"backend": backend.name, "created": now.isoformat(), "jobs": {}}
+        paths = []
+        for job_id, job_path in new_candidates[start : start + MAX_JOBS_PER_BUNDLE]:
+            try:
+                entry, job_paths = collect_job(
+                    storage_provider, backend.name, job_id, job_path
+                )
+            except (OSError, ValueError):
+                continue
+            bundle["jobs"][job_id] = entry
+            paths += job_paths
+        if not bundle["jobs"]:
+            continue
+        bundle_path = (
+            ARCHIVE_DIR
+            + backend.name
+            + "/bundle-"
+            + now.strftime("%Y%m%d_%H%M%S")
+            + "-"
+            + uuid.uuid4().hex[:5]
+            + ".json.gz"
+        )
+        storage_provider.upload_bytes(
+            gzip.compress(json.dumps(bundle).encode("utf-8")), bundle_path
+        )
+        with transaction.atomic():
+            ArchivedJob.objects.bulk_create(
+                [
+                    ArchivedJob(
+                        job_id=job_id,
+                        backend=backend,
+                        username=job_id.split("-")[2],
+                        bundle_path=bundle_path,
+                        archived=now,
+                    )
+                    for job_id in bundle["jobs"]
+                ]
+            )
+        storage_provider.delete_files(paths)
+        num_archived += len(bundle["jobs"])
+    return num_archived
+
+
+def archived_job_ids(backend_name: str, username: str) -> List[str]:
+    """
+    The ids of the archived jobs of a user on a backend.
+    """
+    return list(
+        ArchivedJob.objects.filter(
+            backend__name=backend_name, username=username
+        ).values_list("job_id", flat=True)
+    )
+
+
+def archived_bundles(backend_name: str, username: str) -> Dict[str, str]:
+    """
+    The bundle of each archived job of a user on a backend, keyed by the job id.
+    """
+    return dict(
+        ArchivedJob.objects.filter(
+            backend__name=backend_name, username=username
+        ).values_list("job_id", "bundle_path")
+    )
+
+
+def _load_bundle(storage_provider: StorageProvider, bundle_path: str) -> dict:
+    """
+    Read a bundle from the storage or from the cache.
+    """
+    with _BUNDLE_CACHE_LOCK:
+        if bundle_path in _BUNDLE_CACHE:
+            _BUNDLE_CACHE.move_to_end(bundle_path)
+            return _BUNDLE_CACHE[bundle_path]
+    bundle = json.loads(
+        gzip.decompress(storage_provider.get_file_bytes(bundle_path)).decode("utf-8")
+    )
+    with _BUNDLE_CACHE_LOCK:
+        _BUNDLE_CACHE[bundle_path] = bundle
+        while len(_BUNDLE_CACHE) > MAX_CACHED_BUNDLES:
+            _BUNDLE_CACHE.popitem(last=False)
+    return bundle
+
+
+def load_bundle_entry(
+    storage_provider: StorageProvider, bundle_path: str, job_id: str
+) -> dict:
+    """
+    Get the entry of a job from its bundle without asking the database.
+
+    Args:
+        storage_provider: The storage of the bundles
+        bundle_path: The path of the bundle as in `archived_bundles`
+        job_id: The id of the job
+
+    Returns:
+        The job file, the status and the result of the job as they were archived
+    """
+    return _load_bundle(storage_provider, bundle_path)["jobs"][job_id]
+
+
+def load_archived_job(storage_provider: StorageProvider, job_id: str) -> Optional[dict]:
+    """
+    Get an archived job from its bundle.
+
+    Args:
+        storage_provider: The storage of the bundles
+        job_id: The id of the job
+
+    Returns:
+        The job file, the status and the result of the job as they were archived, or
+        None if the job was not archived
+    """
+    archived_job = ArchivedJob.objects.filter(job_id=job_id).first()
+    if archived_job is None:
+        return None
+    return load_bundle_entry(storage_provider, archived_job.bundle_path, job_id)
+
+
+def load_job_status(
+    storage_provider: StorageProvider, backend_name: str, job_id: str
+) -> dict:
+    """
+    Load the status of a job from the storage or from the archive.
+
+    Args:
+        storage_provider: The storage of the job
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+
+    Returns:
+        The status of the job. Archived jobs are marked by their `result_layout`.
+    """
+    archived_entry = load_archived_job(storage_provider, job_id)
+    if archived_entry is not None:
+        status_msg_dict = dict(archived_entry["status"] or {"job_id": job_id})
+        status_msg_dict["result_layout"] = ARCHIVED_LAYOUT
+        # the batch of an archived job was resolved long ago
+        status_msg_dict.pop("batch_id", None)
+        return status_msg_dict
+    return json.loads(
+        storage_provider.get_file_content(
+            storage_path=status_json_path(backend_name, job_id)
+        )
+    )
+
+
+async def aload_job_status(
+    storage_provider: StorageProvider, backend_name: str, job_id: str
+) -> dict:
+    """
+    Load the status of a job from the storage or from the archive. See
+    `load_job_status` for the details.
+    """
+    archived_entry = await sync_to_async(load_archived_job)(storage_provider, job_id)
+    if archived_entry is not None:
+        status_msg_dict = dict(archived_entry["status"] or {"job_id": job_id})
+        status_msg_dict["result_layout"] = ARCHIVED_LAYOUT
+        # the batch of an archived job was resolved long ago
+        status_msg_dict.pop("batch_id", None)
+        return status_msg_dict
+    return json.loads(
+        await storage_provider.aget_file_content(
+            storage_path=status_json_path(backend_name, job_id)
+        )
+    )
+
+
+def is_archived(status_msg_dict: dict) -> bool:
+    """
+    Is the job with this status archived ?
+    """
+    return status_msg_dict.get("result_layout") == ARCHIVED_LAYOUT
+
+
+def load_archived_result(storage_provider: StorageProvider, job_id: str) -> dict:
+    """
+    Get the result of an archived job.
+
+    Raises:
+        KeyError: If the job has no result.
+    """
+    archived_entry = load_archived_job(storage_provider, job_id)
+    if archived_entry is None or archived_entry.get("result") is None:
+        raise KeyError("The job " + job_id + " has no archived result!")
+    return archived_entry["result"]
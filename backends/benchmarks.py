@@ -0,0 +1,684 @@
+"""
+The module that measures the throughput and the tail latency of qlue under load. The
+`LoadTest` sends a mix of requests to the job endpoints of a `LoadTestServer`, which
+answers them from a thread of the same process, while a fake spooler works through the
+queue. Run it through the management command:
+
+    python manage.py benchmark_api --duration 30 --concurrency 16 --output run.json
+
+The report contains the requests per second, the percentiles of the latency and the CPU
+time per request, both for all requests and for each endpoint. Reports of different
+commits can be compared with `compare_reports`.
+"""
+import datetime
+import json
+import math
+import platform
+import random
+import socket
+import subprocess
+import threading
+import time
+import http.client
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import django
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+
+from .jobs import (
+    finished_jobs_dir,
+    make_job_id,
+    result_json_path,
+    status_json_path,
+)
+from .storage_providers import StorageProvider
+
+OPERATIONS = (
+    "post_job",
+    "get_job_status",
+    "get_job_result",
+    "get_next_job_in_queue",
+    "get_config",
+)
+# clients poll the status of their jobs far more often than they submit new ones
+DEFAULT_MIX = {
+    "post_job": 2.0,
+    "get_job_status": 10.0,
+    "get_job_result": 4.0,
+    "get_next_job_in_queue": 1.0,
+    "get_config": 1.0,
+}
+
+
+def sample_job(
+    backend_name: str, num_experiments: int = 1, shots: int = 100
+) -> Dict[str, dict]:
+    """
+    A typical job for one of the backends of the fixtures.
+
+    Args:
+        backend_name: "fermions", "singlequdit" or "multiqudit"
+        num_experiments: The number of experiments in the job
+        shots: The shots of each experiment
+
+    Returns:
+        The payload of the job as the clients submit it
+    """
+    if backend_name == "fermions":
+        num_wires = 8
+        instructions = [
+            ["load", [0], []],
+            ["load", [1], []],
+            ["load", [6], []],
+            ["fhop", [0, 1, 2, 3], [0.25]],
+            ["fint", [0, 1, 2, 3, 4, 5, 6, 7], [0.5]],
+            ["fphase", [0, 1], [0.1]],
+        ]
+    elif backend_name == "singlequdit":
+        num_wires = 1
+        instructions = [
+            ["load", [0], [50]],
+            ["rlx", [0], [0.5]],
+            ["rlz", [0], [0.3]],
+            ["rlz2", [0], [0.1]],
+        ]
+    elif backend_name == "multiqudit":
+        num_wires = 4
+        instructions = [["load", [wire], [20]] for wire in range(num_wires)]
+        instructions += [
+            ["rlx", [0], [0.5]],
+            ["rlxly", [0, 1], [0.2]],
+            ["rlz2", [2], [0.1]],
+        ]
+    else:
+        raise ValueError("There is no sample job for " + backend_name + "!")
+    instructions += [["measure", [wire], []] for wire in range(num_wires)]
+    return {
+        "experiment_"
+        + str(index): {
+            "instructions": instructions,
+            "num_wires": num_wires,
+            "shots": shots,
+            "wire_order": "interleaved",
+        }
+        for index in range(num_experiments)
+    }
+
+
+def sample_result(
+    backend_name: str, job_id: str, job_payload: dict, seed: int = 0
+) -> dict:
+    """
+    A result like the spooler writes it for a job of `sample_job`.
+
+    Args:
+        backend_name: The name of the backend
+        job_id: The id of the job
+        job_payload: The payload of the job
+        seed: The seed of the random outcomes
+
+    Returns:
+        The result with the shot memory of every experiment
+    """
+    rng = random.Random(seed)
+    results = []
+    for name, experiment in job_payload.items():
+        num_wires = experiment["num_wires"]
+        if backend_name == "fermions":
+            memory = [
+                " ".join(str(rng.randint(0, 1)) for _ in range(num_wires))
+                for _ in range(experiment["shots"])
+            ]
+        else:
+            memory = [
+                " ".join(str(rng.randint(0, 50)) for _ in range(num_wires))
+                for _ in range(experiment["shots"])
+            ]
+        results.append(
+            {
+                "header": {"name": name, "extra metadata": {}},
+                "shots": experiment["shots"],
+                "success": True,
+                "data": {"memory": memory},
+            }
+        )
+    return {
+        "backend_name": "synqs_" + backend_name + "_simulator",
+        "backend_version": "0.0.1",
+        "job_id": job_id,
+        "qobj_id": None,
+        "success": True,
+        "status": "finished",
+        "header": {},
+        "results": results,
+    }
+
+
+@contextmanager
+def throwaway_database(tmp_dir: str) -> Iterator[None]:
+    """
+    Replace the database by a test database with the backends of the fixtures for the
+    duration of a benchmark, such that the data of the deployment is never touched.
+
+    Args:
+        tmp_dir: The folder of the database if it is SQLite
+    """
+    connection = connections["default"]
+    if connection.vendor == "sqlite":
+        # the threads of the server cannot share an in-memory database, and they wait
+        # for each other instead of failing while one of them writes
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = (
+            tmp_dir + "/benchmark.sqlite3"
+        )
+        connection.settings_dict.setdefault("OPTIONS", {})["timeout"] = 30
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        call_command("loaddata", "backend.json", verbosity=0)
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """
+    Read the mix of requests from the command line.
+
+    Args:
+        spec: The weight of each operation like "post_job=1,get_job_status=10"
+
+    Returns:
+        The weight of each operation
+
+    Raises:
+        ValueError: If an operation is unknown or a weight is not a number.
+    """
+    mix = {}
+    for entry in spec.split(","):
+        operation, _, weight = entry.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation " + operation + "!")
+        mix[operation] = float(weight)
+    return mix
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    The nearest-rank percentile of sorted values, 0 if there are none.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> dict:
+    """
+    The throughput and the latency of a group of requests.
+
+    Args:
+        latencies: The duration of each request in seconds
+        errors: The number of requests that failed
+        seconds: The duration of the measurement
+
+    Returns:
+        The numbers as they are saved in the report, with latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / seconds if seconds else 0.0,
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": 1000 * percentile(latencies, 0.5),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+    }
+
+
+def compare_reports(baseline: dict, report: dict) -> List[str]:
+    """
+    Describe how the throughput and the tail latency changed between two reports.
+
+    Args:
+        baseline: The earlier report
+        report: The new report
+
+    Returns:
+        One line for all requests and one for each endpoint that is in both reports
+    """
+    pairs = [("total", baseline.get("total"), report.get("total"))]
+    for operation, numbers in report.get("operations", {}).items():
+        pairs.append(
+            (operation, baseline.get("operations", {}).get(operation), numbers)
+        )
+
+    def change(old: float, new: float) -> str:
+        if not old:
+            return "n/a"
+        return format(100 * (new - old) / old, "+.1f") + "%"
+
+    lines = []
+    for name, old, new in pairs:
+        if not old or not new:
+            continue
+        lines.append(
+            f"{name}: rps {old['rps']:.1f} -> {new['rps']:.1f} "
+            f"({change(old['rps'], new['rps'])}), p99 {old['p99_ms']:.1f} -> "
+            f"{new['p99_ms']:.1f} ms ({change(old['p99_ms'], new['p99_ms'])})"
+        )
+    return lines
+
+
+def current_commit() -> Optional[str]:
+    """
+    The git commit of the code that is measured, None outside of a git checkout.
+    """
+    # pylint: disable=W0702
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            timeout=10,
+        ).stdout.strip()
+    except:
+        return None
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """
+    The request handler that does not log every request of the load test.
+    """
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+class LoadTestServer:
+    """
+    The local server that answers the requests of the load test from a thread of this
+    process, such that it uses the storage and the database of the test.
+
+    Args:
+        kind: "wsgi" for the threaded server of django or "asgi" for uvicorn
+    """
+
+    def __init__(self, kind: str = "wsgi"):
+        self.kind = kind
+        self.url = ""
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "LoadTestServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start to answer requests on a free port.
+        """
+        if self.kind == "asgi":
+            # pylint: disable=C0415, E0401
+            import uvicorn
+            from django.core.asgi import get_asgi_application
+
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            self._server = uvicorn.Server(
+                uvicorn.Config(
+                    get_asgi_application(),
+                    host="127.0.0.1",
+                    port=port,
+                    log_level="warning",
+                    lifespan="off",
+                )
+            )
+            self._thread = threading.Thread(target=self._server.run, daemon=True)
+            self._thread.start()
+            while not self._server.started:
+                time.sleep(0.05)
+        elif self.kind == "wsgi":
+            self._server = ThreadedWSGIServer(
+                ("127.0.0.1", 0), _QuietRequestHandler, allow_reuse_address=False
+            )
+            self._server.set_app(WSGIHandler())
+            port = self._server.server_address[1]
+            self._thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True
+            )
+            self._thread.start()
+        else:
+            raise ValueError("Unknown server " + self.kind + "!")
+        self.url = "http://127.0.0.1:" + str(port)
+
+    def stop(self) -> None:
+        """
+        Stop the server.
+        """
+        if self._server is None:
+            return
+        if self.kind == "asgi":
+            self._server.should_exit = True
+        else:
+            self._server.shutdown()
+            self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+
+class LoadTest:
+    """
+    Clients that send a mix of requests to the job endpoints as fast as they can, while
+    a fake spooler obtains the queued jobs and finishes them right away.
+
+    Args:
+        url: The address of the server
+        storage_provider: The storage of the server, which the fake spooler writes to
+        backend_name: The backend that receives the jobs
+        credentials: The username and the password of the clients
+        spooler_password: The password of the user "spooler"
+        mix: The relative weight of each operation
+        api: "v1" for the api v1 or "legacy" for the views under /api/<backend>/.
+            `get_next_job_in_queue` only exists in the latter.
+        seed: The seed of the random choices for reproducible runs
+    """
+
+    # pylint: disable=R0902
+
+    def __init__(
+        self,
+        url: str,
+        storage_provider: StorageProvider,
+        backend_name: str,
+        credentials: Tuple[str, str],
+        spooler_password: str,
+        *,
+        mix: Dict[str, float] = None,
+        api: str = "v1",
+        seed: int = None,
+    ):
+        # pylint: disable=R0913
+        self.host, port = url.split("//")[1].split(":")
+        self.port = int(port)
+        self.storage_provider = storage_provider
+        self.backend_name = backend_name
+        self.username, self.password = credentials
+        self.spooler_password = spooler_password
+        self.mix = {op: weight for op, weight in (mix or DEFAULT_MIX).items() if weight}
+        self.api = api
+        self.seed = seed
+        self.queued_ids: List[str] = []
+        self.finished_ids: List[str] = []
+        self._lock = threading.Lock()
+        self._spooler_lock = threading.Lock()
+        self._job_str = json.dumps(sample_job(backend_name))
+
+    def prepare(self, num_jobs: int) -> None:
+        """
+        Write finished jobs to the storage, such that there are results to read from
+        the first request on.
+        """
+        job_payload = sample_job(self.backend_name)
+        for _ in range(num_jobs):
+            job_id = make_job_id(self.backend_name, self.username)
+            self.storage_provider.upload(
+                self._job_str,
+                finished_jobs_dir(self.backend_name, self.username)
+                + "job-"
+                + job_id
+                + ".json",
+            )
+            self._finish_job(job_id, job_payload)
+
+    def run(self, duration: float, concurrency: int, warmup: float = 0.0) -> dict:
+        """
+        Send requests from `concurrency` clients for `warmup` plus `duration` seconds.
+        Only the requests that start after the warmup are measured.
+
+        Returns:
+            The report with the numbers of all requests and of each operation
+        """
+        # pylint: disable=R0914
+        start = time.perf_counter()
+        measure_start = start + warmup
+        end = measure_start + duration
+        samples: List[Tuple[str, float, bool]] = []
+        client_cpu = [0.0]
+        workers = [
+            threading.Thread(
+                target=self._work,
+                args=(
+                    random.Random(None if self.seed is None else self.seed + index),
+                    measure_start,
+                    end,
+                    samples,
+                    client_cpu,
+                ),
+                daemon=True,
+            )
+            for index in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        time.sleep(max(0.0, measure_start - time.perf_counter()))
+        cpu_start = time.process_time()
+        for worker in workers:
+            worker.join()
+        server_cpu = max(0.0, time.process_time() - cpu_start - client_cpu[0])
+        seconds = time.perf_counter() - measure_start
+
+        total = summarize(
+            [latency for _, latency, _ in samples],
+            sum(1 for _, _, ok in samples if not ok),
+            seconds,
+        )
+        total["cpu_ms_per_request"] = (
+            1000 * server_cpu / total["requests"] if total["requests"] else 0.0
+        )
+        operations = {}
+        for operation in self.mix:
+            latencies = [lat for op, lat, _ in samples if op == operation]
+            errors = sum(1 for op, _, ok in samples if op == operation and not ok)
+            operations[operation] = summarize(latencies, errors, seconds)
+        return {
+            "meta": {
+                "date": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                "commit": current_commit(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "backend": self.backend_name,
+                "api": self.api,
+                "concurrency": concurrency,
+                "duration": duration,
+                "warmup": warmup,
+                "mix": self.mix,
+            },
+            "total": total,
+            "operations": operations,
+        }
+
+    def _work(
+        self,
+        rng: random.Random,
+        measure_start: float,
+        end: float,
+        samples: List[Tuple[str, float, bool]],
+        client_cpu: List[float],
+    ) -> None:
+        """
+        The loop of a single client.
+        """
+        # pylint: disable=R0913, R0914, W0702, R1732
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        operations = list(self.mix)
+        weights = [self.mix[op] for op in operations]
+        measured: List[Tuple[str, float, bool]] = []
+        cpu = 0.0
+        while time.perf_counter() < end:
+            operation = rng.choices(operations, weights)[0]
+            is_spooler = operation == "get_next_job_in_queue"
+            # a backend has a single spooler, which never asks twice at the same time
+            if is_spooler and not self._spooler_lock.acquire(blocking=False):
+                continue
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                succeeded, seconds = self._send(connection, operation, rng)
+            except:
+                connection.close()
+                succeeded, seconds = False, time.perf_counter() - start
+            finally:
+                if is_spooler:
+                    self._spooler_lock.release()
+            if start >= measure_start:
+                measured.append((operation, seconds, succeeded))
+                cpu += time.thread_time() - cpu_start
+        connection.close()
+        with self._lock:
+            samples.extend(measured)
+            client_cpu[0] += cpu
+
+    def _send(
+        self, connection: http.client.HTTPConnection, operation: str, rng: random.Random
+    ) -> Tuple[bool, float]:
+        """
+        Send a single request and handle its answer.
+
+        Returns:
+            True if the request succeeded and the duration of the request in seconds
+        """
+        if operation == "get_next_job_in_queue":
+            status, body, seconds = self._request(
+                connection,
+                "GET",
+                "/api/" + self.backend_name + "/get_next_job_in_queue/",
+                {"username": "spooler", "password": self.spooler_password},
+            )
+            if status == 200:
+                self._spool(json.loads(body))
+            # the view answers 406 without a job if the queue is empty
+            return (
+                status == 200
+                or (status == 406 and json.loads(body).get("job_id") == "None"),
+                seconds,
+            )
+
+        credentials = {"username": self.username, "password": self.password}
+        prefix = "/api/v1/" + self.backend_name + "/"
+        suffix = ""
+        if self.api == "legacy":
+            prefix = "/api/" + self.backend_name + "/"
+            suffix = "/"
+
+        if operation == "post_job":
+            status, body, seconds = self._request(
+                connection,
+                "POST",
+                prefix + "post_job" + suffix,
+                dict(credentials, json=self._job_str),
+            )
+            if status == 200:
+                with self._lock:
+                    self.queued_ids.append(json.loads(body)["job_id"])
+            return status == 200, seconds
+        if operation == "get_config":
+            params = credentials if self.api == "legacy" else {}
+            status, _, seconds = self._request(
+                connection, "GET", prefix + "get_config" + suffix, params
+            )
+            return status == 200, seconds
+
+        with self._lock:
+            job_ids = self.finished_ids
+            if operation == "get_job_status" and self.queued_ids:
+                job_ids = job_ids + self.queued_ids[-100:]
+            job_id = rng.choice(job_ids) if job_ids else "unknown"
+        if self.api == "legacy":
+            params = dict(credentials, json=json.dumps({"job_id": job_id}))
+        else:
+            params = dict(credentials, job_id=job_id)
+        status, _, seconds = self._request(
+            connection, "GET", prefix + operation + suffix, params
+        )
+        return status == 200, seconds
+
+    @staticmethod
+    def _request(
+        connection: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        params: Dict[str, str],
+    ) -> Tuple[int, bytes, float]:
+        """
+        Send a request over the kept-alive connection of a client.
+
+        Returns:
+            The status and the body of the answer and the duration of the request
+        """
+        start = time.perf_counter()
+        if method == "GET":
+            if params:
+                path += "?" + urlencode(params)
+            connection.request("GET", path)
+        else:
+            connection.request(
+                "POST",
+                path,
+                body=urlencode(params),
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+            )
+        response = connection.getresponse()
+        body = response.read()
+        seconds = time.perf_counter() - start
+        if response.will_close:
+            connection.close()
+        return response.status, body, seconds
+
+    def _spool(self, job_msg_dict: dict) -> None:
+        """
+        Finish the job that the spooler obtained right away, like a spooler with an
+        infinitely fast machine would.
+        """
+        job_id = job_msg_dict.get("job_id", "None")
+        if job_id == "None":
+            return
+        job_path = job_msg_dict["job_json"]
+        self.storage_provider.move_file(
+            job_path,
+            finished_jobs_dir(self.backend_name, job_id.split("-")[2])
+            + job_path.split("/")[-1],
+        )
+        self._finish_job(job_id, json.loads(self._job_str))
+
+    def _finish_job(self, job_id: str, job_payload: dict) -> None:
+        """
+        Write the result and the final status of a job.
+        """
+        self.storage_provider.upload(
+            json.dumps(sample_result(self.backend_name, job_id, job_payload)),
+            result_json_path(self.backend_name, job_id),
+        )
+        status_msg_dict = {
+            "job_id": job_id,
+            "status": "DONE",
+            "detail": "The job is done.",
+            "error_message": "None",
+        }
+        self.storage_provider.upload(
+            json.dumps(status_msg_dict), status_json_path(self.backend_name, job_id)
+        )
+        with self._lock:
+            self.finished_ids.append(job_id)
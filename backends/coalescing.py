@@ -0,0 +1,321 @@
+"""
+The module that merges several small queued jobs of a backend into a single batch for
+the spooler and splits the result of such a batch back onto the original jobs.
+
+A batch looks like any other job to the spooler. Its job id carries the
+`BATCH_USERNAME` instead of a real user, such that the spooler writes the status and
+the result of the batch into the folders of this pseudo user. A manifest in
+`/Backend_files/Batches/<backend>/` remembers which experiments belong to which of the
+original jobs, which are parked in `/Backend_files/Batched_Jobs/<backend>/` in the
+meantime.
+"""
+import json
+from typing import Dict, List, Tuple
+
+from .storage_providers import StorageProvider
+from .encodings import pack_result
+from .jobs import make_job_id, result_json_path, status_json_path
+
+BATCH_USERNAME = "_batch"
+MAX_JOBS_PER_BATCH = 50
+
+
+def merge_jobs(job_dicts: List[dict]) -> Tuple[dict, List[List[str]]]:
+    """
+    Merge several jobs into one job with consecutively numbered experiments.
+
+    Args:
+        job_dicts: The jobs that should be merged in the order of the batch
+
+    Returns:
+        the merged job and for each job the original names of its experiments
+    """
+    merged_dict = {}
+    experiment_names = []
+    for job_dict in job_dicts:
+        names = []
+        for exp_name, exp_dict in job_dict.items():
+            merged_dict["experiment_" + str(len(merged_dict))] = exp_dict
+            names.append(exp_name)
+        experiment_names.append(names)
+    return merged_dict, experiment_names
+
+
+def split_result(result_dict: dict, manifest: dict) -> Dict[str, dict]:
+    """
+    Split the result of a batch into the results of the original jobs.
+
+    Args:
+        result_dict: The result of the batch as it was written by the spooler
+        manifest: The manifest that was written when the batch was created
+
+    Returns:
+        A dict with the result dict of each original job, keyed by its job id
+    """
+    job_results = {}
+    offset = 0
+    for job_entry in manifest["jobs"]:
+        exp_results = []
+        for exp_name in job_entry["experiments"]:
+            # the spooler named the experiment after its place in the batch
+            exp_result = dict(result_dict["results"][offset])
+            exp_result["header"] = dict(exp_result.get("header") or {})
+            exp_result["header"]["name"] = exp_name
+            if "name" in exp_result:
+                exp_result["name"] = exp_name
+            exp_results.append(exp_result)
+            offset += 1
+        job_result = dict(result_dict)
+        job_result["job_id"] = job_entry["job_id"]
+        job_result["results"] = exp_results
+        job_results[job_entry["job_id"]] = job_result
+    return job_results
+
+
+def coalesce_queued_jobs(
+    storage_provider: StorageProvider, backend, job_list: List[str]
+) -> Tuple[dict, List[str]]:
+    """
+    Merge the first jobs of the queue into a batch, as long as the batch stays within
+    `max_experiments` of the backend. `max_shots` limits every experiment on its own,
+    so it does not limit the batch. The jobs are taken in queue order and the batch
+    ends at the first job that does not fit anymore.
+
+    The jobs are parked before the batch is written to the running jobs, such that the
+    spooler never gets a batch whose jobs are still queued. If the storage fails
+    before the batch is complete, its files are removed and the jobs go back into the
+    queue.
+
+    Args:
+        storage_provider: The storage that holds the queue
+        backend: The backend for which the queue should be coalesced
+        job_list: The names of the job files in the queue, in queue order
+
+    Returns:
+        The job_msg_dict of the batch for the spooler, which is empty if there was
+        nothing to coalesce, and the names of the job files that went into the batch.
+    """
+    # pylint: disable=R0914
+    queue_dir = "/Backend_files/Queued_Jobs/" + backend.name + "/"
+    selected_ids = []
+    job_dicts = []
+    num_experiments = 0
+    for job_json_name in job_list[:MAX_JOBS_PER_BATCH]:
+        try:
+            job_dict = json.loads(
+                storage_provider.get_file_content(
+                    storage_path=queue_dir + job_json_name
+                )
+            )
+        except FileNotFoundError:
+            # the job left the queue in the meantime
+            break
+        if num_experiments + len(job_dict) > backend.max_experiments:
+            break
+        selected_ids.append(job_json_name[4:-5])
+        job_dicts.append(job_dict)
+        num_experiments += len(job_dict)
+
+    if len(selected_ids) < 2:
+        return {}, []
+
+    batch_id = make_job_id(backend.name, BATCH_USERNAME)
+    merged_dict, experiment_names = merge_jobs(job_dicts)
+    manifest = {
+        "batch_id": batch_id,
+        "jobs": [
+            {"job_id": job_id, "experiments": names}
+            for job_id, names in zip(selected_ids, experiment_names)
+        ],
+    }
+    parked_ids = []
+    written_paths = []
+    batch_json_path = "/Backend_files/Running_Jobs/job-" + batch_id + ".json"
+    try:
+        for job_id in selected_ids:
+            storage_provider.move_file(
+                start_path=queue_dir + "job-" + job_id + ".json",
+                final_path=_batched_job_path(backend.name, job_id),
+            )
+            parked_ids.append(job_id)
+        batch_status = {
+            "job_id": batch_id,
+            "status": "INITIALIZING",
+            "detail": "Coalesced " + str(len(selected_ids)) + " jobs.",
+            "error_message": "None",
+        }
+        for dump_str, storage_path in (
+            (json.dumps(batch_status), status_json_path(backend.name, batch_id)),
+            (json.dumps(manifest), _manifest_path(backend.name, batch_id)),
+            (json.dumps(merged_dict), batch_json_path),
+        ):
+            # a write that failed may still have reached the storage
+            written_paths.append(storage_path)
+            storage_provider.upload(dump_str=dump_str, storage_path=storage_path)
+    except OSError:
+        _undo_batch(storage_provider, backend.name, parked_ids, written_paths)
+        raise
+
+    # the statuses only tell the users about the batch, which is split without them
+    try:
+        for job_id in selected_ids:
+            job_status = {
+                "job_id": job_id,
+                "status": "INITIALIZING",
+                "detail": "Got your json.; Coalesced into batch " + batch_id + ".",
+                "error_message": "None",
+                "batch_id": batch_id,
+            }
+            storage_provider.upload(
+                dump_str=json.dumps(job_status),
+                storage_path=status_json_path(backend.name, job_id),
+            )
+    except OSError:
+        pass
+    return {"job_id": batch_id, "job_json": batch_json_path}, [
+        "job-" + job_id + ".json" for job_id in selected_ids
+    ]
+
+
+def _undo_batch(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    parked_ids: List[str],
+    written_paths: List[str],
+) -> None:
+    """
+    Remove the files of a batch that could not be created and put its jobs back into
+    the queue, where the next request of the spooler finds them again. Every step is
+    tried, even if the storage fails on an earlier one.
+    """
+    for storage_path in reversed(written_paths):
+        try:
+            storage_provider.delete_file(storage_path)
+        except OSError:
+            pass
+    for job_id in parked_ids:
+        try:
+            storage_provider.move_file(
+                start_path=_batched_job_path(backend_name, job_id),
+                final_path="/Backend_files/Queued_Jobs/"
+                + backend_name
+                + "/job-"
+                + job_id
+                + ".json",
+            )
+        except OSError:
+            pass
+
+
+def split_finished_batches(storage_provider: StorageProvider, backend_name: str) -> int:
+    """
+    Split every batch of the backend that the spooler has finished. The status, result
+    and job files of the jobs in the batch are written to the places the spooler would
+    have used. It is only called by the spooler once it has no running job anymore,
+    such that no two requests split the same batch.
+
+    Args:
+        storage_provider: The storage that holds the batches
+        backend_name: The name of the backend
+
+    Returns:
+        The number of batches that were split
+    """
+    try:
+        manifest_list = storage_provider.get_file_queue(
+            "/Backend_files/Batches/" + backend_name
+        )
+    except FileNotFoundError:
+        return 0
+    num_split = 0
+    for manifest_name in manifest_list:
+        batch_id = manifest_name[6:-5]
+        try:
+            batch_status = json.loads(
+                storage_provider.get_file_content(
+                    storage_path=status_json_path(backend_name, batch_id)
+                )
+            )
+        except FileNotFoundError:
+            # the batch was never handed to the spooler, see `_undo_batch`
+            storage_provider.delete_file(_manifest_path(backend_name, batch_id))
+            continue
+        if batch_status["status"] in ("DONE", "ERROR"):
+            _split_batch(storage_provider, backend_name, batch_status)
+            num_split += 1
+    return num_split
+
+
+def _split_batch(
+    storage_provider: StorageProvider, backend_name: str, batch_status: dict
+) -> None:
+    """
+    Hand the outcome of a finished batch to its jobs. The manifest is removed last,
+    such that a split that failed halfway is simply repeated.
+    """
+    batch_id = batch_status["job_id"]
+    manifest = json.loads(
+        storage_provider.get_file_content(
+            storage_path=_manifest_path(backend_name, batch_id)
+        )
+    )
+    job_results = {}
+    if batch_status["status"] == "DONE":
+        result_dict = json.loads(
+            storage_provider.get_file_content(
+                storage_path=result_json_path(backend_name, batch_id)
+            )
+        )
+        job_results = split_result(result_dict, manifest)
+
+    for job_entry in manifest["jobs"]:
+        job_id = job_entry["job_id"]
+        if job_id in job_results:
+            storage_provider.upload(
+                dump_str=json.dumps(pack_result(job_results[job_id])),
+                storage_path=result_json_path(backend_name, job_id),
+            )
+            final_path = (
+                "/Backend_files/Finished_Jobs/"
+                + backend_name
+                + "/"
+                + job_id.split("-")[2]
+                + "/job-"
+                + job_id
+                + ".json"
+            )
+        else:
+            final_path = "/Backend_files/Deleted_Jobs/job-" + job_id + ".json"
+        try:
+            storage_provider.move_file(
+                start_path=_batched_job_path(backend_name, job_id),
+                final_path=final_path,
+            )
+        except FileNotFoundError:
+            # an earlier attempt moved it already
+            pass
+        new_status = {
+            "job_id": job_id,
+            "status": batch_status["status"],
+            "detail": batch_status.get("detail", "None"),
+            "error_message": batch_status.get("error_message", "None"),
+        }
+        storage_provider.upload(
+            dump_str=json.dumps(new_status),
+            storage_path=status_json_path(backend_name, job_id),
+        )
+    storage_provider.delete_file(_manifest_path(backend_name, batch_id))
+
+
+def _manifest_path(backend_name: str, batch_id: str) -> str:
+    """
+    The path of the manifest of a batch.
+    """
+    return "/Backend_files/Batches/" + backend_name + "/batch-" + batch_id + ".json"
+
+
+def _batched_job_path(backend_name: str, job_id: str) -> str:
+    """
+    The path where a job file is parked while its batch is processed.
+    """
+    return "/Backend_files/Batched_Jobs/" + backend_name + "/job-" + job_id + ".json"
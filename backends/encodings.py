@@ -0,0 +1,253 @@
+"""
+The module that encodes jobs and results in the formats that clients can negotiate.
+JSON is always available. MessagePack and CBOR are offered if `msgpack` or `cbor2`
+are installed.
+
+It also contains the compact form of the shot memory of a result. Instead of a list of
+strings with one string per shot, the memory is stored as packed array of integers,
+which is much smaller and faster to parse.
+"""
+import base64
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.http import HttpResponse
+
+from .metrics import timed_phase
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# pylint: disable=E1101
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+CBOR_MEDIA_TYPE = "application/cbor"
+
+# the functions that encode and decode each available media type
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    JSON_MEDIA_TYPE: (lambda data: json.dumps(data).encode("utf-8"), json.loads)
+}
+if msgpack is not None:
+    CODECS[MSGPACK_MEDIA_TYPE] = (msgpack.packb, msgpack.unpackb)
+    CODECS["application/x-msgpack"] = CODECS[MSGPACK_MEDIA_TYPE]
+if cbor2 is not None:
+    CODECS[CBOR_MEDIA_TYPE] = (cbor2.dumps, cbor2.loads)
+
+UNACCEPTABLE_MESSAGE = "Results are only available as " + ", ".join(CODECS) + "!"
+
+# the marker of a packed shot memory
+PACKED_MEMORY = "packed"
+
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """
+    Choose the media type of the response from the `Accept` header of the request.
+
+    Args:
+        accept: The value of the header, None if the request has none
+
+    Returns:
+        The available media type with the highest quality, JSON if the client accepts
+        anything and None if no available media type is acceptable.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    candidates = []
+    for position, media_range in enumerate(accept.split(",")):
+        parts = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, position, parts[0].lower()))
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("*/*", "application/*"):
+            return JSON_MEDIA_TYPE
+        if media_type in CODECS:
+            return media_type
+    return None
+
+
+def encoded_response(data: Any, media_type: str, status: int = 200) -> HttpResponse:
+    """
+    The response that sends the data in the negotiated media type.
+
+    Args:
+        data: The dict or list that is sent
+        media_type: One of the media types in `CODECS`
+        status: The html status of the response
+
+    Returns:
+        The response
+    """
+    encode = CODECS[media_type][0]
+    with timed_phase("serialize"):
+        content = encode(data)
+    return HttpResponse(content, content_type=media_type, status=status)
+
+
+def decode_payload(content: bytes, media_type: Optional[str]) -> Any:
+    """
+    Decode a job that was submitted in one of the available media types.
+
+    Args:
+        content: The submitted bytes
+        media_type: The media type of the content. JSON if it is not given.
+
+    Returns:
+        The decoded job
+
+    Raises:
+        ValueError: If the media type is not available or the content cannot be
+            decoded.
+    """
+    media_type = (media_type or JSON_MEDIA_TYPE).split(";")[0].strip().lower()
+    if media_type not in CODECS:
+        raise ValueError("The media type " + media_type + " is not supported!")
+    try:
+        return CODECS[media_type][1](content)
+    except Exception as err:
+        # every codec raises its own exceptions
+        raise ValueError("Could not decode the " + media_type + " payload!") from err
+
+
+def memory_array(memory: List[str]) -> Optional[Tuple[np.ndarray, str]]:
+    """
+    Parse the shot memory of an experiment into an array of integers.
+
+    Args:
+        memory: The outcome of each shot, either as string of digits like "0110" or as
+            string of integers that are separated by spaces like "0 1 2 0"
+
+    Returns:
+        The array with one row per shot and the separator of the strings, or None if
+        the memory has another format
+    """
+    if not memory or not all(isinstance(shot, str) for shot in memory):
+        return None
+    separator = " " if " " in memory[0] else ""
+    try:
+        if separator:
+            rows = [[int(value) for value in shot.split(separator)] for shot in memory]
+        else:
+            rows = [[int(value) for value in shot] for shot in memory]
+        array = np.array(rows)
+    except ValueError:
+        return None
+    if array.ndim != 2 or array.size == 0 or array.min() < 0:
+        return None
+    return array, separator
+
+
+def pack_memory(memory: List[str]) -> Optional[dict]:
+    """
+    Pack the shot memory of an experiment into an array of integers.
+
+    Args:
+        memory: The outcome of each shot in one of the formats of `memory_array`
+
+    Returns:
+        The packed memory or None if the memory has another format
+    """
+    parsed = memory_array(memory)
+    if parsed is None:
+        return None
+    array, separator = parsed
+    dtype = np.min_scalar_type(array.max())
+    return {
+        "encoding": PACKED_MEMORY,
+        "dtype": dtype.str,
+        "shape": list(array.shape),
+        "separator": separator,
+        "data": base64.b64encode(array.astype(dtype).tobytes()).decode("ascii"),
+    }
+
+
+def unpack_array(packed: dict) -> np.ndarray:
+    """
+    The array of integers with one row per shot of a packed memory.
+    """
+    return np.frombuffer(
+        base64.b64decode(packed["data"]), dtype=np.dtype(packed["dtype"])
+    ).reshape(packed["shape"])
+
+
+def unpack_memory(packed: dict) -> List[str]:
+    """
+    Restore the list of strings of a packed shot memory.
+
+    Args:
+        packed: The memory as it was packed by `pack_memory`
+
+    Returns:
+        The outcome of each shot in its original format
+    """
+    separator = packed["separator"]
+    return [separator.join(map(str, row)) for row in unpack_array(packed).tolist()]
+
+
+def pack_result(result_dict: dict) -> dict:
+    """
+    Pack the shot memory of every experiment of a result.
+
+    Args:
+        result_dict: The result as it was written by the spooler
+
+    Returns:
+        A copy of the result in which every memory that could be packed is packed
+    """
+    packed_result = dict(result_dict)
+    packed_result["results"] = []
+    for exp_result in result_dict.get("results", []):
+        memory = exp_result.get("data", {}).get("memory")
+        packed = pack_memory(memory) if isinstance(memory, list) else None
+        if packed is not None:
+            exp_result = dict(exp_result)
+            exp_result["data"] = dict(exp_result["data"], memory=packed)
+        packed_result["results"].append(exp_result)
+    return packed_result
+
+
+def unpack_result(result_dict: dict) -> dict:
+    """
+    Restore the shot memory of every experiment of a result.
+
+    Args:
+        result_dict: The result, possibly with packed memories
+
+    Returns:
+        The result with every memory as list of strings
+    """
+    if not any(is_packed(exp_result) for exp_result in result_dict.get("results", [])):
+        return result_dict
+    unpacked_result = dict(result_dict)
+    unpacked_result["results"] = []
+    for exp_result in result_dict["results"]:
+        if is_packed(exp_result):
+            exp_result = dict(exp_result)
+            exp_result["data"] = dict(
+                exp_result["data"], memory=unpack_memory(exp_result["data"]["memory"])
+            )
+        unpacked_result["results"].append(exp_result)
+    return unpacked_result
+
+
+def is_packed(exp_result: dict) -> bool:
+    """
+    Is the shot memory of the result of an experiment packed ?
+    """
+    memory = exp_result.get("data", {}).get("memory") if exp_result else None
+    return isinstance(memory, dict) and memory.get("encoding") == PACKED_MEMORY
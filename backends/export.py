@@ -0,0 +1,173 @@
+"""
+The module that exports the jobs of a user as a single ZIP archive. Every job has its own
+folder in the archive:
+
+    <job_id>/job.json
+    <job_id>/status.json
+    <job_id>/result.json
+
+together with a `manifest.json` that lists the files of each job and the jobs that could
+not be read. The archive is streamed: each job is compressed and sent as soon as it was
+read, while only a few jobs are read from the storage at the same time. The server
+therefore holds a few jobs in memory instead of the whole archive.
+"""
+import json
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .archive import collect_job, load_bundle_entry
+from .encodings import unpack_result
+from .jobs import finished_jobs_dir
+from .storage_providers import StorageProvider
+
+EXPORT_MEDIA_TYPE = "application/zip"
+# the number of jobs that are read from the storage at the same time
+MAX_PARALLEL_EXPORTS = 8
+
+
+def export_job_files(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    job_id: str,
+    bundle_path: Optional[str] = None,
+) -> List[Tuple[str, bytes]]:
+    """
+    Read the payload, the status and the result of a finished job.
+
+    Args:
+        storage_provider: The storage of the job
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        bundle_path: The bundle of the job if it is archived
+
+    Returns:
+        The name and the content of each file of the job in the archive. Files that
+        do not exist are left out.
+    """
+    if bundle_path is not None:
+        entry = load_bundle_entry(storage_provider, bundle_path, job_id)
+    else:
+        job_path = (
+            finished_jobs_dir(backend_name, job_id.split("-")[2])
+            + "job-"
+            + job_id
+            + ".json"
+        )
+        entry = collect_job(storage_provider, backend_name, job_id, job_path)[0]
+
+    files = []
+    if entry.get("job") is not None:
+        files.append(("job.json", entry["job"].encode("utf-8")))
+    if entry.get("status") is not None:
+        files.append(("status.json", json.dumps(entry["status"]).encode("utf-8")))
+    if entry.get("result") is not None:
+        result_dict = unpack_result(entry["result"])
+        files.append(("result.json", json.dumps(result_dict).encode("utf-8")))
+    return files
+
+
+class _StreamBuffer:
+    """
+    The file to which the ZIP archive is written. It cannot seek, such that zipfile
+    writes every entry in a single pass, and it hands out what was written so far.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        """
+        Keep the data until it is sent.
+        """
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        """
+        Nothing to do, the data is sent by `drain`.
+        """
+
+    def drain(self) -> bytes:
+        """
+        Take the data that was written since the last call.
+        """
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_export(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    job_ids: List[str],
+    bundles: Dict[str, str],
+) -> Iterator[bytes]:
+    """
+    Stream the ZIP archive with the given jobs.
+
+    Up to `MAX_PARALLEL_EXPORTS` jobs are read at the same time, while the jobs that
+    were read are written to the archive in the order of `job_ids`. The reads that did
+    not start yet are dropped if the client goes away.
+
+    Args:
+        storage_provider: The storage of the jobs
+        backend_name: The name of the backend of the jobs
+        job_ids: The ids of the jobs
+        bundles: The bundle of each archived job as in `archived_bundles`
+
+    Yields:
+        The archive piece by piece, one piece for each job
+    """
+    # pylint: disable=R0914
+    manifest = {"backend": backend_name, "jobs": []}
+    executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_EXPORTS)
+    pending = deque()
+    remaining = iter(job_ids)
+    buffer = _StreamBuffer()
+
+    def submit_next() -> None:
+        job_id = next(remaining, None)
+        if job_id is not None:
+            pending.append(
+                (
+                    job_id,
+                    executor.submit(
+                        export_job_files,
+                        storage_provider,
+                        backend_name,
+                        job_id,
+                        bundles.get(job_id),
+                    ),
+                )
+            )
+
+    try:
+        for _ in range(MAX_PARALLEL_EXPORTS):
+            submit_next()
+        with zipfile.ZipFile(
+            buffer, mode="w", compression=zipfile.ZIP_DEFLATED
+        ) as zip_file:
+            while pending:
+                job_id, future = pending.popleft()
+                submit_next()
+                job_entry = {"job_id": job_id, "files": []}
+                # pylint: disable=W0702
+                try:
+                    files = future.result()
+                except:
+                    files = []
+                    job_entry["error"] = "Could not read the job from the storage!"
+                for name, content in files:
+                    zip_file.writestr(job_id + "/" + name, content)
+                    job_entry["files"].append(name)
+                manifest["jobs"].append(job_entry)
+                yield buffer.drain()
+            zip_file.writestr("manifest.json", json.dumps(manifest, indent=2))
+        yield buffer.drain()
+    finally:
+        # the reads that did not start yet are not needed after a failure
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,151 @@
+"""
+The module that makes job submissions idempotent. A client may send an
+`Idempotency-Key` header with a submission. The first submission with a key claims it
+in the database and stores its answer, while every retry with the same key gets this
+answer back without touching the storage. The key also remembers a fingerprint of the
+backend and the payload, such that a different request with a reused key is rejected
+instead of being answered with the wrong job.
+"""
+import datetime
+import hashlib
+import json
+import random
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .jobs import error_response, new_job_response
+from .models import IdempotencyKey
+
+# pylint: disable=E1101
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# the length of the key column of `IdempotencyKey`
+MAX_KEY_LENGTH = 255
+# the time for which the answer to a submission is kept
+IDEMPOTENCY_TTL = datetime.timedelta(hours=24)
+# the time after which a submission that never finished gives its key free again
+IDEMPOTENCY_LOCK_TIMEOUT = datetime.timedelta(minutes=5)
+# the share of the claims that also remove the expired keys of all users
+IDEMPOTENCY_PURGE_RATE = 0.01
+
+
+def request_fingerprint(backend_name: str, payload: str) -> str:
+    """
+    The fingerprint of a submission, which tells whether a retry sends the same
+    request as the submission that claimed the key.
+
+    Args:
+        backend_name: The backend to which the job is submitted
+        payload: The submitted job(s) as json string
+
+    Returns:
+        The hex digest of the SHA-256 of the backend and the payload
+    """
+    return hashlib.sha256(
+        backend_name.encode("utf-8") + b"\n" + payload.encode("utf-8")
+    ).hexdigest()
+
+
+def purge_idempotency_keys() -> int:
+    """
+    Remove the keys whose answer is not kept anymore.
+
+    Returns:
+        The number of removed keys
+    """
+    num_deleted, _ = IdempotencyKey.objects.filter(
+        created__lt=timezone.now() - IDEMPOTENCY_TTL
+    ).delete()
+    return num_deleted
+
+
+def claim_idempotency_key(
+    username: str, key: str, fingerprint: str
+) -> Optional[JsonResponse]:
+    """
+    Claim the idempotency key for a new submission of the user.
+
+    Args:
+        username: The user that submits the job
+        key: The idempotency key of the submission
+        fingerprint: The `request_fingerprint` of the submission
+
+    Returns:
+        None if the submission should go ahead. Otherwise the answer to the earlier
+        submission with the same key, or an error if it is still in progress or was a
+        different request.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        return error_response(
+            new_job_response(), "The Idempotency-Key is too long!", 406
+        )
+    # a sample of the claims keeps the table small, the others only touch their key
+    if random.random() < IDEMPOTENCY_PURGE_RATE:
+        purge_idempotency_keys()
+    now = timezone.now()
+    expired = Q(created__lt=now - IDEMPOTENCY_TTL) | Q(
+        response__isnull=True, created__lt=now - IDEMPOTENCY_LOCK_TIMEOUT
+    )
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    username=username, key=key, fingerprint=fingerprint, created=now
+                )
+            return None
+        except IntegrityError:
+            pass
+        # an expired key is given free, such that the second attempt can claim it
+        num_deleted, _ = IdempotencyKey.objects.filter(
+            expired, username=username, key=key
+        ).delete()
+        if not num_deleted:
+            break
+
+    earlier = IdempotencyKey.objects.filter(username=username, key=key).first()
+    # the keys from before the fingerprints were stored match every request
+    if earlier is not None and earlier.fingerprint not in ("", fingerprint):
+        return error_response(
+            new_job_response(),
+            "The Idempotency-Key was already used for a different request!",
+            422,
+        )
+    if earlier is None:
+        # the earlier submission failed in the meantime, so the client may retry
+        return error_response(
+            new_job_response(),
+            "A submission with this Idempotency-Key just failed, please retry!",
+            409,
+        )
+    if earlier.response is None:
+        return error_response(
+            new_job_response(),
+            "A submission with this Idempotency-Key is still in progress!",
+            409,
+        )
+    response = JsonResponse(earlier.response)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def settle_idempotency_key(
+    username: str, key: str, response: Optional[JsonResponse]
+) -> None:
+    """
+    Store the answer to a successful submission under its idempotency key. The key is
+    given free if the submission failed, such that the client can retry it.
+
+    Args:
+        username: The user that submitted the job
+        key: The idempotency key of the submission
+        response: The answer to the submission, None if it raised an exception
+    """
+    claimed = IdempotencyKey.objects.filter(username=username, key=key)
+    if response is not None and response.status_code == 200:
+        claimed.update(response=json.loads(response.content))
+    else:
+        claimed.delete()
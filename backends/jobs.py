@@ -0,0 +1,412 @@
+"""
+The module that contains the steps in the life of a job which are shared between the
+views and the asynchronous api_v1. Nothing in here talks to the storage, such that every
+api can access the storage in its own way.
+"""
+import datetime
+import json
+import math
+import uuid
+from typing import List, Optional, Tuple
+
+from django.contrib.auth import authenticate
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .admission import check_admission, take_submit_token
+from .metrics import timed_phase
+from .models import Backend, QueueEntry, WebhookDelivery
+from .profiling import record_authenticated_user
+from .queue_stats import (
+    estimated_start,
+    get_queue_stats,
+    record_completion,
+    record_dequeue,
+    record_enqueue,
+)
+from .scheduling import SchedulingPolicy, get_scheduling_policy
+from .storage_providers import StorageUnavailable
+from .tracing import (
+    current_trace_id,
+    current_traceparent,
+    enabled,
+    format_traceparent,
+    new_span_id,
+    parse_traceparent,
+    record_span,
+)
+from .validation import validate_job
+
+# pylint: disable=E1101
+
+# the largest number of jobs that can be submitted in a single request
+MAX_JOBS_PER_SUBMISSION = 1000
+
+
+def new_job_response() -> dict:
+    """
+    The empty answer to a request about a job. It has the id of the trace of the
+    request if tracing is on.
+    """
+    job_response_dict = {
+        "job_id": "None",
+        "status": "None",
+        "detail": "None",
+        "error_message": "None",
+    }
+    trace_id = current_trace_id()
+    if trace_id is not None:
+        job_response_dict["trace_id"] = trace_id
+    return job_response_dict
+
+
+def error_response(job_response_dict: dict, message: str, status: int) -> JsonResponse:
+    """
+    Turn the answer into an error with the given message.
+
+    Args:
+        job_response_dict: The answer to the request
+        message: The description of the error
+        status: The html status of the response
+
+    Returns:
+        The response that can be sent to the user
+    """
+    job_response_dict["status"] = "ERROR"
+    job_response_dict["detail"] = message
+    job_response_dict["error_message"] = message
+    return JsonResponse(job_response_dict, status=status)
+
+
+def unavailable_response(
+    job_response_dict: dict, err: StorageUnavailable
+) -> JsonResponse:
+    """
+    Tell the user that the storage is unavailable and when to try again.
+
+    Args:
+        job_response_dict: The answer to the request
+        err: The error of the storage
+
+    Returns:
+        The response with status 503 and the header `Retry-After`
+    """
+    response = error_response(
+        job_response_dict, "The storage is unavailable: " + str(err), 503
+    )
+    response["Retry-After"] = str(max(1, math.ceil(err.retry_after)))
+    return response
+
+
+def check_credentials(
+    backend_name: str, username: str, password: str
+) -> Tuple[dict, int]:
+    """
+    Check that the user is known and that the backend exists.
+
+    Args:
+        backend_name: The backend we would like to use
+        username: The name of the user
+        password: The password of the user
+
+    Returns:
+        status, json_dict that has the appropiate answers
+    """
+    job_response_dict = new_job_response()
+    with timed_phase("auth"):
+        user = authenticate(username=username, password=password)
+    record_authenticated_user(user)
+
+    if user is None:
+        job_response_dict["status"] = "ERROR"
+        job_response_dict["error_message"] = "Invalid credentials!"
+        job_response_dict["detail"] = "Invalid credentials!"
+        return job_response_dict, 401
+
+    try:
+        with timed_phase("db"):
+            _ = Backend.objects.get(name=backend_name)
+    except Backend.DoesNotExist:
+        job_response_dict["status"] = "ERROR"
+        job_response_dict["detail"] = "Unknown back-end!"
+        job_response_dict["error_message"] = "Unknown back-end!"
+        return job_response_dict, 404
+    return job_response_dict, 200
+
+
+def make_job_id(backend_name: str, username: str) -> str:
+    """
+    Create the id of a new job. It starts with the time of the submission, followed by
+    the backend, the user and some random characters.
+    """
+    return (
+        (datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S"))
+        + "-"
+        + backend_name
+        + "-"
+        + username
+        + "-"
+        + (uuid.uuid4().hex)[:5]
+    )
+
+
+def queued_job_path(backend_name: str, job_id: str) -> str:
+    """
+    The path of the job file while the job is queued.
+    """
+    return "/Backend_files/Queued_Jobs/" + backend_name + "/job-" + job_id + ".json"
+
+
+def status_json_path(backend_name: str, job_id: str) -> str:
+    """
+    The path of the status file of a job.
+    """
+    return (
+        "/Backend_files/Status/"
+        + backend_name
+        + "/"
+        + job_id.split("-")[2]
+        + "/status-"
+        + job_id
+        + ".json"
+    )
+
+
+def result_json_path(backend_name: str, job_id: str) -> str:
+    """
+    The path of the result file of a job.
+    """
+    return (
+        "/Backend_files/Result/"
+        + backend_name
+        + "/"
+        + job_id.split("-")[2]
+        + "/result-"
+        + job_id
+        + ".json"
+    )
+
+
+def finished_jobs_dir(backend_name: str, username: str) -> str:
+    """
+    The folder of the finished jobs of a user.
+    """
+    return "/Backend_files/Finished_Jobs/" + backend_name + "/" + username + "/"
+
+
+def admit_job(
+    backend: Backend, username: str, job_response_dict: dict, job_str: str
+) -> Optional[JsonResponse]:
+    """
+    Check that the backend accepts the job right now and that it can run it.
+
+    Args:
+        backend: The backend to which the job is submitted
+        username: The user that submits the job
+        job_response_dict: The answer to the submission
+        job_str: The job as json string
+
+    Returns:
+        None if the job is accepted and the response with the error otherwise
+    """
+    rejection = check_admission(backend, username)
+    if rejection is not None:
+        response = error_response(job_response_dict, rejection[0], 429)
+        response["Retry-After"] = str(rejection[1])
+        return response
+    try:
+        validation_error = validate_job(backend, json.loads(job_str))
+    except json.JSONDecodeError:
+        validation_error = "Error loading json data from input request!"
+    if validation_error is not None:
+        return error_response(job_response_dict, validation_error, 406)
+    return None
+
+
+def prepare_jobs(backend: Backend, username: str, job_list: list) -> List[dict]:
+    """
+    Validate the jobs of a batch submission and give an id to every valid job.
+
+    Args:
+        backend: The backend to which the jobs are submitted
+        username: The user that submits the jobs
+        job_list: The jobs
+
+    Returns:
+        The answer for each job. The valid jobs are "INITIALIZING" and have a job id,
+        the invalid ones are "ERROR" and describe the problem.
+    """
+    job_responses = []
+    job_ids = set()
+    for job_dict in job_list:
+        job_response_dict = new_job_response()
+        validation_error = validate_job(backend, job_dict)
+        if validation_error is not None:
+            job_response_dict["status"] = "ERROR"
+            job_response_dict["detail"] = validation_error
+            job_response_dict["error_message"] = validation_error
+        else:
+            # many jobs are submitted within the same second, so the random part of
+            # the id has to be unique within the batch
+            job_id = make_job_id(backend.name, username)
+            while job_id in job_ids:
+                job_id = make_job_id(backend.name, username)
+            job_ids.add(job_id)
+            job_response_dict["job_id"] = job_id
+            job_response_dict["status"] = "INITIALIZING"
+            job_response_dict["detail"] = "Got your json."
+        job_responses.append(job_response_dict)
+    return job_responses
+
+
+def register_job(
+    backend: Backend,
+    username: str,
+    job_id: str,
+    callback: Optional[Tuple[str, str]] = None,
+) -> Optional[str]:
+    """
+    Put a job that was stored into the queue of the backend.
+
+    Args:
+        backend: The backend of the job
+        username: The user that submitted the job
+        job_id: The id of the job
+        callback: The url and the secret of the notification about the finished job,
+            as in `webhooks.resolve_callback`
+
+    Returns:
+        The estimated start of the job
+    """
+    start = _enqueue_job(backend, username, job_id, callback)
+    _use_submit_tokens(backend, username, 1)
+    return start
+
+
+def register_jobs(
+    backend: Backend,
+    username: str,
+    job_ids: List[str],
+    callback: Optional[Tuple[str, str]] = None,
+) -> List[Optional[str]]:
+    """
+    Put the jobs of a batch submission into the queue of the backend.
+
+    Args:
+        backend: The backend of the jobs
+        username: The user that submitted the jobs
+        job_ids: The ids of the jobs that were stored
+        callback: The callback of every job as in `register_job`
+
+    Returns:
+        The estimated start of each job
+    """
+    with transaction.atomic():
+        starts = [
+            _enqueue_job(backend, username, job_id, callback) for job_id in job_ids
+        ]
+    _use_submit_tokens(backend, username, len(job_ids))
+    return starts
+
+
+def _enqueue_job(
+    backend: Backend,
+    username: str,
+    job_id: str,
+    callback: Optional[Tuple[str, str]],
+) -> Optional[str]:
+    """
+    Put a job into the queue and remember its callback.
+    """
+    policy = get_scheduling_policy(backend)
+    queue_entry = policy.enqueue(backend, username, job_id, current_traceparent())
+    record_enqueue(backend)
+    if callback is not None:
+        WebhookDelivery.objects.create(
+            job_id=job_id,
+            backend=backend,
+            username=username,
+            url=callback[0],
+            secret=callback[1],
+        )
+    return estimated_start(get_queue_stats(backend), policy.jobs_ahead(queue_entry))
+
+
+def _use_submit_tokens(backend: Backend, username: str, num_jobs: int) -> None:
+    """
+    Take a token for every stored job of a submission. A submission that was rejected
+    or failed does not count towards the rate of the user.
+    """
+    if backend.submit_rate and num_jobs:
+        take_submit_token(backend, username, num_jobs)
+
+
+def dequeue_jobs(
+    policy: SchedulingPolicy,
+    backend: Backend,
+    job_json_names: List[str],
+    running_id: str,
+) -> str:
+    """
+    Take the jobs out of the queue once the spooler obtained them. The time that the
+    traced jobs spent in the queue becomes their `job.queued` span and their
+    `job.running` span starts.
+
+    Args:
+        policy: The scheduling policy of the backend
+        backend: The backend of the jobs
+        job_json_names: The names of the job files
+        running_id: The id of the job that the spooler works on now, as in
+            `record_dequeue`
+
+    Returns:
+        The `traceparent` under which the spooler reports the spans of the running job
+        or an empty string if it is not traced
+    """
+    job_ids = [name[4:-5] for name in job_json_names]
+    queued_traces = []
+    if enabled():
+        queued_traces = list(
+            QueueEntry.objects.filter(backend=backend, job_id__in=job_ids)
+            .exclude(traceparent="")
+            .values_list("job_id", "traceparent", "enqueued")
+        )
+    policy.dequeue(backend, job_json_names)
+    now = timezone.now().timestamp()
+    running_traces = []
+    for job_id, traceparent, enqueued in queued_traces:
+        attributes = {"qlue.job_id": job_id, "qlue.backend": backend.name}
+        record_span("job.queued", traceparent, enqueued.timestamp(), now, attributes)
+        running_traces.append([job_id, traceparent, new_span_id()])
+    record_dequeue(backend, running_id, job_ids, running_traces)
+    if not running_traces:
+        return ""
+    _, traceparent, span_id = running_traces[0]
+    return format_traceparent(parse_traceparent(traceparent)[0], span_id)
+
+
+def annotate_status(backend_name: str, status_msg_dict: dict) -> dict:
+    """
+    Keep the statistics of the queue up to date with the status of a job and add the
+    estimated start if the job is still queued.
+
+    Args:
+        backend_name: The name of the backend of the job
+        status_msg_dict: The status of the job as it was stored
+
+    Returns:
+        The status that is sent to the user
+    """
+    backend = Backend.objects.get(name=backend_name)
+    job_id = status_msg_dict["job_id"]
+    if status_msg_dict["status"] in ("DONE", "ERROR"):
+        record_completion(backend, [job_id])
+    else:
+        queue_entry = QueueEntry.objects.filter(job_id=job_id).first()
+        if queue_entry is not None:
+            status_msg_dict["estimated_start"] = estimated_start(
+                get_queue_stats(backend),
+                get_scheduling_policy(backend).jobs_ahead(queue_entry),
+            )
+    return status_msg_dict
@@ -0,0 +1,68 @@
+"""
+The command that packs the old jobs of the backends into archive bundles. Run it once,
+e.g. from the Heroku scheduler or a cron job, or let it repeat with `--interval`.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import archive_backend
+from ...models import Backend
+from ...storage_routing import provider_for_config
+
+# pylint: disable=E1101
+
+
+class Command(BaseCommand):
+    """
+    Apply the retention of every backend, or of the selected ones.
+    """
+
+    help = "Pack finished jobs beyond the retention of their backend into archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            action="append",
+            help="Only archive the jobs of this backend. May be given several times.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the jobs that would be archived.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Repeat the archival every INTERVAL seconds instead of running once.",
+        )
+
+    def handle(self, *args, **options):
+        if options["backend"]:
+            known = set(Backend.objects.values_list("name", flat=True))
+            missing = set(options["backend"]) - known
+            if missing:
+                raise CommandError("Unknown backends: " + ", ".join(sorted(missing)))
+        while True:
+            # the retention may change between two runs
+            backends = Backend.objects.all()
+            if options["backend"]:
+                backends = backends.filter(name__in=options["backend"])
+            for backend in backends:
+                try:
+                    num_jobs = archive_backend(
+                        provider_for_config(backend.storage_config),
+                        backend,
+                        dry_run=options["dry_run"],
+                    )
+                except OSError as err:
+                    self.stderr.write(
+                        f"{backend.name}: skipped, the storage failed: {err}"
+                    )
+                    continue
+                verb = "would archive" if options["dry_run"] else "archived"
+                self.stdout.write(f"{backend.name}: {verb} {num_jobs} jobs")
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
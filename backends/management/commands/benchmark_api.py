@@ -0,0 +1,167 @@
+"""
+The command that measures the throughput and the latency of the job endpoints under
+load. It runs against a throwaway database and a storage in memory or in a temporary
+folder, so it never touches the data of the deployment or Dropbox.
+"""
+import inspect
+import json
+import secrets
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from ...apps import BackendsConfig as ac
+from ...benchmarks import (
+    DEFAULT_MIX,
+    LoadTest,
+    LoadTestServer,
+    compare_reports,
+    parse_mix,
+    throwaway_database,
+)
+from ...memory_storage import MemoryProvider, parse_latency
+from ...storage_providers import InstrumentedProvider, LocalFileProvider
+
+
+def _keyed_values(entries, parse):
+    """
+    Read options like "upload=0.05" into a dict. An entry without a method applies to
+    all methods.
+    """
+    values = {}
+    for entry in entries or []:
+        method, _, value = entry.rpartition("=")
+        try:
+            values[method or "*"] = parse(value)
+        except ValueError as err:
+            raise CommandError(str(err)) from err
+    return values
+
+
+class Command(BaseCommand):
+    """
+    Run a load test against a local server.
+    """
+
+    help = "Measure the requests per second, the latency and the CPU time of the api."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Seconds of measurement."
+        )
+        parser.add_argument(
+            "--warmup",
+            type=float,
+            default=3,
+            help="Seconds of requests before the measurement starts.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=8, help="Number of parallel clients."
+        )
+        parser.add_argument(
+            "--mix",
+            default=",".join(f"{op}={weight:g}" for op, weight in DEFAULT_MIX.items()),
+            help="Weight of each operation, e.g. post_job=1,get_job_status=10.",
+        )
+        parser.add_argument("--backend", default="fermions")
+        parser.add_argument("--api", choices=["v1", "legacy"], default="v1")
+        parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+        parser.add_argument("--storage", choices=["memory", "local"], default="memory")
+        parser.add_argument(
+            "--latency",
+            action="append",
+            help="Latency of the memory storage as METHOD=SPEC or SPEC for all "
+            "methods, e.g. get_file_content=lognormal:0.08:0.5. May be repeated.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            action="append",
+            help="Failure rate of the memory storage as METHOD=RATE or RATE.",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=100,
+            help="Number of finished jobs in the storage before the start.",
+        )
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--output", help="Save the report as json to this file.")
+        parser.add_argument(
+            "--baseline", help="Compare with the report of an earlier run."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options["mix"])
+        except ValueError as err:
+            raise CommandError(str(err)) from err
+        latency = _keyed_values(options["latency"], parse_latency)
+        error_rate = _keyed_values(options["error_rate"], float)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if options["storage"] == "memory":
+                provider = MemoryProvider(
+                    latency=latency, error_rate=error_rate, seed=options["seed"]
+                )
+            else:
+                provider = LocalFileProvider(tmp_dir + "/storage")
+            report = self._run(tmp_dir, InstrumentedProvider(provider), mix, options)
+
+        report["meta"]["server"] = options["server"]
+        report["meta"]["storage"] = {
+            "provider": options["storage"],
+            "latency": options["latency"] or [],
+            "error_rate": options["error_rate"] or [],
+        }
+        self.stdout.write(json.dumps(report["total"], indent=2))
+        for operation, numbers in report["operations"].items():
+            self.stdout.write(
+                f"{operation}: {numbers['rps']:.1f} rps, p50 {numbers['p50_ms']:.1f} "
+                f"ms, p95 {numbers['p95_ms']:.1f} ms, p99 {numbers['p99_ms']:.1f} ms, "
+                f"{numbers['errors']} errors"
+            )
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline_file:
+                for line in compare_reports(json.load(baseline_file), report):
+                    self.stdout.write(line)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output_file:
+                json.dump(report, output_file, indent=2)
+
+    @staticmethod
+    def _run(tmp_dir: str, storage_provider, mix: dict, options: dict) -> dict:
+        """
+        Set up the database, the users and the server and run the load test.
+        """
+        # the storage of the app is only built on first use, so it is kept as it is
+        old_storage = inspect.getattr_static(ac, "storage")
+        try:
+            ac.storage = storage_provider
+            with throwaway_database(tmp_dir):
+                password = secrets.token_urlsafe(16)
+                spooler_password = secrets.token_urlsafe(16)
+                get_user_model().objects.create_user("benchmark", password=password)
+                get_user_model().objects.create_user(
+                    "spooler", password=spooler_password
+                )
+                with override_settings(
+                    ALLOWED_HOSTS=["127.0.0.1", "localhost"]
+                ), LoadTestServer(options["server"]) as server:
+                    load_test = LoadTest(
+                        server.url,
+                        storage_provider,
+                        options["backend"],
+                        ("benchmark", password),
+                        spooler_password,
+                        mix=mix,
+                        api=options["api"],
+                        seed=options["seed"],
+                    )
+                    load_test.prepare(options["jobs"])
+                    return load_test.run(
+                        options["duration"], options["concurrency"], options["warmup"]
+                    )
+        finally:
+            ac.storage = old_storage
@@ -0,0 +1,116 @@
+"""
+The command that times the building blocks of the requests, see `microbenchmarks.py`.
+The api suite runs against a throwaway database.
+"""
+import datetime
+import json
+import platform
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import current_commit, throwaway_database
+from ...microbenchmarks import (
+    DEFAULT_FOLDER_SIZES,
+    DEFAULT_PAYLOAD_SIZES,
+    SUITES,
+    api_benchmarks,
+    compare_results,
+    result_key,
+    serialization_benchmarks,
+    storage_benchmarks,
+)
+
+
+def _sizes(spec: str):
+    """
+    Read a comma separated list of sizes.
+    """
+    try:
+        return [int(size) for size in spec.split(",")]
+    except ValueError as err:
+        raise CommandError("Invalid sizes " + spec + "!") from err
+
+
+class Command(BaseCommand):
+    """
+    Run the microbenchmarks.
+    """
+
+    help = "Time the storage, the serialization and the checks of the api one by one."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--suite",
+            action="append",
+            choices=SUITES,
+            help="Only run this suite. May be given several times.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Number of rounds per benchmark."
+        )
+        parser.add_argument(
+            "--payload-sizes",
+            default=",".join(str(size) for size in DEFAULT_PAYLOAD_SIZES),
+            help="Sizes of the files in bytes, comma separated.",
+        )
+        parser.add_argument(
+            "--folder-sizes",
+            default=",".join(str(size) for size in DEFAULT_FOLDER_SIZES),
+            help="Numbers of files in the listed folders, comma separated.",
+        )
+        parser.add_argument("--output", help="Save the report as json to this file.")
+        parser.add_argument(
+            "--baseline", help="Compare with the report of an earlier run."
+        )
+
+    def handle(self, *args, **options):
+        suites = options["suite"] or SUITES
+        repeat = options["repeat"]
+        report = {
+            "meta": {
+                "date": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                "commit": current_commit(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "repeat": repeat,
+            },
+            "results": [],
+        }
+        runs = []
+        if "storage" in suites:
+            runs.append(
+                storage_benchmarks(
+                    _sizes(options["payload_sizes"]),
+                    _sizes(options["folder_sizes"]),
+                    repeat,
+                )
+            )
+        if "serialization" in suites:
+            runs.append(serialization_benchmarks(repeat))
+        for run in runs:
+            for entry in run:
+                self._add(report, entry)
+        if "api" in suites:
+            with tempfile.TemporaryDirectory() as tmp_dir, throwaway_database(tmp_dir):
+                for entry in api_benchmarks(repeat):
+                    self._add(report, entry)
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as baseline_file:
+                for line in compare_results(json.load(baseline_file), report):
+                    self.stdout.write(line)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output_file:
+                json.dump(report, output_file, indent=2)
+
+    def _add(self, report: dict, entry: dict) -> None:
+        """
+        Keep a result and show it right away.
+        """
+        report["results"].append(entry)
+        self.stdout.write(
+            f"{result_key(entry)}: {entry['median_us']:.1f} us "
+            f"({entry['ops_per_s']:.0f}/s)"
+        )
@@ -0,0 +1,59 @@
+"""
+The command that splits the latency of the traced jobs into the submission, the wait in
+the queue, the execution on the spooler and the transfer to and from the storage. It
+reads the file that the exporter writes to `TRACING_FILE`, see `tracing.py`.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...tracing import job_latency_breakdown, read_spans
+
+PARTS = ("submission", "queue_wait", "execution", "transfer")
+
+
+class Command(BaseCommand):
+    """
+    Print the parts of the latency of every traced job.
+    """
+
+    help = (
+        "Split the latency of the traced jobs into queue wait, transfer and execution."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("trace_file", help="The OTLP/JSON file of the traces.")
+        parser.add_argument(
+            "--job",
+            action="append",
+            help="Only show the traces of this job. May be given several times.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the breakdown as json instead of a table.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["trace_file"], encoding="utf-8") as trace_file:
+                breakdown = job_latency_breakdown(read_spans(trace_file))
+        except (OSError, ValueError) as err:
+            raise CommandError("Could not read the traces: " + str(err)) from err
+        if options["job"]:
+            breakdown = [
+                trace
+                for trace in breakdown
+                if set(trace["job_ids"]) & set(options["job"])
+            ]
+        if options["json"]:
+            self.stdout.write(json.dumps(breakdown, indent=2))
+            return
+        self.stdout.write(
+            "job_id".ljust(50) + "".join(part.rjust(12) for part in PARTS)
+        )
+        for trace in breakdown:
+            self.stdout.write(
+                ",".join(trace["job_ids"]).ljust(50)
+                + "".join(format(trace[part], ".3f").rjust(12) for part in PARTS)
+            )
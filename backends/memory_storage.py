@@ -0,0 +1,331 @@
+"""
+The storage in memory, which is meant for tests and benchmarks. Every operation of the
+`MemoryProvider` can be slowed down and made to fail at random, such that we can see
+how qlue behaves with a fast, a slow or a flaky storage without touching the network.
+
+The files live in a `MemoryStore`. By default every provider has its own store, while
+several processes, like the workers of gunicorn, can share a store that is served by the
+`MemoryStoreManager`:
+
+    manager = MemoryStoreManager(address=("127.0.0.1", 50000), authkey=b"qlue")
+    manager.start()
+    storage = MemoryProvider(address=("127.0.0.1", 50000), authkey=b"qlue")
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from .storage_providers import StorageProvider
+
+# the latency of an operation in seconds, either constant or drawn from a distribution
+Latency = Union[float, Callable[[random.Random], float]]
+
+
+def parse_latency(spec: str) -> Latency:
+    """
+    Read the latency of an operation from a setting or the command line.
+
+    Args:
+        spec: Either a constant in seconds like "0.05", or a distribution like
+            "lognormal:<median>:<sigma>", "uniform:<low>:<high>" or "exp:<mean>"
+
+    Returns:
+        The latency as it is used by the `MemoryProvider`
+
+    Raises:
+        ValueError: If the spec has none of these forms.
+    """
+    parts = spec.split(":")
+    try:
+        values = [float(part) for part in parts[1:]]
+        if len(parts) == 1:
+            return float(parts[0])
+        if parts[0] == "lognormal" and len(values) == 2:
+            return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+        if parts[0] == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        if parts[0] == "exp" and len(values) == 1:
+            return lambda rng: rng.expovariate(1 / values[0])
+    except (ValueError, ZeroDivisionError) as err:
+        raise ValueError("Invalid latency " + spec + "!") from err
+    raise ValueError("Invalid latency " + spec + "!")
+
+
+class MemoryStore:
+    """
+    The files of a `MemoryProvider`. A single store can be shared by several processes
+    through the `MemoryStoreManager`.
+    """
+
+    def __init__(self):
+        self._files: Dict[str, Union[str, bytes]] = {}
+        self._folders: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(storage_path: str) -> Tuple[str, str]:
+        """
+        The folder and the name of a file.
+        """
+        folder, _, name = storage_path.rpartition("/")
+        return folder, name
+
+    def write(self, storage_path: str, content: Union[str, bytes]) -> None:
+        """
+        Create or replace a file.
+        """
+        folder, name = self._split(storage_path)
+        with self._lock:
+            self._files[storage_path] = content
+            self._folders.setdefault(folder, set()).add(name)
+
+    def read(self, storage_path: str) -> Union[str, bytes]:
+        """
+        The content of a file.
+        """
+        with self._lock:
+            try:
+                return self._files[storage_path]
+            except KeyError:
+                raise FileNotFoundError(storage_path) from None
+
+    def list_folder(self, folder: str) -> List[str]:
+        """
+        The sorted names of the files in a folder.
+        """
+        with self._lock:
+            return sorted(self._folders.get(folder.rstrip("/"), ()))
+
+    def move(self, start_path: str, final_path: str) -> None:
+        """
+        Move a file.
+        """
+        with self._lock:
+            content = self._pop(start_path)
+            folder, name = self._split(final_path)
+            self._files[final_path] = content
+            self._folders.setdefault(folder, set()).add(name)
+
+    def delete(self, storage_path: str) -> None:
+        """
+        Remove a file.
+        """
+        with self._lock:
+            self._pop(storage_path)
+
+    def clear(self) -> None:
+        """
+        Remove all files.
+        """
+        with self._lock:
+            self._files.clear()
+            self._folders.clear()
+
+    def count(self) -> int:
+        """
+        The number of files.
+        """
+        with self._lock:
+            return len(self._files)
+
+    def _pop(self, storage_path: str) -> Union[str, bytes]:
+        """
+        Remove a file and return its content. The lock has to be held.
+        """
+        try:
+            content = self._files.pop(storage_path)
+        except KeyError:
+            raise FileNotFoundError(storage_path) from None
+        folder, name = self._split(storage_path)
+        self._folders[folder].discard(name)
+        if not self._folders[folder]:
+            del self._folders[folder]
+        return content
+
+
+_SHARED_STORE: Optional[MemoryStore] = None
+
+
+def _shared_store() -> MemoryStore:
+    """
+    The store that the `MemoryStoreManager` serves, created in its own process.
+    """
+    global _SHARED_STORE  # pylint: disable=W0603
+    if _SHARED_STORE is None:
+        _SHARED_STORE = MemoryStore()
+    return _SHARED_STORE
+
+
+class MemoryStoreManager(BaseManager):
+    """
+    The server that shares a `MemoryStore` between processes, e.g. between the workers
+    of gunicorn. Start it with `start()` and connect with a `MemoryProvider` that has
+    the same address and authkey.
+    """
+
+
+MemoryStoreManager.register("get_store", callable=_shared_store)
+
+
+class MemoryProvider(StorageProvider):
+    """
+    The storage in memory with injected latency and failures.
+
+    Args:
+        latency: The latency of the operations in seconds, keyed by the name of the
+            method like "upload" or "get_file_queue". The key "*" applies to all
+            other methods. See `parse_latency` for the values.
+        error_rate: The probability that an operation fails with a `ConnectionError`,
+            keyed like the latency.
+        address: The address of a `MemoryStoreManager` that shares the files with
+            other processes. The files are kept in this process if it is not given.
+        authkey: The authkey of the `MemoryStoreManager`
+        seed: The seed of the random numbers for reproducible runs
+    """
+
+    def __init__(
+        self,
+        latency: Dict[str, Latency] = None,
+        error_rate: Dict[str, float] = None,
+        address: Tuple[str, int] = None,
+        authkey: bytes = None,
+        seed: int = None,
+    ):
+        """
+        Set up the store.
+        """
+        # pylint: disable=R0913
+        self.latency = latency or {}
+        self.error_rate = error_rate or {}
+        self._random = random.Random(seed)
+        if address is None:
+            self.store = MemoryStore()
+        else:
+            manager = MemoryStoreManager(address=address, authkey=authkey)
+            manager.connect()
+            self.store = manager.get_store()  # pylint: disable=E1101
+
+    def _draw(self, method: str) -> Tuple[float, bool]:
+        """
+        The latency of a call and whether it fails.
+        """
+        latency = self.latency.get(method, self.latency.get("*", 0.0))
+        if callable(latency):
+            latency = max(0.0, latency(self._random))
+        error_rate = self.error_rate.get(method, self.error_rate.get("*", 0.0))
+        return latency, self._random.random() < error_rate
+
+    def _simulate(self, method: str) -> None:
+        """
+        Wait like a real storage would and fail if it is the turn of an error.
+        """
+        latency, fails = self._draw(method)
+        if latency:
+            time.sleep(latency)
+        if fails:
+            raise ConnectionError("Injected failure of " + method + "!")
+
+    async def _asimulate(self, method: str) -> None:
+        """
+        Wait without blocking the event loop and fail if it is the turn of an error.
+        """
+        latency, fails = self._draw(method)
+        await asyncio.sleep(latency)
+        if fails:
+            raise ConnectionError("Injected failure of " + method + "!")
+
+    def upload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Keep the file in memory
+        """
+        self._simulate("upload")
+        self.store.write(storage_path, dump_str)
+
+    def get_file_content(self, storage_path: str) -> str:
+        """
+        Get the file from memory
+        """
+        self._simulate("get_file_content")
+        return self.store.read(storage_path)
+
+    def get_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get the sorted list of files in the folder
+        """
+        self._simulate("get_file_queue")
+        return self.store.list_folder(storage_path)
+
+    def move_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        self._simulate("move_file")
+        self.store.move(start_path, final_path)
+
+    def delete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from memory
+        """
+        self._simulate("delete_file")
+        self.store.delete(storage_path)
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Keep the binary file in memory
+        """
+        self._simulate("upload_bytes")
+        self.store.write(storage_path, data)
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Get the binary file from memory
+        """
+        self._simulate("get_file_bytes")
+        return self.store.read(storage_path)
+
+    def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Remove many files from memory in a single operation
+        """
+        self._simulate("delete_files")
+        for storage_path in storage_paths:
+            self.store.delete(storage_path)
+
+    async def aupload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Keep the file in memory
+        """
+        await self._asimulate("upload")
+        self.store.write(storage_path, dump_str)
+
+    async def aget_file_content(self, storage_path: str) -> str:
+        """
+        Get the file from memory
+        """
+        await self._asimulate("get_file_content")
+        return self.store.read(storage_path)
+
+    async def aget_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get the sorted list of files in the folder
+        """
+        await self._asimulate("get_file_queue")
+        return self.store.list_folder(storage_path)
+
+    async def amove_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        await self._asimulate("move_file")
+        self.store.move(start_path, final_path)
+
+    async def adelete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from memory
+        """
+        await self._asimulate("delete_file")
+        self.store.delete(storage_path)
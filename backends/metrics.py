@@ -0,0 +1,288 @@
+"""
+The module that measures where the time of the requests goes. Every request is split
+into phases:
+
+    auth: checking the password of the user
+    db: looking up the backend
+    storage: the calls to the `StorageProvider`
+    serialize: encoding the answer
+
+The `metrics_middleware` keeps histograms of the duration of each view and of each
+phase within it, while the `InstrumentedProvider` measures every call to the storage.
+Everything is kept in the memory of the process and exposed in the text format of
+Prometheus by the `metrics` view.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# the upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# the upper bounds in bytes of the buckets of the size histograms
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+# the request header that asks for the `Server-Timing` header in the response
+SERVER_TIMING_HEADER = "X-Server-Timing"
+
+METRIC_HELP = {
+    "qlue_request_duration_seconds": ("histogram", "The duration of the requests."),
+    "qlue_phase_duration_seconds": (
+        "histogram",
+        "The time that the requests spent in each phase.",
+    ),
+    "qlue_storage_duration_seconds": (
+        "histogram",
+        "The duration of the calls to the storage.",
+    ),
+    "qlue_storage_payload_bytes": (
+        "histogram",
+        "The size of the files that were sent to or received from the storage.",
+    ),
+    "qlue_storage_calls_total": ("counter", "The number of calls to the storage."),
+    "qlue_storage_bytes_total": (
+        "counter",
+        "The number of bytes sent to and received from the storage.",
+    ),
+    "qlue_storage_errors_total": (
+        "counter",
+        "The number of calls to the storage that failed.",
+    ),
+    "qlue_storage_retries_total": (
+        "counter",
+        "The number of calls to the storage that repeated a failed call.",
+    ),
+    "qlue_storage_hedges_total": (
+        "counter",
+        "The number of reads that were sent again because the first was slow.",
+    ),
+    "qlue_storage_rejected_total": (
+        "counter",
+        "The number of calls that failed fast because the storage was unhealthy.",
+    ),
+}
+# the histograms that do not measure durations
+METRIC_BUCKETS = {"qlue_storage_payload_bytes": SIZE_BUCKETS}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# the time spent in each phase of the current request, None outside of requests
+_REQUEST_PHASES: contextvars.ContextVar[
+    Optional[Dict[str, float]]
+] = contextvars.ContextVar("qlue_request_phases", default=None)
+
+
+class Histogram:
+    """
+    The distribution of a duration or a size.
+
+    Args:
+        buckets: The upper bounds of the buckets
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Add a measurement.
+        """
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    The histograms and counters of the process, keyed by their name and their labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        """
+        Add a measurement to a histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(
+                    METRIC_BUCKETS.get(name, LATENCY_BUCKETS)
+                )
+            self._histograms[key].observe(value)
+
+    def increment(self, name: str, labels: Dict[str, str], amount: float = 1) -> None:
+        """
+        Increase a counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter_value(self, name: str, labels: Dict[str, str]) -> float:
+        """
+        The current value of a counter.
+        """
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_count(self, name: str, labels: Dict[str, str]) -> int:
+        """
+        The number of measurements in a histogram.
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return 0 if histogram is None else histogram.count
+
+    def reset(self) -> None:
+        """
+        Forget all measurements.
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        """
+        All metrics in the text format of Prometheus.
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text) in METRIC_HELP.items():
+                lines.append("# HELP " + name + " " + help_text)
+                lines.append("# TYPE " + name + " " + kind)
+                if kind == "histogram":
+                    lines += self._render_histograms(name)
+                else:
+                    for (key_name, labels), value in sorted(self._counters.items()):
+                        if key_name == name:
+                            lines.append(
+                                name + _format_labels(labels) + " " + str(value)
+                            )
+        return "\n".join(lines) + "\n"
+
+    def _render_histograms(self, name: str) -> List[str]:
+        """
+        The lines of all histograms with the given name.
+        """
+        lines = []
+        for (key_name, labels), histogram in sorted(
+            self._histograms.items(), key=lambda item: item[0]
+        ):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(
+                histogram.buckets + (float("inf"),), histogram.bucket_counts
+            ):
+                cumulative += count
+                bucket_labels = labels + (
+                    ("le", "+Inf" if bound == float("inf") else str(bound)),
+                )
+                lines.append(
+                    name
+                    + "_bucket"
+                    + _format_labels(bucket_labels)
+                    + " "
+                    + str(cumulative)
+                )
+            lines.append(
+                name + "_sum" + _format_labels(labels) + " " + str(histogram.total)
+            )
+            lines.append(
+                name + "_count" + _format_labels(labels) + " " + str(histogram.count)
+            )
+        return lines
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_labels(labels: Labels) -> str:
+    """
+    The labels of a sample in the text format of Prometheus.
+    """
+    if not labels:
+        return ""
+    escaped = [
+        key + '="' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for key, value in labels
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def start_request() -> contextvars.Token:
+    """
+    Start to collect the phases of a request.
+    """
+    return _REQUEST_PHASES.set({})
+
+
+def finish_request(
+    token: contextvars.Token, view: str, method: str, seconds: float
+) -> Dict[str, float]:
+    """
+    Record the duration of a request and of its phases.
+
+    Args:
+        token: The token of `start_request`
+        view: The route of the view that answered the request
+        method: The html method of the request
+        seconds: The duration of the request
+
+    Returns:
+        The time spent in each phase of the request
+    """
+    phases = _REQUEST_PHASES.get() or {}
+    _REQUEST_PHASES.reset(token)
+    REGISTRY.observe(
+        "qlue_request_duration_seconds", {"view": view, "method": method}, seconds
+    )
+    for phase, phase_seconds in phases.items():
+        REGISTRY.observe(
+            "qlue_phase_duration_seconds", {"view": view, "phase": phase}, phase_seconds
+        )
+    return phases
+
+
+def add_phase_time(phase: str, seconds: float) -> None:
+    """
+    Add time to a phase of the current request. Nothing happens outside of requests.
+    """
+    phases = _REQUEST_PHASES.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """
+    Count the time spent within the block towards a phase of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(phase, time.perf_counter() - start)
+
+
+def server_timing(phases: Dict[str, float], seconds: float) -> str:
+    """
+    The value of the `Server-Timing` header with the phases and the total duration of
+    a request in milliseconds.
+    """
+    entries = [
+        phase + ";dur=" + format(phase_seconds * 1000, ".1f")
+        for phase, phase_seconds in phases.items()
+    ]
+    entries.append("total;dur=" + format(seconds * 1000, ".1f"))
+    return ", ".join(entries)
@@ -0,0 +1,257 @@
+"""
+The module that times the building blocks of the requests one by one, such that we can
+see which optimization pays off before we measure it under load. The suites are
+
+    storage: the operations of the storage providers for several sizes of the files
+        and of the folders
+    serialization: encoding and decoding jobs and results of each backend in every
+        available media type, with and without packed shot memory
+    api: building the configurations of `api_v1.list_backends` and checking the
+        credentials in `check_request`
+
+Run them through the management command:
+
+    python manage.py benchmark_components --output components.json
+"""
+import json
+import statistics
+import tempfile
+import timeit
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+from django.contrib.auth import get_user_model
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+
+from .api_v1 import list_backends
+from .benchmarks import sample_job, sample_result
+from .encodings import CODECS, pack_result
+from .memory_storage import MemoryProvider
+from .storage_providers import InstrumentedProvider, LocalFileProvider, StorageProvider
+from .views import check_request
+
+SUITES = ("storage", "serialization", "api")
+DEFAULT_PAYLOAD_SIZES = (1_000, 100_000, 1_000_000)
+DEFAULT_FOLDER_SIZES = (10, 1_000, 10_000)
+
+
+def measure(func: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    """
+    Time a function like `timeit` does. The number of calls per round is chosen such
+    that a round takes at least 0.2 seconds.
+
+    Args:
+        func: The function without arguments
+        repeat: The number of rounds
+
+    Returns:
+        The best and the median time per call in microseconds and the calls per second
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_call = [seconds / number for seconds in timer.repeat(repeat, number)]
+    median = statistics.median(per_call)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": 1e6 * min(per_call),
+        "median_us": 1e6 * median,
+        "ops_per_s": 1 / median if median else 0.0,
+    }
+
+
+def _entry(suite: str, name: str, params: dict, timing: Dict[str, float]) -> dict:
+    """
+    A single line of the report.
+    """
+    return dict({"suite": suite, "name": name, "params": params}, **timing)
+
+
+def storage_benchmarks(
+    payload_sizes: Sequence[int] = DEFAULT_PAYLOAD_SIZES,
+    folder_sizes: Sequence[int] = DEFAULT_FOLDER_SIZES,
+    repeat: int = 5,
+) -> Iterator[dict]:
+    """
+    Time upload, get_file_content and move_file for files of each payload size and
+    get_file_queue for folders of each size. The storage in memory shows the overhead
+    of qlue itself, the local files add a real file system and the instrumented
+    storage in memory shows the cost of the metrics.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        providers: Dict[str, StorageProvider] = {
+            "memory": MemoryProvider(),
+            "instrumented_memory": InstrumentedProvider(MemoryProvider()),
+            "local": LocalFileProvider(tmp_dir),
+        }
+        for provider_name, storage_provider in providers.items():
+            for size in payload_sizes:
+                params = {"provider": provider_name, "payload_bytes": size}
+                payload = "x" * size
+                path = "/Backend_files/Result/bench/user/result-" + str(size) + ".json"
+                yield _entry(
+                    "storage",
+                    "upload",
+                    params,
+                    measure(partial(storage_provider.upload, payload, path), repeat),
+                )
+                yield _entry(
+                    "storage",
+                    "get_file_content",
+                    params,
+                    measure(partial(storage_provider.get_file_content, path), repeat),
+                )
+                yield _entry(
+                    "storage",
+                    "move_file",
+                    params,
+                    measure(_mover(storage_provider, path), repeat),
+                )
+            for size in folder_sizes:
+                folder = "/Backend_files/Queued_Jobs/bench" + str(size) + "/"
+                for index in range(size):
+                    storage_provider.upload("{}", folder + f"job-{index:06d}.json")
+                yield _entry(
+                    "storage",
+                    "get_file_queue",
+                    {"provider": provider_name, "folder_files": size},
+                    measure(partial(storage_provider.get_file_queue, folder), repeat),
+                )
+
+
+def _mover(storage_provider: StorageProvider, path: str) -> Callable[[], None]:
+    """
+    A function that moves the file back and forth between two folders.
+    """
+    paths = [path, path.replace("/Result/", "/Moved/")]
+
+    def move() -> None:
+        storage_provider.move_file(paths[0], paths[1])
+        paths.reverse()
+
+    return move
+
+
+def serialization_benchmarks(repeat: int = 5) -> Iterator[dict]:
+    """
+    Time encoding and decoding a job with 10 experiments and its result with 1000
+    shots per experiment for every backend and every media type. The packed results
+    are those that clients get with `packed=true`.
+    """
+    media_types = [
+        media_type for media_type in CODECS if media_type != "application/x-msgpack"
+    ]
+    for backend_name in ("fermions", "singlequdit", "multiqudit"):
+        job_payload = sample_job(backend_name, num_experiments=10, shots=1000)
+        job_str = json.dumps(job_payload)
+        params = {"backend": backend_name}
+        yield _entry(
+            "serialization",
+            "job_encode",
+            dict(params, media_type="application/json"),
+            measure(partial(json.dumps, job_payload), repeat),
+        )
+        yield _entry(
+            "serialization",
+            "job_decode",
+            dict(params, media_type="application/json"),
+            measure(partial(json.loads, job_str), repeat),
+        )
+        result_dict = sample_result(backend_name, "job", job_payload)
+        documents = {"plain": result_dict, "packed": pack_result(result_dict)}
+        yield _entry(
+            "serialization",
+            "result_pack",
+            params,
+            measure(partial(pack_result, result_dict), repeat),
+        )
+        for media_type in media_types:
+            encode, decode = CODECS[media_type]
+            for form, document in documents.items():
+                content = encode(document)
+                result_params = dict(
+                    params, media_type=media_type, form=form, bytes=len(content)
+                )
+                yield _entry(
+                    "serialization",
+                    "result_encode",
+                    result_params,
+                    measure(partial(encode, document), repeat),
+                )
+                yield _entry(
+                    "serialization",
+                    "result_decode",
+                    result_params,
+                    measure(partial(decode, content), repeat),
+                )
+
+
+def api_benchmarks(repeat: int = 5) -> Iterator[dict]:
+    """
+    Time the configurations of all backends, directly and through a request, and the
+    check of the credentials for the right and a wrong password. It needs the database
+    of `throwaway_database`.
+    """
+    get_user_model().objects.create_user("benchmark", password="benchmark-password")
+    factory = RequestFactory()
+    yield _entry(
+        "api", "list_backends", {}, measure(lambda: list_backends(None), repeat)
+    )
+    client = Client()
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        yield _entry(
+            "api",
+            "list_backends_request",
+            {},
+            measure(lambda: client.get("/api/v1/backends"), repeat),
+        )
+    for password in ("benchmark-password", "wrong-password"):
+        request = factory.get(
+            "/api/fermions/get_config/",
+            {"username": "benchmark", "password": password},
+        )
+        yield _entry(
+            "api",
+            "check_request",
+            {"valid": password == "benchmark-password"},
+            measure(partial(check_request, request, "fermions"), repeat),
+        )
+
+
+def result_key(entry: dict) -> str:
+    """
+    The key that identifies a result across reports.
+    """
+    return (
+        entry["suite"]
+        + "/"
+        + entry["name"]
+        + " "
+        + json.dumps(entry["params"], sort_keys=True)
+    )
+
+
+def compare_results(baseline: dict, report: dict) -> List[str]:
+    """
+    Describe how the median time per call changed between two reports.
+
+    Args:
+        baseline: The earlier report
+        report: The new report
+
+    Returns:
+        One line for each result that is in both reports
+    """
+    old_results = {result_key(entry): entry for entry in baseline.get("results", [])}
+    lines = []
+    for entry in report.get("results", []):
+        old = old_results.get(result_key(entry))
+        if old is None or not old["median_us"]:
+            continue
+        change = 100 * (entry["median_us"] - old["median_us"]) / old["median_us"]
+        lines.append(
+            f"{result_key(entry)}: {old['median_us']:.1f} -> "
+            f"{entry['median_us']:.1f} us ({change:+.1f}%)"
+        )
+    return lines
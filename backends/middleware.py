@@ -0,0 +1,154 @@
+"""
+The middleware of the app.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import SERVER_TIMING_HEADER, finish_request, server_timing, start_request
+from .profiling import (
+    PROFILE_ID_HEADER,
+    RequestProfiler,
+    may_profile,
+    profiling_user,
+    wants_profile,
+)
+from .tracing import SPAN_KIND_SERVER, TRACEPARENT_HEADER, span
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Measure the duration of every request and of its phases, see `metrics.py`. The
+    response gets a `Server-Timing` header if the request has the header
+    `X-Server-Timing` or the setting `SERVER_TIMING` is on.
+    """
+
+    def finish(request, response, token, start: float):
+        seconds = time.perf_counter() - start
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.route if resolver_match is not None else "unmatched"
+        phases = finish_request(token, view, request.method, seconds)
+        if SERVER_TIMING_HEADER in request.headers or getattr(
+            settings, "SERVER_TIMING", False
+        ):
+            response["Server-Timing"] = server_timing(phases, seconds)
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            start = time.perf_counter()
+            token = start_request()
+            response = await get_response(request)
+            return finish(request, response, token, start)
+
+    else:
+
+        def middleware(request):
+            start = time.perf_counter()
+            token = start_request()
+            response = get_response(request)
+            return finish(request, response, token, start)
+
+    return middleware
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Profile the requests of staff users that ask for it, see `profiling.py`. It has to
+    come after the `AuthenticationMiddleware`. Whether the user is staff is only known
+    once the view checked the credentials, so the profile of other users is dropped.
+    """
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not wants_profile(request):
+                return await get_response(request)
+            if not await sync_to_async(may_profile)(request):
+                return await get_response(request)
+            profiler = RequestProfiler()
+            profiler.start()
+            try:
+                response = await get_response(request)
+            finally:
+                profiler.stop()
+            username = await sync_to_async(profiling_user)(
+                request, profiler.authenticated_user
+            )
+            if username is None:
+                return response
+            profile = await sync_to_async(profiler.save)(request, response, username)
+            response[PROFILE_ID_HEADER] = str(profile.id)
+            return response
+
+    else:
+
+        def middleware(request):
+            if not wants_profile(request) or not may_profile(request):
+                return get_response(request)
+            profiler = RequestProfiler()
+            profiler.start()
+            try:
+                response = get_response(request)
+            finally:
+                profiler.stop()
+            username = profiling_user(request, profiler.authenticated_user)
+            if username is None:
+                return response
+            profile = profiler.save(request, response, username)
+            response[PROFILE_ID_HEADER] = str(profile.id)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    """
+    Trace every request as span, see `tracing.py`. It continues the trace of the
+    `traceparent` header if the request has one. The query is left out, as it may
+    contain the password.
+    """
+
+    def request_span(request):
+        return span(
+            "HTTP " + request.method,
+            {"http.method": request.method, "http.target": request.path},
+            SPAN_KIND_SERVER,
+            request.headers.get(TRACEPARENT_HEADER),
+        )
+
+    def finish(request, response, request_span_now) -> None:
+        if request_span_now is None:
+            return
+        resolver_match = getattr(request, "resolver_match", None)
+        if resolver_match is not None:
+            request_span_now.name = request.method + " " + resolver_match.route
+            request_span_now.attributes["http.route"] = resolver_match.route
+        request_span_now.attributes["http.status_code"] = response.status_code
+        if response.status_code >= 500:
+            request_span_now.error = "HTTP " + str(response.status_code)
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with request_span(request) as request_span_now:
+                response = await get_response(request)
+                finish(request, response, request_span_now)
+            return response
+
+    else:
+
+        def middleware(request):
+            with request_span(request) as request_span_now:
+                response = get_response(request)
+                finish(request, response, request_span_now)
+            return response
+
+    return middleware
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0004_alter_backend_description"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backend",
+            name="coalesce_jobs",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.0.2 on 2026-10-19 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0005_backend_coalesce_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backend",
+            name="scheduling_policy",
+            field=models.CharField(
+                choices=[
+                    ("fifo", "first in, first out"),
+                    ("fair_share", "weighted fair share between users"),
+                    ("priority", "priority classes of the users"),
+                ],
+                default="fifo",
+                max_length=15,
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="queue_priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "low"), (1, "normal"), (2, "high")], default=1
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="queue_weight",
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.CreateModel(
+            name="QueueEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("job_id", models.CharField(max_length=200, unique=True)),
+                ("username", models.CharField(max_length=150)),
+                ("priority", models.PositiveSmallIntegerField(default=1)),
+                ("virtual_finish", models.FloatField(default=0.0)),
+                (
+                    "backend",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="backends.backend",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="queueentry",
+            index=models.Index(
+                fields=["backend", "virtual_finish"],
+                name="backends_qu_backend_d31bbd_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="queueentry",
+            index=models.Index(
+                fields=["backend", "username", "virtual_finish"],
+                name="backends_qu_backend_318ce7_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="queueentry",
+            index=models.Index(
+                fields=["backend", "priority", "id"],
+                name="backends_qu_backend_60bf29_idx",
+            ),
+        ),
+    ]
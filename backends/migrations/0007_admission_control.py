@@ -0,0 +1,86 @@
+# Generated by Django 4.0.2 on 2026-10-19 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0006_queue_scheduling"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backend",
+            name="max_jobs_per_user",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="backend",
+            name="max_queue_depth",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="backend",
+            name="submit_burst",
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name="backend",
+            name="submit_rate",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="QueueStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("queued", models.PositiveIntegerField(default=0)),
+                ("busy_since", models.DateTimeField(null=True)),
+                ("last_dequeue", models.DateTimeField(null=True)),
+                ("drain_interval", models.FloatField(null=True)),
+                (
+                    "backend",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="backends.backend",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SubmitBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.CharField(max_length=150)),
+                ("tokens", models.FloatField()),
+                ("updated", models.DateTimeField()),
+                (
+                    "backend",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="backends.backend",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("backend", "username")},
+            },
+        ),
+    ]
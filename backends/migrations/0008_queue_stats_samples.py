@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0007_admission_control"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="queuestats",
+            name="completions",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="queuestats",
+            name="execution_times",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="queuestats",
+            name="queue_waits",
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name="queuestats",
+            name="running",
+            field=models.JSONField(default=dict),
+        ),
+    ]
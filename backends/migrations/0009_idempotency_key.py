@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-19 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0008_queue_stats_samples"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.CharField(max_length=150)),
+                ("key", models.CharField(max_length=255)),
+                ("response", models.JSONField(null=True)),
+                ("created", models.DateTimeField(db_index=True)),
+            ],
+            options={
+                "unique_together": {("username", "key")},
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.0.2 on 2026-10-19 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0009_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backend",
+            name="retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ArchivedJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("job_id", models.CharField(max_length=200, unique=True)),
+                ("username", models.CharField(max_length=150)),
+                ("bundle_path", models.CharField(max_length=500)),
+                ("archived", models.DateTimeField()),
+                (
+                    "backend",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="backends.backend",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.0.2 on 2026-10-19 18:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0010_job_archive"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="callback_secret",
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="callback_url",
+            field=models.URLField(blank=True, max_length=500),
+        ),
+        migrations.CreateModel(
+            name="WebhookDelivery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("job_id", models.CharField(max_length=200, unique=True)),
+                ("username", models.CharField(max_length=150)),
+                ("url", models.URLField(max_length=500)),
+                ("secret", models.CharField(max_length=200)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("WAITING", "waiting for the job"),
+                            ("PENDING", "pending"),
+                            ("DELIVERED", "delivered"),
+                            ("FAILED", "failed"),
+                        ],
+                        db_index=True,
+                        default="WAITING",
+                        max_length=15,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("next_attempt", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.CharField(blank=True, max_length=500)),
+                ("delivered", models.DateTimeField(blank=True, null=True)),
+                (
+                    "backend",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="backends.backend",
+                    ),
+                ),
+            ],
+        ),
+    ]
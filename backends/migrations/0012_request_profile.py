@@ -0,0 +1,37 @@
+# Generated by Django 4.0.2 on 2026-10-19 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0011_webhook_delivery"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.CharField(max_length=150)),
+                ("method", models.CharField(max_length=10)),
+                ("path", models.CharField(max_length=500)),
+                ("status_code", models.PositiveIntegerField()),
+                ("duration", models.FloatField()),
+                ("num_samples", models.PositiveIntegerField()),
+                ("summary", models.TextField(blank=True)),
+                ("folded_stacks", models.TextField(blank=True)),
+                ("stats", models.BinaryField()),
+                ("created", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.2 on 2026-10-19 19:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0012_request_profile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="queueentry",
+            name="enqueued",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="queueentry",
+            name="traceparent",
+            field=models.CharField(blank=True, max_length=55),
+        ),
+        migrations.AddField(
+            model_name="queuestats",
+            name="running_traces",
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.2 on 2026-10-19 19:08
+
+import backends.storage_registry
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0013_job_traces"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backend",
+            name="storage_config",
+            field=models.CharField(
+                blank=True,
+                max_length=50,
+                validators=[backends.storage_registry.validate_storage_config],
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.2 on 2026-10-19 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0014_backend_storage_config"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="queueentry",
+            name="backends_qu_backend_60bf29_idx",
+        ),
+        migrations.AddIndex(
+            model_name="queueentry",
+            index=models.Index(
+                fields=["backend", "-priority", "id"],
+                name="backends_qu_backend_660d2e_idx",
+            ),
+        ),
+    ]
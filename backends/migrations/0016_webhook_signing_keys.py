@@ -0,0 +1,31 @@
+# Generated by Django 4.0.2 on 2026-10-19 19:41
+
+import hashlib
+import hmac
+
+from django.db import migrations
+
+
+def derive_signing_keys(apps, schema_editor):
+    """
+    Replace the secrets of the stored notifications by the keys that are derived from
+    them, as in `webhooks.signing_key`.
+    """
+    # pylint: disable=W0613
+    webhook_delivery = apps.get_model("backends", "WebhookDelivery")
+    for delivery in webhook_delivery.objects.all():
+        delivery.secret = hmac.new(
+            delivery.secret.encode("utf-8"), b"qlue-webhook", hashlib.sha256
+        ).hexdigest()
+        delivery.save(update_fields=["secret"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0015_queueentry_priority_order"),
+    ]
+
+    operations = [
+        migrations.RunPython(derive_signing_keys, migrations.RunPython.noop),
+    ]
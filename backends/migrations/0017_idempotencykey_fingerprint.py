@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-19 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0016_webhook_signing_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="idempotencykey",
+            name="fingerprint",
+            field=models.CharField(default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-19 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("backends", "0017_idempotencykey_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="queuestats",
+            name="running_jobs",
+            field=models.JSONField(default=dict),
+        ),
+    ]
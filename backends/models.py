@@ -4,14 +4,34 @@ The models that define our sql tables for the app.
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+from .storage_registry import validate_storage_config
 
 # pylint: disable=W0611, W0107
 class User(AbstractUser):
     """
     The class that will contain all the fancy features of a user.
+
+    Args:
+        queue_weight: The share of the backends that the user gets with the fair share
+            scheduling. A user with weight 2 gets twice as many jobs through the queue
+            as a user with weight 1.
+        queue_priority: The priority class of the jobs of the user with the priority
+            scheduling.
+        callback_url: The url that is notified about every finished job of the user,
+            unless the job comes with its own. No notifications if empty.
+        callback_secret: The key with which the notifications are signed, unless the
+            job comes with its own.
     """
 
-    pass
+    queue_weight = models.FloatField(default=1.0)
+    PRIORITY_CHOICES = ((0, "low"), (1, "normal"), (2, "high"))
+    queue_priority = models.PositiveSmallIntegerField(
+        choices=PRIORITY_CHOICES, default=1
+    )
+    callback_url = models.URLField(max_length=500, blank=True)
+    callback_secret = models.CharField(max_length=200, blank=True)
 
 
 class Backend(models.Model):
@@ -33,6 +53,21 @@ class Backend(models.Model):
         wire_order: Could by interleaved or sequential.
         num_species: Number of internal states the backend is working with. Only relevant for
             the types `boson` or `fermion`
+        coalesce_jobs: Should small queued jobs be merged into a single batch for the
+            spooler ? The batch stays within `max_experiments` and `max_shots`.
+        scheduling_policy: The order in which the queued jobs are given to the spooler.
+        max_queue_depth: The number of queued jobs above which new jobs are rejected.
+            No limit if empty.
+        max_jobs_per_user: The number of queued jobs a single user may have. No limit
+            if empty.
+        submit_rate: The number of jobs per second that a single user may submit on
+            average. No limit if empty.
+        submit_burst: The number of jobs that a single user may submit at once before
+            the `submit_rate` kicks in.
+        retention_days: The number of days after which finished jobs are packed into
+            archive bundles. They are never archived if empty.
+        storage_config: The name of the configuration in `STORAGE_PROVIDERS` that
+            keeps the jobs of the backend. They go to the storage of the app if empty.
     """
 
     name = models.CharField(max_length=50, unique=True)
@@ -53,6 +88,234 @@ class Backend(models.Model):
     WIRE_ORDER_CHOICES = (("interleaved", "interleaved"), ("sequential", "sequential"))
     wire_order = models.CharField(max_length=15, choices=WIRE_ORDER_CHOICES)
     num_species = models.PositiveIntegerField(default=1)
+    coalesce_jobs = models.BooleanField(default=False)
+    SCHEDULING_POLICY_CHOICES = (
+        ("fifo", "first in, first out"),
+        ("fair_share", "weighted fair share between users"),
+        ("priority", "priority classes of the users"),
+    )
+    scheduling_policy = models.CharField(
+        max_length=15, choices=SCHEDULING_POLICY_CHOICES, default="fifo"
+    )
+    max_queue_depth = models.PositiveIntegerField(null=True, blank=True)
+    max_jobs_per_user = models.PositiveIntegerField(null=True, blank=True)
+    submit_rate = models.FloatField(null=True, blank=True)
+    submit_burst = models.PositiveIntegerField(default=10)
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    storage_config = models.CharField(
+        max_length=50, blank=True, validators=[validate_storage_config]
+    )
+
+
+class QueueEntry(models.Model):
+    """
+    The entry of a queued job in the index of the queue. The job itself lives on the
+    storage provider, the index only decides in which order the spooler obtains the
+    jobs. The entry is removed as soon as the job leaves the queue.
+
+    Args:
+        job_id: The id of the queued job
+        backend: The backend on which the job is queued
+        username: The user that submitted the job
+        priority: The priority class of the user at submission time
+        virtual_finish: The virtual finishing time of the job in the weighted fair
+            queuing of the backend
+        enqueued: The time at which the job entered the queue
+        traceparent: The span of the submission if it was traced, see `tracing.py`
+    """
+
+    job_id = models.CharField(max_length=200, unique=True)
+    backend = models.ForeignKey(Backend, on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    priority = models.PositiveSmallIntegerField(default=1)
+    virtual_finish = models.FloatField(default=0.0)
+    enqueued = models.DateTimeField(default=timezone.now)
+    traceparent = models.CharField(max_length=55, blank=True)
+
+    # pylint: disable=C0115, R0903
+    class Meta:
+        indexes = [
+            models.Index(fields=["backend", "virtual_finish"]),
+            models.Index(fields=["backend", "username", "virtual_finish"]),
+            models.Index(fields=["backend", "-priority", "id"]),
+        ]
+
+
+class QueueStats(models.Model):
+    """
+    The counters of the queue of a backend. They are updated whenever a job enters or
+    leaves the queue, such that we never have to list the folders of the storage to
+    know how busy a backend is.
+
+    Args:
+        backend: The backend of the queue
+        queued: The number of jobs in the queue
+        busy_since: The time at which the queue became non-empty
+        last_dequeue: The time at which the spooler obtained the last job
+        drain_interval: The moving average of the time in seconds that the spooler
+            needs per job while the queue is non-empty
+        running: The start times of the jobs that the spooler currently works on as
+            unix timestamps, keyed by the job id
+        running_jobs: The ids of the submitted jobs within the running jobs, keyed
+            like `running`. They differ from the key for a batch of coalesced jobs.
+        running_traces: The traced jobs within the running jobs, keyed like `running`.
+            Each is given by its job id, the `traceparent` of its submission and the
+            span id of its `job.running` span.
+        queue_waits: The most recent times in seconds that jobs waited in the queue
+        execution_times: The most recent times in seconds that the spooler needed to
+            finish a job
+        completions: The unix timestamps of the most recently finished jobs
+    """
+
+    backend = models.OneToOneField(Backend, on_delete=models.CASCADE)
+    queued = models.PositiveIntegerField(default=0)
+    busy_since = models.DateTimeField(null=True)
+    last_dequeue = models.DateTimeField(null=True)
+    drain_interval = models.FloatField(null=True)
+    running = models.JSONField(default=dict)
+    running_jobs = models.JSONField(default=dict)
+    running_traces = models.JSONField(default=dict)
+    queue_waits = models.JSONField(default=list)
+    execution_times = models.JSONField(default=list)
+    completions = models.JSONField(default=list)
+
+
+class SubmitBucket(models.Model):
+    """
+    The token bucket that limits the rate at which a user submits jobs to a backend.
+
+    Args:
+        backend: The backend to which the jobs are submitted
+        username: The user that submits the jobs
+        tokens: The number of jobs that the user may still submit
+        updated: The time at which the tokens were last refilled
+    """
+
+    backend = models.ForeignKey(Backend, on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    tokens = models.FloatField()
+    updated = models.DateTimeField()
+
+    # pylint: disable=C0115, R0903
+    class Meta:
+        unique_together = ["backend", "username"]
+
+
+class IdempotencyKey(models.Model):
+    """
+    The answer to a job submission that came with an `Idempotency-Key` header. A
+    client that retries the submission with the same key gets the stored answer
+    instead of a second copy of the job.
+
+    Args:
+        username: The user that submitted the job
+        key: The idempotency key that the client chose
+        fingerprint: The hash of the backend and the payload of the submission
+        response: The answer to the submission. It is None while the submission is
+            still in progress.
+        created: The time of the first submission with the key
+    """
+
+    username = models.CharField(max_length=150)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, default="")
+    response = models.JSONField(null=True)
+    created = models.DateTimeField(db_index=True)
+
+    # pylint: disable=C0115, R0903
+    class Meta:
+        unique_together = ["username", "key"]
+
+
+class ArchivedJob(models.Model):
+    """
+    The entry of an archived job in the index of the archive bundles. It tells us in
+    which bundle the job, its status and its result are kept after their files were
+    removed from the storage.
+
+    Args:
+        job_id: The id of the archived job
+        backend: The backend of the job
+        username: The user that submitted the job
+        bundle_path: The path of the bundle on the storage
+        archived: The time at which the job was archived
+    """
+
+    job_id = models.CharField(max_length=200, unique=True)
+    backend = models.ForeignKey(Backend, on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    bundle_path = models.CharField(max_length=500)
+    archived = models.DateTimeField()
+
+
+class WebhookDelivery(models.Model):
+    """
+    The notification of a user about a job that reached "DONE" or "ERROR". Failed
+    deliveries are retried and the ones that failed too often stay in the table as
+    dead letters.
+
+    Args:
+        job_id: The id of the job
+        backend: The backend of the job
+        username: The user that submitted the job
+        url: The url to which the notification is posted
+        secret: The key with which the notification is signed, which is derived from
+            the secret of the callback, see `webhooks.signing_key`
+        state: Is the job still running, is the notification pending, delivered or
+            did it fail for good ?
+        attempts: The number of failed attempts
+        next_attempt: The time at which the pending notification is sent next
+        last_error: The reason of the last failed attempt
+        delivered: The time of the delivery
+    """
+
+    job_id = models.CharField(max_length=200, unique=True)
+    backend = models.ForeignKey(Backend, on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=200)
+    STATE_CHOICES = (
+        ("WAITING", "waiting for the job"),
+        ("PENDING", "pending"),
+        ("DELIVERED", "delivered"),
+        ("FAILED", "failed"),
+    )
+    state = models.CharField(
+        max_length=15, choices=STATE_CHOICES, default="WAITING", db_index=True
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(null=True, blank=True)
+    last_error = models.CharField(max_length=500, blank=True)
+    delivered = models.DateTimeField(null=True, blank=True)
+
+
+class RequestProfile(models.Model):
+    """
+    The profile of a single request that a staff user asked for, see `profiling.py`.
+
+    Args:
+        username: The staff user that asked for the profile
+        method: The html method of the request
+        path: The path and the query of the request without the password
+        status_code: The status of the answer
+        duration: The duration of the request in seconds
+        num_samples: The number of times that the stacks were sampled
+        summary: The functions with the highest cumulative time according to cProfile
+        folded_stacks: The sampled stacks in the folded format of flamegraph.pl
+        stats: The marshalled statistics of cProfile, which `pstats` can load
+        created: The time of the request
+    """
+
+    username = models.CharField(max_length=150)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveIntegerField()
+    duration = models.FloatField()
+    num_samples = models.PositiveIntegerField()
+    summary = models.TextField(blank=True)
+    folded_stacks = models.TextField(blank=True)
+    stats = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
 # Create your models here.
@@ -0,0 +1,267 @@
+"""
+The module that profiles single requests on demand. A staff user sends the request with
+the header `X-Qlue-Profile: 1` or the query parameter `profile=1`, either logged in to
+the admin or with the username and the password of the api. The request then runs
+under two profilers:
+
+    a sampling profiler, which records the stacks of all busy threads every
+        millisecond. They are saved in the folded format that flamegraph.pl, speedscope
+        and inferno read.
+    cProfile on the thread that runs the request. Its statistics are saved in the
+        format of `pstats`, which snakeviz reads as well.
+
+The password is not checked again for the profile. A request with credentials is
+profiled right away and the profile is only kept if the view authenticated a staff
+user, see `record_authenticated_user`.
+
+Under ASGI the requests of a worker share the thread of the event loop and the threads
+of `sync_to_async`. Both profilers then also record the requests that ran at the same
+time as the profiled one.
+
+The profile is kept as `RequestProfile`, which the admin lists, and the answer carries
+its id in the header `X-Qlue-Profile-Id`. Requests without the flag only pay for the
+check of the flag.
+"""
+import contextvars
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from .models import RequestProfile
+
+# pylint: disable=E1101
+
+PROFILE_HEADER = "X-Qlue-Profile"
+PROFILE_QUERY = "profile"
+PROFILE_ID_HEADER = "X-Qlue-Profile-Id"
+# the time between two samples of the stacks in seconds
+SAMPLE_INTERVAL = 0.001
+# the number of profiles that are kept, older ones are removed
+MAX_PROFILES = 200
+# the number of functions in the summary of cProfile
+SUMMARY_LINES = 40
+# the functions in which idle threads wait, such that their samples can be dropped
+_IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# the user that the view of the current profiled request authenticated, None outside
+# of profiled requests
+_AUTHENTICATED_USER: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "qlue_authenticated_user", default=None
+)
+
+
+def wants_profile(request) -> bool:
+    """
+    Does the request ask to be profiled ?
+    """
+    return PROFILE_HEADER in request.headers or PROFILE_QUERY in request.GET
+
+
+def may_profile(request) -> bool:
+    """
+    Could the request come from a staff user ? Either a staff user is logged in or the
+    request has credentials, which the view checks.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    params = request.POST if request.method == "POST" else request.GET
+    return "username" in params and "password" in params
+
+
+def record_authenticated_user(user) -> None:
+    """
+    Remember the user that the view authenticated. Nothing happens outside of profiled
+    requests.
+    """
+    authenticated = _AUTHENTICATED_USER.get()
+    if authenticated is not None:
+        authenticated["user"] = user
+
+
+def profiling_user(request, authenticated_user) -> Optional[str]:
+    """
+    The staff user that asked for the profile, None if the user may not profile.
+
+    Args:
+        request: The profiled request
+        authenticated_user: The user that the view authenticated, if any
+    """
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        user = authenticated_user
+    if user is None or not user.is_staff:
+        return None
+    return user.username
+
+
+def _frame_label(frame) -> str:
+    """
+    The name of the function of a frame together with its file and line.
+    """
+    code = frame.f_code
+    filename = "/".join(code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    The profiler that records the stacks of all busy threads in regular intervals.
+
+    Args:
+        interval: The time between two samples in seconds
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_names: Dict[int, str] = {}
+
+    def start(self) -> None:
+        """
+        Start to take samples in a background thread.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="qlue-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop to take samples.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        """
+        The stacks in the folded format, one line per stack with the root first,
+        followed by the number of samples.
+        """
+        return "\n".join(
+            stack + " " + str(count) for stack, count in self.stacks.most_common()
+        )
+
+    def _run(self) -> None:
+        """
+        Take samples until the profiler is stopped.
+        """
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self._sample(own_id)
+
+    def _sample(self, own_id: int) -> None:
+        """
+        Record the current stack of every thread that is not idle.
+        """
+        # pylint: disable=W0212
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            if leaf in _IDLE_FUNCTIONS:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if thread_id not in self._thread_names:
+                self._thread_names = {
+                    thread.ident: thread.name for thread in threading.enumerate()
+                }
+            labels.append(self._thread_names.get(thread_id, str(thread_id)))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.num_samples += 1
+
+
+class RequestProfiler:
+    """
+    Both profilers for a single request.
+    """
+
+    def __init__(self):
+        self.sampler = SamplingProfiler()
+        self.profile = cProfile.Profile()
+        self.duration = 0.0
+        self.authenticated: dict = {}
+        self._start = 0.0
+        self._token: Optional[contextvars.Token] = None
+
+    @property
+    def authenticated_user(self):
+        """
+        The user that the view authenticated, None if it did not.
+        """
+        return self.authenticated.get("user")
+
+    def start(self) -> None:
+        """
+        Start both profilers on the current thread.
+        """
+        self._token = _AUTHENTICATED_USER.set(self.authenticated)
+        self._start = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self) -> None:
+        """
+        Stop both profilers on the thread that started them.
+        """
+        self.profile.disable()
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self._start
+        _AUTHENTICATED_USER.reset(self._token)
+
+    def save(self, request, response, username: str) -> RequestProfile:
+        """
+        Keep the profile of the request and remove the oldest profiles beyond
+        `MAX_PROFILES`.
+
+        Args:
+            request: The profiled request
+            response: The answer to the request
+            username: The staff user that asked for the profile
+
+        Returns:
+            The stored profile
+        """
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=summary)
+        stats.sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        self.profile.create_stats()
+        # the password of the api must not end up in the database
+        query = request.GET.copy()
+        query.pop("password", None)
+        path = request.path + ("?" + query.urlencode() if query else "")
+        profile = RequestProfile.objects.create(
+            username=username,
+            method=request.method,
+            path=path[:500],
+            status_code=response.status_code,
+            duration=self.duration,
+            num_samples=self.sampler.num_samples,
+            summary=summary.getvalue(),
+            folded_stacks=self.sampler.folded(),
+            stats=marshal.dumps(self.profile.stats),
+        )
+        old_ids = RequestProfile.objects.order_by("-created", "-id").values_list(
+            "id", flat=True
+        )[MAX_PROFILES:]
+        RequestProfile.objects.filter(id__in=list(old_ids)).delete()
+        return profile
@@ -0,0 +1,282 @@
+"""
+The module that keeps the counters and the rolling statistics of the queues up to date.
+They are updated incrementally whenever a job enters the queue, leaves it or finishes,
+which is much cheaper than listing the folders of the storage.
+"""
+import datetime
+from typing import List, Optional
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Backend, QueueStats
+from .tracing import record_span
+
+# pylint: disable=E1101
+
+# weight of the newest observation in the moving averages
+SMOOTHING = 0.2
+# number of observations that are kept for the percentiles and the throughput
+NUM_SAMPLES = 200
+# time window in seconds for the throughput
+THROUGHPUT_WINDOW = 900
+
+
+def get_queue_stats(backend: Backend) -> QueueStats:
+    """
+    Get the counters of the queue of a backend.
+
+    Args:
+        backend: The backend
+
+    Returns:
+        The counters, which are created if the backend has none yet
+    """
+    stats, _ = QueueStats.objects.get_or_create(backend=backend)
+    return stats
+
+
+def submission_time(job_id: str) -> datetime.datetime:
+    """
+    Get the time at which a job was submitted from the timestamp at the beginning of
+    its job id.
+
+    Args:
+        job_id: The id of the job
+
+    Returns:
+        The time of the submission
+    """
+    return datetime.datetime.strptime(job_id[:15], "%Y%m%d_%H%M%S").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def record_enqueue(backend: Backend) -> None:
+    """
+    Count a job that entered the queue of the backend.
+
+    Args:
+        backend: The backend of the queue
+    """
+    get_queue_stats(backend)
+    with transaction.atomic():
+        stats = QueueStats.objects.select_for_update().get(backend=backend)
+        if stats.queued == 0:
+            stats.busy_since = timezone.now()
+        stats.queued += 1
+        stats.save()
+
+
+def record_dequeue(
+    backend: Backend,
+    running_id: str,
+    job_ids: List[str],
+    running_traces: Optional[List[List[str]]] = None,
+) -> None:
+    """
+    Count jobs that the spooler obtained from the queue of the backend and update the
+    rate at which the queue drains. The time in which the queue was empty does not
+    count towards the drain rate.
+
+    Args:
+        backend: The backend of the queue
+        running_id: The id of the job that the spooler works on now
+        job_ids: The ids of the jobs that left the queue with it. They differ from the
+            `running_id` if the jobs were coalesced into a batch.
+        running_traces: The traced jobs as described in `QueueStats`, such that
+            `record_completion` can end their `job.running` spans
+    """
+    get_queue_stats(backend)
+    now = timezone.now()
+    with transaction.atomic():
+        stats = QueueStats.objects.select_for_update().get(backend=backend)
+        starts = [time for time in (stats.last_dequeue, stats.busy_since) if time]
+        if starts:
+            interval = (now - max(starts)).total_seconds() / len(job_ids)
+            if stats.drain_interval is None:
+                stats.drain_interval = interval
+            else:
+                stats.drain_interval = (
+                    1 - SMOOTHING
+                ) * stats.drain_interval + SMOOTHING * interval
+        stats.queued = max(stats.queued - len(job_ids), 0)
+        stats.last_dequeue = now
+        if stats.queued == 0:
+            stats.busy_since = None
+        for job_id in job_ids:
+            try:
+                wait = (now - submission_time(job_id)).total_seconds()
+            except ValueError:
+                continue
+            stats.queue_waits = _append_sample(stats.queue_waits, wait)
+        stats.running[running_id] = now.timestamp()
+        stats.running_jobs[running_id] = job_ids
+        if running_traces:
+            stats.running_traces[running_id] = running_traces
+        stats.save()
+
+
+def record_drop(backend: Backend, num_jobs: int) -> None:
+    """
+    Count jobs that left the queue without reaching the spooler, e.g. stale entries of
+    the index whose file is gone. They do not change the drain rate.
+
+    Args:
+        backend: The backend of the queue
+        num_jobs: The number of dropped jobs
+    """
+    if not num_jobs:
+        return
+    get_queue_stats(backend)
+    with transaction.atomic():
+        stats = QueueStats.objects.select_for_update().get(backend=backend)
+        stats.queued = max(stats.queued - num_jobs, 0)
+        if stats.queued == 0:
+            stats.busy_since = None
+        stats.save()
+
+
+def finished_job_ids(backend: Backend, running_ids: List[str]) -> List[str]:
+    """
+    Get the jobs that the spooler obtained from the queue and that left the running
+    jobs since.
+
+    Args:
+        backend: The backend of the jobs
+        running_ids: The ids of the jobs of the backend that are still running
+
+    Returns:
+        The ids of the finished jobs, which are still counted as running
+    """
+    stats = get_queue_stats(backend)
+    return [job_id for job_id in stats.running if job_id not in running_ids]
+
+
+def record_completion(backend: Backend, job_ids: List[str]) -> None:
+    """
+    Count jobs that the spooler finished and end the `job.running` spans of the traced
+    ones. Jobs that were not obtained from the queue through `record_dequeue` are
+    ignored, such that a job is only counted once.
+
+    Args:
+        backend: The backend of the jobs
+        job_ids: The ids of the finished jobs
+    """
+    stats = get_queue_stats(backend)
+    if not any(job_id in stats.running for job_id in job_ids):
+        return
+    now = timezone.now().timestamp()
+    with transaction.atomic():
+        stats = QueueStats.objects.select_for_update().get(backend=backend)
+        for job_id in job_ids:
+            start = stats.running.pop(job_id, None)
+            stats.running_jobs.pop(job_id, None)
+            if start is None:
+                continue
+            stats.execution_times = _append_sample(stats.execution_times, now - start)
+            stats.completions = _append_sample(stats.completions, now)
+            for traced_id, traceparent, span_id in stats.running_traces.pop(job_id, []):
+                record_span(
+                    "job.running",
+                    traceparent,
+                    start,
+                    now,
+                    {"qlue.job_id": traced_id, "qlue.backend": backend.name},
+                    span_id=span_id,
+                )
+        stats.save()
+
+
+def count_running_jobs(stats: QueueStats, username: str) -> int:
+    """
+    Count the jobs of a user that the spooler currently works on, including the jobs
+    within running batches.
+
+    Args:
+        stats: The counters of the queue
+        username: The user
+
+    Returns:
+        The number of running jobs of the user
+    """
+    num_jobs = 0
+    for running_id in stats.running:
+        for job_id in stats.running_jobs.get(running_id, [running_id]):
+            if job_id.split("-")[2:3] == [username]:
+                num_jobs += 1
+    return num_jobs
+
+
+def drain_time(stats: QueueStats, num_jobs: int) -> Optional[float]:
+    """
+    Estimate how long it takes until a number of jobs left the queue.
+
+    Args:
+        stats: The counters of the queue
+        num_jobs: The number of jobs that have to leave the queue
+
+    Returns:
+        The estimated time in seconds or None if we never saw the queue drain
+    """
+    if stats.drain_interval is None:
+        return None
+    return stats.drain_interval * num_jobs
+
+
+def estimated_start(stats: QueueStats, num_ahead: int) -> Optional[str]:
+    """
+    Estimate when a queued job is given to the spooler.
+
+    Args:
+        stats: The counters of the queue
+        num_ahead: The number of jobs that run before the job
+
+    Returns:
+        The estimated start as ISO 8601 string or None if we never saw the queue drain
+    """
+    wait = drain_time(stats, num_ahead + 1)
+    if wait is None:
+        return None
+    return (timezone.now() + datetime.timedelta(seconds=wait)).isoformat()
+
+
+def summarize_queue_stats(stats: QueueStats) -> dict:
+    """
+    Summarize the statistics of a queue.
+
+    Args:
+        stats: The counters of the queue
+
+    Returns:
+        A dict with the queue depth, the running jobs, the throughput in jobs per
+        minute, the percentiles of the queue wait and the execution time in seconds
+        and the estimated start of a job that is submitted now.
+    """
+    now = timezone.now().timestamp()
+    recent = [time for time in stats.completions if now - time <= THROUGHPUT_WINDOW]
+    summary_dict = {
+        "backend_name": stats.backend.name,
+        "queue_depth": stats.queued,
+        "running": len(stats.running),
+        "jobs_per_minute": 60 * len(recent) / THROUGHPUT_WINDOW,
+        "estimated_start": estimated_start(stats, stats.queued),
+    }
+    for name, samples in (
+        ("queue_wait", stats.queue_waits),
+        ("execution_time", stats.execution_times),
+    ):
+        for percent in (50, 95):
+            key = name + "_p" + str(percent)
+            summary_dict[key] = (
+                float(np.percentile(samples, percent)) if samples else None
+            )
+    return summary_dict
+
+
+def _append_sample(samples: list, value: float) -> list:
+    """
+    Append a sample and drop the oldest ones beyond `NUM_SAMPLES`.
+    """
+    return (samples + [value])[-NUM_SAMPLES:]
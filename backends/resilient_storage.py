@@ -0,0 +1,546 @@
+"""
+The module that keeps a slow or failing storage from taking the workers down with it.
+The `ResilientProvider` wraps any storage provider and
+
+    gives every call a timeout, after which the caller gets a `StorageUnavailable`
+        while the call itself is abandoned in the background
+    repeats the reads that failed with a `StorageUnavailable`, after a backoff with
+        full jitter. Writes are never repeated.
+    sends a read a second time if the first one takes longer than the given quantile
+        of the recent reads of the same method and takes whatever answers first
+    stops calling the storage for `reset_seconds` once `failure_threshold` calls in
+        a row were unavailable. Then every call fails at once until a single trial
+        call finds the storage healthy again.
+
+Everything that goes wrong becomes a `StorageError`, such that the views can tell an
+unavailable storage (503) from a missing file. Retries count towards the metric
+`qlue_storage_retries_total` of the `InstrumentedProvider`, so the instrumentation
+should wrap the `ResilientProvider` and not the other way around.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from decouple import config
+
+from .metrics import REGISTRY
+from .storage_providers import (
+    StorageError,
+    StorageNotFoundError,
+    StorageProvider,
+    StorageUnavailable,
+    path_prefix,
+)
+
+# the methods that only read and can therefore be repeated and hedged
+READ_METHODS = ("get_file_content", "get_file_queue", "get_file_bytes")
+# the number of recent latencies per method from which the hedge delay is taken
+LATENCY_WINDOW = 200
+# the number of latencies that are needed before reads are hedged
+MIN_HEDGE_SAMPLES = 20
+
+
+def typed_error(err: BaseException) -> StorageError:
+    """
+    The `StorageError` for an exception of a storage provider.
+    """
+    if isinstance(err, StorageError):
+        return err
+    if isinstance(err, FileNotFoundError):
+        return StorageNotFoundError(str(err))
+    if isinstance(err, (ConnectionError, TimeoutError)):
+        return StorageUnavailable(str(err) or type(err).__name__)
+    if isinstance(err, SystemExit):
+        return StorageError("The storage provider gave up: " + str(err.code))
+    return StorageError(str(err) or type(err).__name__)
+
+
+class CircuitBreaker:
+    """
+    The breaker that stops the calls to a storage that is unavailable.
+
+    Args:
+        failure_threshold: The number of unavailable calls in a row that open it
+        reset_seconds: The time after which a single trial call is let through
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        "closed" if calls go through, "open" if they fail at once and "half_open" if
+        the next call is a trial.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half_open"
+
+    def check(self) -> None:
+        """
+        Let a call through or reject it.
+
+        Raises:
+            StorageUnavailable: If the breaker is open or a trial call is running
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_seconds:
+                raise StorageUnavailable(
+                    "The storage is unhealthy", retry_after=self.reset_seconds - waited
+                )
+            if self._trial_running:
+                raise StorageUnavailable("The storage is unhealthy", retry_after=1.0)
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        """
+        Close the breaker after the storage answered.
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """
+        Count an unavailable call and open the breaker if there were too many.
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class ResilientProvider(StorageProvider):
+    """
+    The wrapper of any storage provider that bounds the time that a call may take and
+    stops calling a storage that is down, see the module.
+
+    Args:
+        provider: The storage provider that is protected
+        timeout: The timeout of a single attempt in seconds, or the timeouts keyed by
+            the name of the method with the key "*" for all other methods. It is
+            taken from the `STORAGE_TIMEOUT` setting if it is not given.
+        retries: The number of times that an unavailable read is repeated. It is
+            taken from the `STORAGE_RETRIES` setting if it is not given.
+        backoff: The largest wait before the first retry in seconds. It doubles with
+            every further retry.
+        hedge_quantile: The quantile of the recent latencies after which a second
+            read is sent. No hedging if None.
+        failure_threshold: The number of unavailable calls in a row that open the
+            circuit breaker. It is taken from the `STORAGE_FAILURE_THRESHOLD` setting
+            if it is not given.
+        reset_seconds: The time for which the circuit breaker stays open. It is taken
+            from the `STORAGE_RESET_SECONDS` setting if it is not given.
+        max_workers: The number of threads that run the synchronous calls
+    """
+
+    # pylint: disable=R0902
+
+    def __init__(
+        self,
+        provider: StorageProvider,
+        *,
+        timeout: Union[float, Dict[str, float]] = None,
+        retries: int = None,
+        backoff: float = 0.1,
+        hedge_quantile: Optional[float] = 0.95,
+        failure_threshold: int = None,
+        reset_seconds: float = None,
+        max_workers: int = 32,
+    ):
+        """
+        Set up the wrapper.
+        """
+        # pylint: disable=R0913
+        self.provider = provider
+        if timeout is None:
+            timeout = config("STORAGE_TIMEOUT", default=10.0, cast=float)
+        self.timeouts = timeout if isinstance(timeout, dict) else {"*": timeout}
+        if retries is None:
+            retries = config("STORAGE_RETRIES", default=2, cast=int)
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_quantile = hedge_quantile
+        if failure_threshold is None:
+            failure_threshold = config("STORAGE_FAILURE_THRESHOLD", default=5, cast=int)
+        if reset_seconds is None:
+            reset_seconds = config("STORAGE_RESET_SECONDS", default=30.0, cast=float)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="qlue-storage"
+        )
+
+    def __getattr__(self, name: str):
+        """
+        Everything else comes from the wrapped provider.
+        """
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+
+    def timeout(self, method: str) -> float:
+        """
+        The timeout of a single attempt of a method in seconds.
+        """
+        return self.timeouts.get(method, self.timeouts.get("*", 10.0))
+
+    def hedge_delay(self, method: str) -> Optional[float]:
+        """
+        The time after which a read is sent a second time, None if it is not hedged.
+        """
+        if self.hedge_quantile is None or method not in READ_METHODS:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies.get(method, ()))
+        if len(latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        return latencies[
+            min(int(self.hedge_quantile * len(latencies)), -1 + len(latencies))
+        ]
+
+    def _observe(self, method: str, seconds: float) -> None:
+        """
+        Remember the latency of a successful attempt.
+        """
+        with self._lock:
+            if method not in self._latencies:
+                self._latencies[method] = deque(maxlen=LATENCY_WINDOW)
+            self._latencies[method].append(seconds)
+
+    def _attempts(self, method: str) -> List[float]:
+        """
+        The waits before each attempt of a call. Only reads are repeated.
+        """
+        if method not in READ_METHODS:
+            return [0.0]
+        return [0.0] + [
+            random.uniform(0, self.backoff * 2**retry)
+            for retry in range(self.retries)
+        ]
+
+    def _admit(self, labels: Dict[str, str]) -> None:
+        """
+        Ask the circuit breaker and count the rejected calls.
+        """
+        try:
+            self.breaker.check()
+        except StorageUnavailable:
+            REGISTRY.increment("qlue_storage_rejected_total", labels)
+            raise
+
+    def _settle(self, error: Optional[StorageError]) -> None:
+        """
+        Tell the circuit breaker how an attempt went. Every answer of the storage,
+        also a missing file, shows that it is available.
+        """
+        if isinstance(error, StorageUnavailable):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _timed(self, method: str, call: Callable[[], Any]) -> Any:
+        """
+        Run a synchronous attempt in a worker thread of the wrapper.
+        """
+        start = time.perf_counter()
+        try:
+            result = call()
+        except BaseException as err:  # pylint: disable=W0703
+            raise typed_error(err) from err
+        self._observe(method, time.perf_counter() - start)
+        return result
+
+    def _call(self, method: str, storage_path: str, call: Callable[[], Any]) -> Any:
+        """
+        Make a synchronous call with retries, hedging and the circuit breaker.
+        """
+        labels = {"method": method, "prefix": path_prefix(storage_path)}
+        error: Optional[StorageError] = None
+        for attempt, wait_seconds in enumerate(self._attempts(method)):
+            if attempt:
+                REGISTRY.increment("qlue_storage_retries_total", labels)
+                time.sleep(wait_seconds)
+            self._admit(labels)
+            try:
+                result = self._attempt(method, call, labels)
+            except StorageError as err:
+                self._settle(err)
+                if not isinstance(err, StorageUnavailable):
+                    raise
+                error = err
+                continue
+            self._settle(None)
+            return result
+        raise error
+
+    def _attempt(
+        self, method: str, call: Callable[[], Any], labels: Dict[str, str]
+    ) -> Any:
+        """
+        A single attempt, which is hedged for reads, within the timeout.
+        """
+        deadline = time.perf_counter() + self.timeout(method)
+        futures = {self._executor.submit(self._timed, method, call)}
+        hedge_delay = self.hedge_delay(method)
+        if hedge_delay is not None and hedge_delay < self.timeout(method):
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                REGISTRY.increment("qlue_storage_hedges_total", labels)
+                futures.add(self._executor.submit(self._timed, method, call))
+        error: Optional[StorageError] = None
+        while futures:
+            done, futures = wait(
+                futures,
+                timeout=max(0.0, deadline - time.perf_counter()),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                break
+            for future in done:
+                result, error = self._outcome(future)
+                if error is None:
+                    return result
+                if not isinstance(error, StorageUnavailable):
+                    raise error
+        for future in futures:
+            future.cancel()
+        if error is not None and not futures:
+            raise error
+        raise StorageUnavailable(
+            method + " took longer than " + str(self.timeout(method)) + " s"
+        )
+
+    @staticmethod
+    def _outcome(future: Future) -> Tuple[Any, Optional[StorageError]]:
+        """
+        The result of a finished attempt or its error.
+        """
+        try:
+            return future.result(), None
+        except StorageError as err:
+            return None, err
+
+    async def _atimed(self, method: str, make_call: Callable[[], Awaitable]) -> Any:
+        """
+        Run an asynchronous attempt.
+        """
+        start = time.perf_counter()
+        try:
+            result = await make_call()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as err:  # pylint: disable=W0703
+            raise typed_error(err) from err
+        self._observe(method, time.perf_counter() - start)
+        return result
+
+    async def _acall(
+        self, method: str, storage_path: str, make_call: Callable[[], Awaitable]
+    ) -> Any:
+        """
+        Make an asynchronous call with retries, hedging and the circuit breaker.
+        """
+        labels = {"method": method, "prefix": path_prefix(storage_path)}
+        error: Optional[StorageError] = None
+        for attempt, wait_seconds in enumerate(self._attempts(method)):
+            if attempt:
+                REGISTRY.increment("qlue_storage_retries_total", labels)
+                await asyncio.sleep(wait_seconds)
+            self._admit(labels)
+            try:
+                result = await self._aattempt(method, make_call, labels)
+            except StorageError as err:
+                self._settle(err)
+                if not isinstance(err, StorageUnavailable):
+                    raise
+                error = err
+                continue
+            self._settle(None)
+            return result
+        raise error
+
+    async def _aattempt(
+        self, method: str, make_call: Callable[[], Awaitable], labels: Dict[str, str]
+    ) -> Any:
+        """
+        A single asynchronous attempt, which is hedged for reads, within the timeout.
+        """
+        deadline = time.perf_counter() + self.timeout(method)
+        tasks = {asyncio.ensure_future(self._atimed(method, make_call))}
+        hedge_delay = self.hedge_delay(method)
+        try:
+            if hedge_delay is not None and hedge_delay < self.timeout(method):
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    REGISTRY.increment("qlue_storage_hedges_total", labels)
+                    tasks.add(asyncio.ensure_future(self._atimed(method, make_call)))
+            error: Optional[StorageError] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks,
+                    timeout=max(0.0, deadline - time.perf_counter()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for task in done:
+                    result, error = self._outcome(task)
+                    if error is None:
+                        return result
+                    if not isinstance(error, StorageUnavailable):
+                        raise error
+            if error is not None and not tasks:
+                raise error
+            raise StorageUnavailable(
+                method + " took longer than " + str(self.timeout(method)) + " s"
+            )
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def upload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Upload the file to the storage
+        """
+        self._call(
+            "upload", storage_path, lambda: self.provider.upload(dump_str, storage_path)
+        )
+
+    def get_file_content(self, storage_path: str) -> str:
+        """
+        Get the file content from the storage
+        """
+        return self._call(
+            "get_file_content",
+            storage_path,
+            lambda: self.provider.get_file_content(storage_path),
+        )
+
+    def get_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get a list of files
+        """
+        return self._call(
+            "get_file_queue",
+            storage_path,
+            lambda: self.provider.get_file_queue(storage_path),
+        )
+
+    def move_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        self._call(
+            "move_file",
+            start_path,
+            lambda: self.provider.move_file(start_path, final_path),
+        )
+
+    def delete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+        self._call(
+            "delete_file", storage_path, lambda: self.provider.delete_file(storage_path)
+        )
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Upload binary data to the storage
+        """
+        self._call(
+            "upload_bytes",
+            storage_path,
+            lambda: self.provider.upload_bytes(data, storage_path),
+        )
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Get the binary content of a file from the storage
+        """
+        return self._call(
+            "get_file_bytes",
+            storage_path,
+            lambda: self.provider.get_file_bytes(storage_path),
+        )
+
+    def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Remove many files from the storage
+        """
+        if storage_paths:
+            self._call(
+                "delete_files",
+                storage_paths[0],
+                lambda: self.provider.delete_files(storage_paths),
+            )
+
+    async def aupload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Upload the file to the storage
+        """
+        await self._acall(
+            "upload",
+            storage_path,
+            lambda: self.provider.aupload(dump_str, storage_path),
+        )
+
+    async def aget_file_content(self, storage_path: str) -> str:
+        """
+        Get the file content from the storage
+        """
+        return await self._acall(
+            "get_file_content",
+            storage_path,
+            lambda: self.provider.aget_file_content(storage_path),
+        )
+
+    async def aget_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get a list of files
+        """
+        return await self._acall(
+            "get_file_queue",
+            storage_path,
+            lambda: self.provider.aget_file_queue(storage_path),
+        )
+
+    async def amove_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        await self._acall(
+            "move_file",
+            start_path,
+            lambda: self.provider.amove_file(start_path, final_path),
+        )
+
+    async def adelete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+        await self._acall(
+            "delete_file",
+            storage_path,
+            lambda: self.provider.adelete_file(storage_path),
+        )
@@ -0,0 +1,173 @@
+"""
+The module that stores results in chunks. Instead of a single `result-<job_id>.json`, a
+chunked result is a folder `result-<job_id>/` with a small manifest and one file per
+experiment:
+
+    /Backend_files/Result/<backend>/<user>/result-<job_id>/manifest.json
+    /Backend_files/Result/<backend>/<user>/result-<job_id>/experiment-<index>.json
+
+The manifest contains the top-level fields of the result, the names of the experiments
+that were written so far and whether the result is complete. A spooler writes the
+chunk of each experiment as soon as it is done and updates the manifest afterwards,
+such that the manifest never points to a missing chunk. It marks the status of the
+job with `"result_layout": "chunked"`, so qlue knows where to look without trying
+both layouts.
+
+Clients can read a chunked result while the job is still running and a request for
+some experiments only reads the chunks of these experiments.
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+from .jobs import result_json_path
+from .results import resolve_selection
+from .storage_providers import StorageProvider
+
+CHUNKED_LAYOUT = "chunked"
+# the number of chunks that are read from the storage at the same time
+MAX_PARALLEL_READS = 16
+
+
+def is_chunked(status_msg_dict: dict) -> bool:
+    """
+    Is the result of the job with this status stored in chunks ?
+    """
+    return status_msg_dict.get("result_layout") == CHUNKED_LAYOUT
+
+
+def result_dir(backend_name: str, job_id: str) -> str:
+    """
+    The folder of a chunked result.
+    """
+    return result_json_path(backend_name, job_id)[: -len(".json")] + "/"
+
+
+def manifest_path(backend_name: str, job_id: str) -> str:
+    """
+    The path of the manifest of a chunked result.
+    """
+    return result_dir(backend_name, job_id) + "manifest.json"
+
+
+def chunk_path(backend_name: str, job_id: str, index: int) -> str:
+    """
+    The path of the chunk with the result of a single experiment.
+    """
+    return result_dir(backend_name, job_id) + "experiment-" + str(index) + ".json"
+
+
+def write_result_chunk(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    job_id: str,
+    manifest: dict,
+    exp_result: dict,
+    *,
+    complete: bool = False,
+) -> dict:
+    """
+    Append the result of an experiment to a chunked result.
+
+    Args:
+        storage_provider: The storage of the result
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        manifest: The current manifest. An empty dict for the first experiment.
+        exp_result: The result of the experiment
+        complete: Is this the last experiment of the job ?
+
+    Returns:
+        The updated manifest
+    """
+    # pylint: disable=R0913
+    manifest = dict(manifest)
+    manifest.setdefault("job_id", job_id)
+    manifest.setdefault("result", {})
+    experiments = list(manifest.get("experiments", []))
+    storage_provider.upload(
+        dump_str=json.dumps(exp_result),
+        storage_path=chunk_path(backend_name, job_id, len(experiments)),
+    )
+    experiments.append({"name": (exp_result.get("header") or {}).get("name")})
+    manifest["experiments"] = experiments
+    manifest["complete"] = complete
+    storage_provider.upload(
+        dump_str=json.dumps(manifest),
+        storage_path=manifest_path(backend_name, job_id),
+    )
+    return manifest
+
+
+def _assemble(manifest: dict, chunks: List[str]) -> dict:
+    """
+    Put the result together from the manifest and the chunks that were read.
+    """
+    result_dict = dict(manifest.get("result", {}))
+    result_dict["results"] = [json.loads(chunk) for chunk in chunks]
+    if not manifest.get("complete"):
+        result_dict["partial"] = True
+    return result_dict
+
+
+def load_chunked_result(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    job_id: str,
+    experiments: Optional[str] = None,
+) -> dict:
+    """
+    Read a chunked result from the storage.
+
+    Args:
+        storage_provider: The storage of the result
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        experiments: The selected experiments as in `select_experiments`. Only their
+            chunks are read.
+
+    Returns:
+        The result with the selected experiments that were written so far. It has
+        `"partial": True` as long as the result is not complete.
+
+    Raises:
+        UnknownExperimentError: If a selected experiment is not part of the result
+            (yet).
+    """
+    manifest = json.loads(
+        storage_provider.get_file_content(manifest_path(backend_name, job_id))
+    )
+    names = [entry.get("name") for entry in manifest.get("experiments", [])]
+    chunks = [
+        storage_provider.get_file_content(chunk_path(backend_name, job_id, index))
+        for index in resolve_selection(names, experiments)
+    ]
+    return _assemble(manifest, chunks)
+
+
+async def aload_chunked_result(
+    storage_provider: StorageProvider,
+    backend_name: str,
+    job_id: str,
+    experiments: Optional[str] = None,
+) -> dict:
+    """
+    Read a chunked result from the storage with up to `MAX_PARALLEL_READS` chunks at
+    the same time. See `load_chunked_result` for the details.
+    """
+    manifest = json.loads(
+        await storage_provider.aget_file_content(manifest_path(backend_name, job_id))
+    )
+    names = [entry.get("name") for entry in manifest.get("experiments", [])]
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_READS)
+
+    async def read_chunk(index: int) -> str:
+        async with semaphore:
+            return await storage_provider.aget_file_content(
+                chunk_path(backend_name, job_id, index)
+            )
+
+    chunks = await asyncio.gather(
+        *(read_chunk(index) for index in resolve_selection(names, experiments))
+    )
+    return _assemble(manifest, chunks)
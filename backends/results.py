@@ -0,0 +1,193 @@
+"""
+The module that shapes results before they are sent. Clients may only ask for some
+experiments of a job and for the counts of the outcomes instead of the shot memory.
+
+The counts are computed once per result with numpy and kept in a small cache, as
+results do not change anymore once a job is done. Repeated requests for the counts of
+a job are then answered without reading the result from the storage.
+"""
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .encodings import is_packed, memory_array, unpack_array
+
+# the number of results whose counts are kept in memory
+MAX_CACHED_COUNTS = 256
+
+# the results in counts form, keyed by the backend name, the job id and the selected
+# experiments
+_COUNTS_CACHE: "OrderedDict[tuple, dict]" = OrderedDict()
+
+
+class UnknownExperimentError(ValueError):
+    """
+    A selected experiment is not part of the result.
+    """
+
+
+def count_memory(memory) -> Dict[str, int]:
+    """
+    Count how often each outcome appears in the shot memory of an experiment.
+
+    Args:
+        memory: The shot memory, either packed or as list of strings
+
+    Returns:
+        The number of shots of each outcome, keyed by the outcome in the format of the
+        strings of the memory
+    """
+    if isinstance(memory, dict):
+        array, separator = unpack_array(memory), memory["separator"]
+    else:
+        parsed = memory_array(memory)
+        if parsed is None:
+            # outcomes in another format, e.g. hexadecimal, are counted as strings
+            return dict(Counter(memory))
+        array, separator = parsed
+    outcomes, counts = np.unique(array, axis=0, return_counts=True)
+    return {
+        separator.join(map(str, outcome)): count
+        for outcome, count in zip(outcomes.tolist(), counts.tolist())
+    }
+
+
+def counts_result(result_dict: dict) -> dict:
+    """
+    Replace the shot memory of every experiment of a result by its counts.
+
+    Args:
+        result_dict: The result with the shot memory, packed or not
+
+    Returns:
+        A copy of the result with `counts` instead of `memory` in the data of each
+        experiment
+    """
+    counted_result = dict(result_dict)
+    counted_result["results"] = []
+    for exp_result in result_dict.get("results", []):
+        memory = exp_result.get("data", {}).get("memory")
+        if memory is not None and (is_packed(exp_result) or isinstance(memory, list)):
+            exp_data = dict(exp_result["data"])
+            del exp_data["memory"]
+            exp_data["counts"] = count_memory(memory)
+            exp_result = dict(exp_result, data=exp_data)
+        counted_result["results"].append(exp_result)
+    return counted_result
+
+
+def resolve_selection(
+    names: List[Optional[str]], experiments: Optional[str]
+) -> List[int]:
+    """
+    Find the indices of the selected experiments.
+
+    Args:
+        names: The name of each experiment of the result
+        experiments: The experiments as comma separated list of their indices or their
+            names. All experiments if None.
+
+    Returns:
+        The indices of the selected experiments in the requested order
+
+    Raises:
+        UnknownExperimentError: If an experiment is not part of the result.
+    """
+    if experiments is None:
+        return list(range(len(names)))
+    indices = []
+    for item in experiments.split(","):
+        item = item.strip()
+        if item in names:
+            indices.append(names.index(item))
+        elif item.isdigit() and int(item) < len(names):
+            indices.append(int(item))
+        else:
+            raise UnknownExperimentError("The result has no experiment " + item + "!")
+    return indices
+
+
+def select_experiments(result_dict: dict, experiments: Optional[str]) -> dict:
+    """
+    Keep only some experiments of a result.
+
+    Args:
+        result_dict: The result
+        experiments: The experiments as comma separated list of their indices or their
+            names. All experiments if None.
+
+    Returns:
+        A copy of the result with the selected experiments in the requested order
+
+    Raises:
+        UnknownExperimentError: If an experiment is not part of the result.
+    """
+    if experiments is None:
+        return result_dict
+    exp_results = result_dict.get("results", [])
+    names = [experiment_name(exp_result) for exp_result in exp_results]
+    indices = resolve_selection(names, experiments)
+    return dict(result_dict, results=[exp_results[ii] for ii in indices])
+
+
+def experiment_name(exp_result: dict) -> Optional[str]:
+    """
+    The name of an experiment in the result, which is kept in its header.
+    """
+    header = exp_result.get("header") or {}
+    return header.get("name", exp_result.get("name"))
+
+
+def cached_counts(
+    backend_name: str, job_id: str, experiments: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Get the counts of a result if they are in the cache.
+
+    Args:
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        experiments: The selected experiments as in `select_experiments`
+
+    Returns:
+        The selected experiments of the result in counts form or None
+    """
+    key = (backend_name, job_id, experiments)
+    if key not in _COUNTS_CACHE:
+        return None
+    _COUNTS_CACHE.move_to_end(key)
+    return _COUNTS_CACHE[key]
+
+
+def cache_counts(
+    backend_name: str, job_id: str, result_dict: dict, experiments: Optional[str] = None
+) -> dict:
+    """
+    Compute the counts form of the result of a done job and keep it in the cache.
+
+    Args:
+        backend_name: The name of the backend of the job
+        job_id: The id of the job
+        result_dict: The selected experiments of the result with their shot memory
+        experiments: The selected experiments as in `select_experiments`
+
+    Returns:
+        The result in counts form
+    """
+    counted_result = counts_result(result_dict)
+    _COUNTS_CACHE[(backend_name, job_id, experiments)] = counted_result
+    while len(_COUNTS_CACHE) > MAX_CACHED_COUNTS:
+        _COUNTS_CACHE.popitem(last=False)
+    return counted_result
+
+
+def clear_counts_cache(job_ids: List[str] = None) -> None:
+    """
+    Remove results from the cache, all of them if no job ids are given.
+    """
+    if job_ids is None:
+        _COUNTS_CACHE.clear()
+        return
+    for key in [key for key in _COUNTS_CACHE if key[1] in job_ids]:
+        del _COUNTS_CACHE[key]
@@ -0,0 +1,246 @@
+"""
+The module that decides in which order the queued jobs of a backend are given to the
+spooler.
+
+Every submitted job gets an entry in the `QueueEntry` index, independent of the policy
+of the backend, such that the policy can be switched in the admin at any time. The
+policies that work on the index only look at the head of an ordered database index,
+so the dequeue stays logarithmic in the length of the queue.
+"""
+from abc import ABC, abstractmethod
+from typing import List
+
+from django.db.models import Q
+
+from .models import Backend, QueueEntry, User
+from .storage_providers import StorageProvider
+
+# pylint: disable=E1101
+
+
+class SchedulingPolicy(ABC):
+    """
+    The template for the scheduling policies of the backends.
+    """
+
+    @staticmethod
+    def enqueue(
+        backend: Backend, username: str, job_id: str, traceparent: str = ""
+    ) -> QueueEntry:
+        """
+        Add a freshly submitted job to the index of the queue.
+
+        The virtual finishing time follows the weighted fair queuing. A job starts at
+        the virtual time of the head of the queue or after the last queued job of the
+        same user, whatever is later, and it takes `1 / queue_weight` of the user.
+
+        Args:
+            backend: The backend on which the job is queued
+            username: The user that submitted the job
+            job_id: The id of the job
+            traceparent: The span of the submission if it is traced
+
+        Returns:
+            The entry of the job in the index
+        """
+        weight, priority = User.objects.filter(username=username).values_list(
+            "queue_weight", "queue_priority"
+        ).first() or (1.0, 1)
+        entries = QueueEntry.objects.filter(backend=backend)
+        virtual_start = (
+            entries.order_by("virtual_finish")
+            .values_list("virtual_finish", flat=True)
+            .first()
+            or 0.0
+        )
+        user_finish = (
+            entries.filter(username=username)
+            .order_by("-virtual_finish")
+            .values_list("virtual_finish", flat=True)
+            .first()
+            or 0.0
+        )
+        return QueueEntry.objects.create(
+            job_id=job_id,
+            backend=backend,
+            username=username,
+            priority=priority,
+            virtual_finish=max(virtual_start, user_finish) + 1.0 / max(weight, 1e-3),
+            traceparent=traceparent,
+        )
+
+    def next_jobs(
+        self, storage_provider: StorageProvider, backend: Backend, limit: int = 1
+    ) -> List[str]:
+        """
+        Get the names of the job files that should be given to the spooler next.
+
+        Args:
+            storage_provider: The storage that holds the queue
+            backend: The backend for which we would like to have the next jobs
+            limit: The maximal number of jobs
+
+        Returns:
+            The names of the job files in the order in which they should run
+        """
+        job_ids = list(
+            self.order_entries(QueueEntry.objects.filter(backend=backend)).values_list(
+                "job_id", flat=True
+            )[:limit]
+        )
+        if not job_ids:
+            # jobs that were queued without an entry in the index
+            job_json_dir = "/Backend_files/Queued_Jobs/" + backend.name + "/"
+            return storage_provider.get_file_queue(job_json_dir)[:limit]
+        return ["job-" + job_id + ".json" for job_id in job_ids]
+
+    @abstractmethod
+    def order_entries(self, entries):
+        """
+        Sort the entries of the index in the order in which they should run.
+
+        Args:
+            entries: The queryset of all entries of the backend
+
+        Returns:
+            The ordered queryset
+        """
+
+    @abstractmethod
+    def ahead_of(self, entry: QueueEntry) -> Q:
+        """
+        The condition for the entries that run before a given entry.
+
+        Args:
+            entry: The entry of a queued job
+
+        Returns:
+            The condition as a filter on the entries of the backend
+        """
+
+    def jobs_ahead(self, entry: QueueEntry) -> int:
+        """
+        Count the jobs that run before a queued job.
+
+        Args:
+            entry: The entry of the queued job
+
+        Returns:
+            The number of jobs ahead
+        """
+        return (
+            QueueEntry.objects.filter(backend_id=entry.backend_id)
+            .filter(self.ahead_of(entry))
+            .count()
+        )
+
+    @staticmethod
+    def dequeue(backend: Backend, job_json_names: List[str]) -> int:
+        """
+        Remove the jobs from the index of the queue, once they are given to the
+        spooler.
+
+        Args:
+            backend: The backend of the jobs
+            job_json_names: The names of the job files
+
+        Returns:
+            The number of jobs that were still in the index
+        """
+        num_deleted, _ = QueueEntry.objects.filter(
+            backend=backend, job_id__in=[name[4:-5] for name in job_json_names]
+        ).delete()
+        return num_deleted
+
+
+class FifoPolicy(SchedulingPolicy):
+    """
+    The jobs run in the order in which the storage lists the queue, which follows the
+    timestamp at the beginning of the job id.
+    """
+
+    def next_jobs(
+        self, storage_provider: StorageProvider, backend: Backend, limit: int = 1
+    ) -> List[str]:
+        """
+        Get the first files of the queue folder.
+        """
+        job_json_dir = "/Backend_files/Queued_Jobs/" + backend.name + "/"
+        return storage_provider.get_file_queue(job_json_dir)[:limit]
+
+    def order_entries(self, entries):
+        """
+        Sort the entries by their submission.
+        """
+        return entries.order_by("id")
+
+    def ahead_of(self, entry: QueueEntry) -> Q:
+        """
+        The entries that were submitted earlier.
+        """
+        return Q(id__lt=entry.id)
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """
+    Weighted fair queuing between the users. A user who submits thousands of jobs only
+    gets their share of the backend, while the jobs of the other users overtake their
+    queue.
+    """
+
+    def order_entries(self, entries):
+        """
+        Sort the entries by their virtual finishing time.
+        """
+        return entries.order_by("virtual_finish", "id")
+
+    def ahead_of(self, entry: QueueEntry) -> Q:
+        """
+        The entries with an earlier virtual finishing time.
+        """
+        return Q(virtual_finish__lt=entry.virtual_finish) | Q(
+            virtual_finish=entry.virtual_finish, id__lt=entry.id
+        )
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """
+    The jobs of users in a higher priority class always run first. Within a class the
+    jobs run in the order of their submission.
+    """
+
+    def order_entries(self, entries):
+        """
+        Sort the entries by priority class and then by submission.
+        """
+        return entries.order_by("-priority", "id")
+
+    def ahead_of(self, entry: QueueEntry) -> Q:
+        """
+        The entries of a higher priority class or submitted earlier in the same class.
+        """
+        return Q(priority__gt=entry.priority) | Q(
+            priority=entry.priority, id__lt=entry.id
+        )
+
+
+SCHEDULING_POLICIES = {
+    "fifo": FifoPolicy(),
+    "fair_share": FairSharePolicy(),
+    "priority": PriorityPolicy(),
+}
+
+
+def get_scheduling_policy(backend: Backend) -> SchedulingPolicy:
+    """
+    Get the scheduling policy that is configured for the backend.
+
+    Args:
+        backend: The backend
+
+    Returns:
+        The policy, which falls back to FIFO for unknown names
+    """
+    return SCHEDULING_POLICIES.get(
+        backend.scheduling_policy, SCHEDULING_POLICIES["fifo"]
+    )
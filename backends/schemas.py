@@ -3,8 +3,8 @@ The schemas that define our communication with the api_v1.
 """
 
 
-from typing import List
-from ninja import ModelSchema
+from typing import List, Optional
+from ninja import ModelSchema, Schema
 from .models import Backend
 
 # pylint: disable=R0903
@@ -40,3 +40,20 @@ class BackendSchemaOut(ModelSchema):
             "gates",
             "supported_instructions",
         ]
+
+
+class QueueStatsSchemaOut(Schema):
+    """
+    The schema send out to describe the current load of the queue of a backend. All
+    times are given in seconds and are None as long as we have not observed any job.
+    """
+
+    backend_name: str
+    queue_depth: int
+    running: int
+    jobs_per_minute: float
+    queue_wait_p50: Optional[float]
+    queue_wait_p95: Optional[float]
+    execution_time_p50: Optional[float]
+    execution_time_p95: Optional[float]
+    estimated_start: Optional[str]
@@ -3,14 +3,61 @@ The module that contains all the necessary logic for communication with the exte
 storage for the jobs.
 """
 from abc import ABC
-import sys
-from typing import List
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, List, Union
 
+from asgiref.sync import sync_to_async
 import dropbox
-from dropbox.files import WriteMode
-from dropbox.exceptions import ApiError, AuthError
+from dropbox.files import DeleteArg, WriteMode
+from dropbox.exceptions import (
+    ApiError,
+    AuthError,
+    DropboxException,
+    InternalServerError,
+    RateLimitError,
+)
 from decouple import config
 
+from .metrics import REGISTRY, add_phase_time
+from .tracing import SPAN_KIND_CLIENT, span
+
+logger = logging.getLogger(__name__)
+
+
+class StorageError(OSError):
+    """
+    A call to the storage failed. It is an `OSError` like the errors of the local
+    files, such that the views handle all storage providers alike.
+    """
+
+
+class StorageNotFoundError(StorageError, FileNotFoundError):
+    """
+    The file or the folder does not exist in the storage.
+    """
+
+
+class StorageUnavailable(StorageError):
+    """
+    The storage did not answer in time or it is known to be unhealthy. The views
+    answer with 503, such that the client tries again later.
+
+    Args:
+        message: The description of the problem
+        retry_after: The time in seconds after which the storage might be back
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 
 class StorageProvider(ABC):
     """
@@ -37,32 +84,275 @@ class StorageProvider(ABC):
         Move the file from start_path to `final_path`
         """
 
+    def delete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Upload binary data, like a compressed archive, to the storage
+        """
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Get the binary content of a file from the storage
+        """
+
+    def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Remove many files from the storage. Providers that can delete files in batches
+        should override it.
+        """
+        for storage_path in storage_paths:
+            self.delete_file(storage_path)
+
+    # The asynchronous versions of the methods above. By default they run the
+    # synchronous methods in a thread, such that the event loop is never blocked by
+    # the storage. Providers with native asynchronous access should override them.
+
+    async def aupload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Upload the file to the storage
+        """
+        await sync_to_async(self.upload, thread_sensitive=False)(dump_str, storage_path)
+
+    async def aget_file_content(self, storage_path: str) -> str:
+        """
+        Get the file content from the storage
+        """
+        return await sync_to_async(self.get_file_content, thread_sensitive=False)(
+            storage_path
+        )
+
+    async def aget_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get a list of files
+        """
+        return await sync_to_async(self.get_file_queue, thread_sensitive=False)(
+            storage_path
+        )
+
+    async def amove_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        await sync_to_async(self.move_file, thread_sensitive=False)(
+            start_path, final_path
+        )
+
+    async def adelete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+        await sync_to_async(self.delete_file, thread_sensitive=False)(storage_path)
+
+
+class LocalFileProvider(StorageProvider):
+    """
+    The access to a folder on the local disk. It is meant for simulators that run on
+    the same machine as qlue and for testing.
+
+    Args:
+        root_dir: The folder that contains all the files. It is taken from the
+            `LOCAL_STORAGE_ROOT` setting if it is not given.
+    """
+
+    def __init__(self, root_dir: str = None):
+        """
+        Set up the folder.
+        """
+        if root_dir is None:
+            root_dir = config("LOCAL_STORAGE_ROOT", default="local_storage")
+        self.root_dir = root_dir
+
+    def _full_path(self, storage_path: str) -> str:
+        """
+        The path of the file on the local disk.
+        """
+        return os.path.join(self.root_dir, storage_path.lstrip("/"))
+
+    def upload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Write the file into the folder
+        """
+        full_path = self._full_path(storage_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w", encoding="utf-8") as file:
+            file.write(dump_str)
+
+    def get_file_content(self, storage_path: str) -> str:
+        """
+        Read the file from the folder
+        """
+        with open(self._full_path(storage_path), encoding="utf-8") as file:
+            return file.read()
+
+    def get_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get the sorted list of files in the folder, which is empty if the folder
+        does not exist
+        """
+        full_path = self._full_path(storage_path)
+        if not os.path.isdir(full_path):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(full_path)
+            if os.path.isfile(os.path.join(full_path, name))
+        )
+
+    def move_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        full_final_path = self._full_path(final_path)
+        os.makedirs(os.path.dirname(full_final_path), exist_ok=True)
+        os.replace(self._full_path(start_path), full_final_path)
+
+    def delete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the folder
+        """
+        os.remove(self._full_path(storage_path))
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Write the binary file into the folder
+        """
+        full_path = self._full_path(storage_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as file:
+            file.write(data)
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Read the binary file from the folder
+        """
+        with open(self._full_path(storage_path), "rb") as file:
+            return file.read()
+
+    # Operations on the local disk only take microseconds for the small files of
+    # qlue, so they run directly in the event loop instead of a thread.
+
+    async def aupload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Write the file into the folder
+        """
+        self.upload(dump_str, storage_path)
+        await asyncio.sleep(0)
+
+    async def aget_file_content(self, storage_path: str) -> str:
+        """
+        Read the file from the folder
+        """
+        content = self.get_file_content(storage_path)
+        await asyncio.sleep(0)
+        return content
+
+    async def aget_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get the sorted list of files in the folder
+        """
+        file_list = self.get_file_queue(storage_path)
+        await asyncio.sleep(0)
+        return file_list
+
+    async def amove_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        self.move_file(start_path, final_path)
+        await asyncio.sleep(0)
+
+    async def adelete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the folder
+        """
+        self.delete_file(storage_path)
+        await asyncio.sleep(0)
+
+
+def dropbox_error(err: Exception) -> "StorageError":
+    """
+    The typed error for an exception of the dropbox sdk or of its connection.
+    """
+    if isinstance(err, AuthError):
+        return StorageError("Invalid access token of the dropbox")
+    if isinstance(err, ApiError) and "not_found" in repr(err.error):
+        return StorageNotFoundError(str(err.error))
+    if isinstance(err, RateLimitError):
+        return StorageUnavailable(
+            "The dropbox limits the rate", retry_after=err.backoff or 1.0
+        )
+    # the connection errors and timeouts of requests are OSErrors
+    if isinstance(err, (InternalServerError, OSError)):
+        return StorageUnavailable("The dropbox is unavailable: " + str(err))
+    return StorageError(str(err))
+
 
 class DropboxProvider(StorageProvider):
     """
-    The access to the dropbox
+    The access to the dropbox. The errors of the dropbox become `StorageError`s.
+
+    Args:
+        timeout: The time in seconds after which a request to the dropbox is
+            abandoned. It is taken from the `DROPBOX_TIMEOUT` setting if it is not
+            given.
+        max_retries: The number of times that the sdk repeats a request that failed
+            or was rate limited. It is taken from the `DROPBOX_MAX_RETRIES` setting if
+            it is not given.
     """
 
+    # the largest number of files that dropbox deletes in a single batch
+    MAX_DELETE_BATCH = 1000
+    # the time in seconds between two checks of a running batch
+    DELETE_BATCH_POLL = 0.5
+
     # Add OAuth2 access token here.
     # You can generate one for yourself in the App Console.
     # <https://blogs.dropbox.com/developers/2014/05/generate-an-access-token-for-your-own-account/>
-    def __init__(self):
+    def __init__(self, timeout: float = None, max_retries: int = None):
         """
         Set up the neccessary keys.
         """
         self.app_key = config("APP_KEY")
         self.refresh_token = config("REFRESH_TOKEN")
+        if timeout is None:
+            timeout = config("DROPBOX_TIMEOUT", default=30.0, cast=float)
+        if max_retries is None:
+            max_retries = config("DROPBOX_MAX_RETRIES", default=4, cast=int)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    @contextmanager
+    def _client(self, check_token: bool = True) -> Iterator[dropbox.Dropbox]:
+        """
+        An instance of the Dropbox class, which can make requests to the API. The
+        errors within the block become `StorageError`s.
+        """
+        try:
+            with dropbox.Dropbox(
+                oauth2_refresh_token=self.refresh_token,
+                app_key=self.app_key,
+                timeout=self.timeout,
+                max_retries_on_error=self.max_retries,
+                max_retries_on_rate_limit=self.max_retries,
+            ) as dbx:
+                if check_token:
+                    # Check that the access token is valid
+                    dbx.users_get_current_account()
+                yield dbx
+        except StorageError:
+            raise
+        except (DropboxException, OSError) as err:
+            raise dropbox_error(err) from err
 
     def upload(self, dump_str: str, storage_path: str) -> None:
         """
         Upload the file identified to the dropbox
         """
-        # Create an instance of a Dropbox class, which can make requests to the API.
-        with dropbox.Dropbox(
-            oauth2_refresh_token=self.refresh_token, app_key=self.app_key
-        ) as dbx:
-            # Check that the access token is valid
-            dbx.users_get_current_account()
+        with self._client() as dbx:
             dbx.files_upload(
                 dump_str.encode("utf-8"), storage_path, mode=WriteMode("overwrite")
             )
@@ -71,89 +361,354 @@ class DropboxProvider(StorageProvider):
         """
         Get the file content from the dropbox
         """
-        # Create an instance of a Dropbox class, which can make requests to the API.
-        with dropbox.Dropbox(
-            oauth2_refresh_token=self.refresh_token, app_key=self.app_key
-        ) as dbx:
-            # Check that the access token is valid
-            try:
-                dbx.users_get_current_account()
-            except AuthError:
-                sys.exit("ERROR: Invalid access token.")
-            # We should really handle these exceptions cleaner, but this seems a bit
-            # complicated right now
-            # pylint: disable=W0703
-            try:
-                _, res = dbx.files_download(path=storage_path)
-                data = res.content
-            except Exception as err:
-                sys.exit(err)
-        return data.decode("utf-8")
+        with self._client() as dbx:
+            _, res = dbx.files_download(path=storage_path)
+        return res.content.decode("utf-8")
 
     def get_file_queue(self, storage_path: str) -> List[str]:
         """
         Get a list of files
         """
-
-        # Create an instance of a Dropbox class, which can make requests to the API.
-        with dropbox.Dropbox(
-            oauth2_refresh_token=self.refresh_token, app_key=self.app_key
-        ) as dbx:
-            # Check that the access token is valid
-            try:
-                dbx.users_get_current_account()
-            except AuthError:
-                sys.exit("ERROR: Invalid access token.")
-            # We should really handle these exceptions cleaner, but this seems a bit
-            # complicated right now
-            # pylint: disable=W0703
-            try:
-                response = dbx.files_list_folder(path=storage_path)
-                file_list = response.entries
-                file_list = [item.name for item in file_list]
-
-            except Exception as err:
-                print(err)
-                sys.exit()
-        return file_list
+        with self._client() as dbx:
+            response = dbx.files_list_folder(path=storage_path)
+        return [item.name for item in response.entries]
 
     def move_file(self, start_path: str, final_path: str) -> None:
         """
         Move the file from start_path to
         """
-
-        # Create an instance of a Dropbox class, which can make requests to the API.
-        with dropbox.Dropbox(
-            oauth2_refresh_token=self.refresh_token, app_key=self.app_key
-        ) as dbx:
-            # Check that the access token is valid
-            try:
-                dbx.users_get_current_account()
-            except AuthError:
-                sys.exit("ERROR: Invalid access token.")
-            try:
-                dbx.files_move_v2(start_path, final_path)
-            except ApiError as err:
-                print(err)
-                sys.exit()
+        with self._client() as dbx:
+            dbx.files_move_v2(start_path, final_path)
 
     def delete_file(self, storage_path: str):
         """
         Remove the file from the dropbox
         """
-        # Create an instance of a Dropbox class, which can make requests to the API.
-        with dropbox.Dropbox(
-            oauth2_refresh_token=self.refresh_token, app_key=self.app_key
-        ) as dbx:
-            # Check that the access token is valid
+        with self._client() as dbx:
+            dbx.files_delete(path=storage_path)
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Upload binary data to the dropbox
+        """
+        with self._client(check_token=False) as dbx:
+            dbx.files_upload(data, storage_path, mode=WriteMode("overwrite"))
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Get the binary content of a file from the dropbox
+        """
+        with self._client(check_token=False) as dbx:
+            _, res = dbx.files_download(path=storage_path)
+            return res.content
+
+    def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Remove many files from the dropbox with batch deletes
+        """
+        with self._client(check_token=False) as dbx:
+            for start in range(0, len(storage_paths), self.MAX_DELETE_BATCH):
+                batch = storage_paths[start : start + self.MAX_DELETE_BATCH]
+                launch = dbx.files_delete_batch([DeleteArg(path) for path in batch])
+                if not launch.is_async_job_id():
+                    continue
+                job_id = launch.get_async_job_id()
+                status = dbx.files_delete_batch_check(job_id)
+                while status.is_in_progress():
+                    time.sleep(self.DELETE_BATCH_POLL)
+                    status = dbx.files_delete_batch_check(job_id)
+                if status.is_failed():
+                    raise ApiError(
+                        job_id, status.get_failed(), "Batch delete failed", None
+                    )
+
+
+def path_prefix(storage_path: str) -> str:
+    """
+    The folder below `/Backend_files/` to which a path belongs, like `Queued_Jobs`,
+    `Status` or `Result`. It groups the calls to the storage in the metrics.
+    """
+    parts = storage_path.strip("/").split("/")
+    if parts[0] == "Backend_files" and len(parts) > 2:
+        return parts[1]
+    return "other"
+
+
+class InstrumentedProvider(StorageProvider):
+    """
+    The wrapper of any storage provider that measures every call to it. The metrics
+    count the calls, their latency, the size of the files, the failures and the
+    retries per method and per `path_prefix`. A retry is a call that repeats a failed
+    call with the same method and path. Calls that take longer than
+    `slow_call_seconds` are logged and kept in `slow_calls`. Every call is traced as
+    `storage.<method>` span as well, see `tracing.py`.
+
+    Args:
+        provider: The storage provider that is measured
+        slow_call_seconds: The duration above which calls are logged as slow. It is
+            taken from the `STORAGE_SLOW_CALL_SECONDS` setting if it is not given.
+    """
+
+    # the number of slow calls that are kept
+    MAX_SLOW_CALLS = 100
+    # the number of failed calls that are remembered to detect retries
+    MAX_FAILED_CALLS = 1000
+
+    def __init__(self, provider: StorageProvider, slow_call_seconds: float = None):
+        """
+        Set up the wrapper.
+        """
+        self.provider = provider
+        if slow_call_seconds is None:
+            slow_call_seconds = config(
+                "STORAGE_SLOW_CALL_SECONDS", default=1.0, cast=float
+            )
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_calls: deque = deque(maxlen=self.MAX_SLOW_CALLS)
+        self._failed_calls: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        """
+        Everything else comes from the wrapped provider.
+        """
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+
+    def _start(self, method: str, storage_path: str) -> float:
+        """
+        Count the call as retry if it repeats a failed call.
+        """
+        with self._lock:
+            if (method, storage_path) in self._failed_calls:
+                REGISTRY.increment(
+                    "qlue_storage_retries_total",
+                    {"method": method, "prefix": path_prefix(storage_path)},
+                )
+        return time.perf_counter()
+
+    def _finish(
+        self,
+        method: str,
+        storage_path: str,
+        start: float,
+        payload: Any,
+        error: Exception = None,
+    ) -> None:
+        """
+        Record the outcome of a call.
+        """
+        # pylint: disable=R0913
+        seconds = time.perf_counter() - start
+        labels = {"method": method, "prefix": path_prefix(storage_path)}
+        REGISTRY.observe("qlue_storage_duration_seconds", labels, seconds)
+        REGISTRY.increment("qlue_storage_calls_total", labels)
+        if isinstance(payload, (str, bytes)):
+            # text is counted in characters, which are bytes for the json of qlue
+            REGISTRY.observe("qlue_storage_payload_bytes", labels, len(payload))
+            REGISTRY.increment("qlue_storage_bytes_total", labels, len(payload))
+        add_phase_time("storage", seconds)
+
+        with self._lock:
+            if error is None:
+                self._failed_calls.pop((method, storage_path), None)
+            else:
+                self._failed_calls[(method, storage_path)] = True
+                while len(self._failed_calls) > self.MAX_FAILED_CALLS:
+                    self._failed_calls.popitem(last=False)
+        if error is not None:
+            REGISTRY.increment(
+                "qlue_storage_errors_total",
+                dict(labels, error=type(error).__name__),
+            )
+        if seconds >= self.slow_call_seconds:
+            self.slow_calls.append(
+                {
+                    "time": datetime.datetime.utcnow().isoformat(),
+                    "method": method,
+                    "path": storage_path,
+                    "seconds": seconds,
+                    "error": None if error is None else type(error).__name__,
+                }
+            )
+            logger.warning(
+                "Slow storage call: %s %s took %.3f s", method, storage_path, seconds
+            )
+
+    def _call(
+        self,
+        method: str,
+        storage_path: str,
+        call: Callable[[], Any],
+        payload: Union[str, bytes] = None,
+    ) -> Any:
+        """
+        Measure and trace a call to the wrapped provider. The payload of a download
+        is its result.
+        """
+        with span(
+            "storage." + method, {"storage.path": storage_path}, SPAN_KIND_CLIENT
+        ):
+            start = self._start(method, storage_path)
             try:
-                dbx.users_get_current_account()
-            except AuthError:
-                sys.exit("ERROR: Invalid access token.")
-            # We should really handle these exceptions cleaner, but this seems a bit
-            # complicated right now
-            # pylint: disable=W0703
+                result = call()
+            except Exception as err:
+                self._finish(method, storage_path, start, payload, err)
+                raise
+            self._finish(method, storage_path, start, payload or result)
+            return result
+
+    async def _acall(
+        self,
+        method: str,
+        storage_path: str,
+        call: Callable[[], Awaitable[Any]],
+        payload: Union[str, bytes] = None,
+    ) -> Any:
+        """
+        Measure and trace an asynchronous call to the wrapped provider.
+        """
+        with span(
+            "storage." + method, {"storage.path": storage_path}, SPAN_KIND_CLIENT
+        ):
+            start = self._start(method, storage_path)
             try:
-                _ = dbx.files_delete(path=storage_path)
+                result = await call()
             except Exception as err:
-                sys.exit(err)
+                self._finish(method, storage_path, start, payload, err)
+                raise
+            self._finish(method, storage_path, start, payload or result)
+            return result
+
+    def upload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Upload the file to the storage
+        """
+        self._call(
+            "upload",
+            storage_path,
+            lambda: self.provider.upload(dump_str, storage_path),
+            dump_str,
+        )
+
+    def get_file_content(self, storage_path: str) -> str:
+        """
+        Get the file content from the storage
+        """
+        return self._call(
+            "get_file_content",
+            storage_path,
+            lambda: self.provider.get_file_content(storage_path),
+        )
+
+    def get_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get a list of files
+        """
+        return self._call(
+            "get_file_queue",
+            storage_path,
+            lambda: self.provider.get_file_queue(storage_path),
+        )
+
+    def move_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        self._call(
+            "move_file",
+            start_path,
+            lambda: self.provider.move_file(start_path, final_path),
+        )
+
+    def delete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+        self._call(
+            "delete_file", storage_path, lambda: self.provider.delete_file(storage_path)
+        )
+
+    def upload_bytes(self, data: bytes, storage_path: str) -> None:
+        """
+        Upload binary data to the storage
+        """
+        self._call(
+            "upload_bytes",
+            storage_path,
+            lambda: self.provider.upload_bytes(data, storage_path),
+            data,
+        )
+
+    def get_file_bytes(self, storage_path: str) -> bytes:
+        """
+        Get the binary content of a file from the storage
+        """
+        return self._call(
+            "get_file_bytes",
+            storage_path,
+            lambda: self.provider.get_file_bytes(storage_path),
+        )
+
+    def delete_files(self, storage_paths: List[str]) -> None:
+        """
+        Remove many files from the storage
+        """
+        if storage_paths:
+            self._call(
+                "delete_files",
+                storage_paths[0],
+                lambda: self.provider.delete_files(storage_paths),
+            )
+
+    async def aupload(self, dump_str: str, storage_path: str) -> None:
+        """
+        Upload the file to the storage
+        """
+        await self._acall(
+            "upload",
+            storage_path,
+            lambda: self.provider.aupload(dump_str, storage_path),
+            dump_str,
+        )
+
+    async def aget_file_content(self, storage_path: str) -> str:
+        """
+        Get the file content from the storage
+        """
+        return await self._acall(
+            "get_file_content",
+            storage_path,
+            lambda: self.provider.aget_file_content(storage_path),
+        )
+
+    async def aget_file_queue(self, storage_path: str) -> List[str]:
+        """
+        Get a list of files
+        """
+        return await self._acall(
+            "get_file_queue",
+            storage_path,
+            lambda: self.provider.aget_file_queue(storage_path),
+        )
+
+    async def amove_file(self, start_path: str, final_path: str) -> None:
+        """
+        Move the file from start_path to `final_path`
+        """
+        await self._acall(
+            "move_file",
+            start_path,
+            lambda: self.provider.amove_file(start_path, final_path),
+        )
+
+    async def adelete_file(self, storage_path: str) -> None:
+        """
+        Remove the file from the storage
+        """
+        await self._acall(
+            "delete_file",
+            storage_path,
+            lambda: self.provider.adelete_file(storage_path),
+        )
@@ -0,0 +1,169 @@
+"""
+The module that builds the storage providers from the setting `STORAGE_PROVIDERS`. It
+names each provider configuration, similar to the `CACHES` of django:
+
+    STORAGE_PROVIDERS = {
+        "default": {
+            "BACKEND": "backends.storage_providers.DropboxProvider",
+            "OPTIONS": {},
+            "WRAPPERS": [
+                "backends.resilient_storage.ResilientProvider",
+                "backends.storage_providers.InstrumentedProvider",
+            ],
+        },
+    }
+
+`BACKEND` is the dotted path of the provider class and `OPTIONS` are its keyword
+arguments. The `WRAPPERS` are applied from the inside out, each gets the provider that
+it wraps as first argument. A wrapper is a dotted path or a dict with `BACKEND` and
+`OPTIONS` itself. A provider is only built when it is used for the first time and it is
+kept for the rest of the process, such that importing the app needs no credentials and
+every worker opens its own connections.
+"""
+import os
+import threading
+from typing import Any, Dict, Optional, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from .storage_providers import StorageProvider
+
+DEFAULT_PROVIDER = "default"
+DEFAULT_STORAGE_PROVIDERS = {
+    DEFAULT_PROVIDER: {
+        "BACKEND": "backends.storage_providers.DropboxProvider",
+        "OPTIONS": {},
+        "WRAPPERS": [
+            "backends.resilient_storage.ResilientProvider",
+            "backends.storage_providers.InstrumentedProvider",
+        ],
+    },
+}
+
+_PROVIDERS: Dict[str, StorageProvider] = {}
+_PROVIDERS_PID: Optional[int] = None
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def storage_configs() -> Dict[str, dict]:
+    """
+    The provider configurations of the settings.
+    """
+    return getattr(settings, "STORAGE_PROVIDERS", DEFAULT_STORAGE_PROVIDERS)
+
+
+def _instantiate(spec: Union[str, dict], *args: Any) -> Any:
+    """
+    Create the object of a dotted path or of a dict with `BACKEND` and `OPTIONS`.
+    """
+    if isinstance(spec, str):
+        spec = {"BACKEND": spec}
+    try:
+        provider_class = import_string(spec["BACKEND"])
+    except (ImportError, KeyError) as err:
+        raise ImproperlyConfigured(
+            "Could not import the storage provider " + str(spec.get("BACKEND"))
+        ) from err
+    return provider_class(*args, **spec.get("OPTIONS", {}))
+
+
+def build_provider(provider_config: dict) -> StorageProvider:
+    """
+    Create a storage provider and its wrappers.
+
+    Args:
+        provider_config: The configuration with `BACKEND`, `OPTIONS` and `WRAPPERS`
+
+    Returns:
+        The outermost wrapper or the provider itself if it has no wrappers
+    """
+    storage_provider = _instantiate(provider_config)
+    for wrapper in provider_config.get("WRAPPERS", []):
+        storage_provider = _instantiate(wrapper, storage_provider)
+    return storage_provider
+
+
+def get_provider(name: str = DEFAULT_PROVIDER) -> StorageProvider:
+    """
+    The storage provider of a configuration. It is built on the first call and kept
+    for the rest of the process. A process that was forked from the one that built it
+    builds its own.
+
+    Args:
+        name: The name of the configuration in `STORAGE_PROVIDERS`
+
+    Returns:
+        The storage provider
+
+    Raises:
+        ImproperlyConfigured: If there is no such configuration
+    """
+    # pylint: disable=W0603
+    global _PROVIDERS_PID
+    if _PROVIDERS_PID == os.getpid() and name in _PROVIDERS:
+        return _PROVIDERS[name]
+    with _PROVIDERS_LOCK:
+        if _PROVIDERS_PID != os.getpid():
+            _PROVIDERS.clear()
+            _PROVIDERS_PID = os.getpid()
+        if name not in _PROVIDERS:
+            configs = storage_configs()
+            if name not in configs:
+                raise ImproperlyConfigured("Unknown storage provider " + name)
+            _PROVIDERS[name] = build_provider(configs[name])
+        return _PROVIDERS[name]
+
+
+def built_providers() -> Dict[str, StorageProvider]:
+    """
+    The providers that this process built so far, keyed by their configuration.
+    """
+    with _PROVIDERS_LOCK:
+        return dict(_PROVIDERS) if _PROVIDERS_PID == os.getpid() else {}
+
+
+def validate_storage_config(name: str) -> None:
+    """
+    Check that a backend names a configuration of `STORAGE_PROVIDERS`.
+
+    Raises:
+        ValidationError: If there is no such configuration
+    """
+    if name and name not in storage_configs():
+        raise ValidationError(
+            "%(name)s is not in STORAGE_PROVIDERS", params={"name": name}
+        )
+
+
+def reset_providers(**kwargs) -> None:
+    """
+    Forget the built providers, such that they are built again from the settings.
+    It is called whenever `STORAGE_PROVIDERS` changes, e.g. in tests.
+    """
+    if kwargs.get("setting", "STORAGE_PROVIDERS") != "STORAGE_PROVIDERS":
+        return
+    with _PROVIDERS_LOCK:
+        _PROVIDERS.clear()
+
+
+setting_changed.connect(reset_providers)
+
+
+class LazyProvider:
+    """
+    The class attribute that builds its storage provider on first access.
+
+    Args:
+        name: The name of the configuration in `STORAGE_PROVIDERS`
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, name: str = DEFAULT_PROVIDER):
+        self.name = name
+
+    def __get__(self, instance, owner) -> StorageProvider:
+        return get_provider(self.name)
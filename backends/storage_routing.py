@@ -0,0 +1,106 @@
+"""
+The module that finds the storage of each backend. A backend keeps its jobs in the
+storage provider that its `storage_config` names, e.g. a busy simulator on the local
+disk and the hardware on Dropbox, such that their listings and rate limits do not get
+in the way of each other. Backends without `storage_config` use the storage of the app.
+
+The configuration of every backend is cached for `ROUTING_CACHE_SECONDS`, so most
+requests find their storage without a query. A change in the admin is seen at once by
+the worker that saved it and by the others after the cache expired.
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db.models.signals import post_delete, post_save
+
+from .apps import BackendsConfig as ac
+from .models import Backend
+from .storage_providers import StorageProvider
+from .storage_registry import get_provider
+
+# pylint: disable=E1101
+
+# the time in seconds for which the configuration of a backend is cached
+ROUTING_CACHE_SECONDS = 30.0
+
+_ROUTES: Dict[str, Tuple[str, float]] = {}
+_ROUTES_LOCK = threading.Lock()
+
+
+def _cached_config(backend_name: str) -> Optional[str]:
+    """
+    The cached configuration of a backend, None if it is not cached or too old.
+    """
+    with _ROUTES_LOCK:
+        route = _ROUTES.get(backend_name)
+    if route is None or time.monotonic() - route[1] > ROUTING_CACHE_SECONDS:
+        return None
+    return route[0]
+
+
+def _load_config(backend_name: str) -> str:
+    """
+    Look up the configuration of a backend and cache it. Unknown backends use the
+    storage of the app.
+    """
+    storage_config = (
+        Backend.objects.filter(name=backend_name)
+        .values_list("storage_config", flat=True)
+        .first()
+        or ""
+    )
+    with _ROUTES_LOCK:
+        _ROUTES[backend_name] = (storage_config, time.monotonic())
+    return storage_config
+
+
+def provider_for_config(storage_config: str) -> StorageProvider:
+    """
+    The storage provider of a configuration in `STORAGE_PROVIDERS`, the storage of the
+    app if it is empty.
+    """
+    if not storage_config:
+        return getattr(ac, "storage")
+    return get_provider(storage_config)
+
+
+def backend_storage(backend_name: str) -> StorageProvider:
+    """
+    The storage provider that keeps the jobs of a backend.
+
+    Args:
+        backend_name: The name of the backend
+
+    Returns:
+        The storage provider
+    """
+    storage_config = _cached_config(backend_name)
+    if storage_config is None:
+        storage_config = _load_config(backend_name)
+    return provider_for_config(storage_config)
+
+
+async def abackend_storage(backend_name: str) -> StorageProvider:
+    """
+    The storage provider that keeps the jobs of a backend, for the asynchronous views.
+    The database is only asked if the configuration is not cached.
+    """
+    storage_config = _cached_config(backend_name)
+    if storage_config is None:
+        storage_config = await sync_to_async(_load_config)(backend_name)
+    return provider_for_config(storage_config)
+
+
+def forget_route(sender, instance: Backend, **kwargs) -> None:
+    """
+    Drop the cached configuration of a backend that was changed or deleted.
+    """
+    # pylint: disable=W0613
+    with _ROUTES_LOCK:
+        _ROUTES.pop(instance.name, None)
+
+
+post_save.connect(forget_route, sender=Backend)
+post_delete.connect(forget_route, sender=Backend)
@@ -1,18 +1,94 @@
 """
 The models that define our tests for this app.
 """
+import asyncio
+import hashlib
+import hmac
+import http.server
+import io
 import json
+import marshal
+import shutil
+import tempfile
+import threading
+import time
+import unittest
 import uuid
+from unittest import mock
+import zipfile
 from decouple import config
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import Backend
+from .models import (
+    ArchivedJob,
+    Backend,
+    IdempotencyKey,
+    QueueEntry,
+    QueueStats,
+    RequestProfile,
+    WebhookDelivery,
+)
 from .apps import BackendsConfig as ac
+from .storage_providers import (
+    InstrumentedProvider,
+    LocalFileProvider,
+    StorageNotFoundError,
+    StorageUnavailable,
+)
+from .resilient_storage import ResilientProvider
+from .memory_storage import MemoryProvider, MemoryStoreManager, parse_latency
+from .storage_registry import LazyProvider, get_provider
+from .encodings import (
+    CODECS,
+    MSGPACK_MEDIA_TYPE,
+    is_packed,
+    negotiate_media_type,
+    pack_result,
+    unpack_result,
+)
+from .results import clear_counts_cache, count_memory, select_experiments
+from .result_chunks import chunk_path, write_result_chunk
+from .idempotency import (
+    IDEMPOTENCY_TTL,
+    claim_idempotency_key,
+    purge_idempotency_keys,
+    request_fingerprint,
+    settle_idempotency_key,
+)
+from .coalescing import BATCH_USERNAME, merge_jobs, split_result
+from .scheduling import SCHEDULING_POLICIES, get_scheduling_policy
+from .metrics import REGISTRY
+from .webhooks import (
+    MAX_DELIVERY_ATTEMPTS,
+    SIGNATURE_HEADER,
+    TIMESTAMP_HEADER,
+    deliver_webhook,
+    release_finished_deliveries,
+)
+from .admission import take_submit_token
+from .profiling import PROFILE_HEADER, PROFILE_ID_HEADER
+from .benchmarks import compare_reports, parse_mix, sample_job, sample_result, summarize
+from .microbenchmarks import compare_results, measure
+from .tracing import flush as flush_traces
+from .tracing import job_latency_breakdown, read_spans
+from .validation import validate_job
+from .jobs import result_json_path, status_json_path
+from .queue_stats import (
+    count_running_jobs,
+    get_queue_stats,
+    record_completion,
+    record_dequeue,
+    record_enqueue,
+)
 
 User = get_user_model()
 
-# pylint: disable=E1101
+# pylint: disable=E1101, C0302
 class BackendCreationTest(TestCase):
     """
     The test for the creation of the backends.
@@ -407,6 +483,1672 @@ class JobSubmissionTest(TestCase):
         self.assertEqual(data["status"], "ERROR")
 
 
+class JobCoalescingTest(TestCase):
+    """
+    The class that contains the tests for merging jobs into batches.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        for username in (self.username, "spooler"):
+            user = User.objects.create(username=username)
+            user.set_password(self.password)
+            user.save()
+        self.original_storage = ac.storage
+        ac.storage = MemoryProvider()
+        ac.storage.store.clear()
+
+    def tearDown(self):
+        ac.storage.store.clear()
+        ac.storage = self.original_storage
+
+    def test_merge_and_split(self):
+        """
+        Do the results of a batch end up at the right jobs ?
+        """
+        job_1 = {
+            "experiment_0": {"instructions": [], "shots": 3},
+            "experiment_1": {"instructions": [], "shots": 4},
+        }
+        job_2 = {"sweep_0": {"instructions": [], "shots": 5}}
+
+        merged_dict, experiment_names = merge_jobs([job_1, job_2])
+        self.assertEqual(
+            list(merged_dict.keys()), ["experiment_0", "experiment_1", "experiment_2"]
+        )
+        self.assertEqual(merged_dict["experiment_2"]["shots"], 5)
+        self.assertEqual(
+            experiment_names, [["experiment_0", "experiment_1"], ["sweep_0"]]
+        )
+
+        manifest = {
+            "batch_id": "batch",
+            "jobs": [
+                {"job_id": "job_1", "experiments": experiment_names[0]},
+                {"job_id": "job_2", "experiments": experiment_names[1]},
+            ],
+        }
+        result_dict = {
+            "job_id": "batch",
+            "success": True,
+            "results": [
+                {"header": {"name": "experiment_" + str(index)}, "shots": shots}
+                for index, shots in enumerate((3, 4, 5))
+            ],
+        }
+        job_results = split_result(result_dict, manifest)
+        self.assertEqual(job_results["job_1"]["job_id"], "job_1")
+        self.assertEqual(
+            [exp["shots"] for exp in job_results["job_1"]["results"]], [3, 4]
+        )
+        self.assertEqual(
+            job_results["job_2"]["results"],
+            [{"header": {"name": "sweep_0"}, "shots": 5}],
+        )
+        self.assertEqual(result_dict["job_id"], "batch")
+        self.assertEqual(result_dict["results"][2]["header"]["name"], "experiment_2")
+
+    def test_failed_batch(self):
+        """
+        Does a batch that could not be written leave the queue as it was ?
+        """
+        backend = Backend.objects.get(name="fermions")
+        backend.coalesce_jobs = True
+        backend.save()
+        for _ in range(3):
+            req = self.client.post(
+                "/api/v1/fermions/post_job",
+                {
+                    "json": json.dumps(sample_job("fermions")),
+                    "username": self.username,
+                    "password": self.password,
+                },
+            )
+            self.assertEqual(req.status_code, 200)
+        queue_dir = "/Backend_files/Queued_Jobs/fermions/"
+        queued_names = ac.storage.get_file_queue(queue_dir)
+
+        upload = ac.storage.upload
+        spooler_params = {"username": "spooler", "password": self.password}
+        url = reverse("get_next_job_in_queue", kwargs={"backend_name": "fermions"})
+        for failing_folder in (
+            "/Backend_files/Status/fermions/" + BATCH_USERNAME + "/",
+            "/Backend_files/Running_Jobs/",
+        ):
+            # the write fails, although the file reached the storage
+            def failing_upload(dump_str, storage_path, folder=failing_folder):
+                upload(dump_str, storage_path)
+                if storage_path.startswith(folder):
+                    raise ConnectionError("Injected failure of upload!")
+
+            ac.storage.upload = failing_upload
+            req = self.client.get(url, spooler_params)
+            self.assertEqual(req.status_code, 406)
+            ac.storage.upload = upload
+            self.assertEqual(ac.storage.get_file_queue(queue_dir), queued_names)
+            for folder in (
+                "/Backend_files/Running_Jobs/",
+                "/Backend_files/Batches/fermions/",
+                "/Backend_files/Batched_Jobs/fermions/",
+                "/Backend_files/Status/fermions/" + BATCH_USERNAME + "/",
+            ):
+                self.assertFalse(ac.storage.get_file_queue(folder))
+
+        # a manifest without the status of its batch is left over from a failure
+        lost_id = "20220101_120000-fermions-" + BATCH_USERNAME + "-abcde"
+        ac.storage.upload(
+            json.dumps({"batch_id": lost_id, "jobs": []}),
+            "/Backend_files/Batches/fermions/batch-" + lost_id + ".json",
+        )
+        batch_msg_dict = self.client.get(url, spooler_params).json()
+        self.assertIn(BATCH_USERNAME, batch_msg_dict["job_id"])
+        self.assertEqual(
+            ac.storage.get_file_queue("/Backend_files/Batches/fermions/"),
+            ["batch-" + batch_msg_dict["job_id"] + ".json"],
+        )
+        self.assertFalse(ac.storage.get_file_queue(queue_dir))
+
+    def test_batch_round_trip(self):
+        """
+        Do coalesced jobs go from the submission over the batch of the spooler to
+        their own status and result ?
+        """
+        backend = Backend.objects.get(name="fermions")
+        backend.coalesce_jobs = True
+        backend.save()
+        payloads = {}
+        for index in range(3):
+            job_payload = {
+                "sweep_" + str(index) + "_" + str(exp_index): exp_dict
+                for exp_index, exp_dict in enumerate(
+                    sample_job("fermions", num_experiments=2, shots=5).values()
+                )
+            }
+            req = self.client.post(
+                "/api/v1/fermions/post_job",
+                {
+                    "json": json.dumps(job_payload),
+                    "username": self.username,
+                    "password": self.password,
+                },
+            )
+            self.assertEqual(req.status_code, 200)
+            payloads[req.json()["job_id"]] = job_payload
+
+        spooler_params = {"username": "spooler", "password": self.password}
+        url = reverse("get_next_job_in_queue", kwargs={"backend_name": "fermions"})
+        batch_msg_dict = self.client.get(url, spooler_params).json()
+        batch_id = batch_msg_dict["job_id"]
+        self.assertIn(BATCH_USERNAME, batch_id)
+        batch_payload = json.loads(
+            ac.storage.get_file_content(batch_msg_dict["job_json"])
+        )
+        self.assertEqual(len(batch_payload), 6)
+        self.assertFalse(QueueEntry.objects.filter(backend=backend).exists())
+
+        query = {"username": self.username, "password": self.password}
+        status_dict = self.client.get(
+            "/api/v1/fermions/get_job_status", dict(query, job_id=list(payloads)[1])
+        ).json()
+        self.assertEqual(status_dict["status"], "INITIALIZING")
+
+        # let us pretend that the spooler did the batch
+        ac.storage.upload(
+            json.dumps(sample_result("fermions", batch_id, batch_payload)),
+            result_json_path("fermions", batch_id),
+        )
+        ac.storage.upload(
+            json.dumps({"job_id": batch_id, "status": "DONE", "detail": "done"}),
+            status_json_path("fermions", batch_id),
+        )
+        ac.storage.move_file(
+            batch_msg_dict["job_json"],
+            "/Backend_files/Finished_Jobs/fermions/"
+            + BATCH_USERNAME
+            + "/job-"
+            + batch_id
+            + ".json",
+        )
+        # the job is only split once the spooler comes back
+        status_dict = self.client.get(
+            "/api/v1/fermions/get_job_status", dict(query, job_id=list(payloads)[1])
+        ).json()
+        self.assertEqual(status_dict["status"], "INITIALIZING")
+        self.client.get(url, spooler_params)
+        self.assertFalse(ac.storage.get_file_queue("/Backend_files/Batches/fermions"))
+
+        for job_id, job_payload in payloads.items():
+            status_dict = self.client.get(
+                "/api/v1/fermions/get_job_status", dict(query, job_id=job_id)
+            ).json()
+            self.assertEqual(status_dict["status"], "DONE")
+            self.assertNotIn("batch_id", status_dict)
+            result_dict = self.client.get(
+                "/api/v1/fermions/get_job_result", dict(query, job_id=job_id)
+            ).json()
+            self.assertEqual(result_dict["job_id"], job_id)
+            self.assertEqual(
+                [exp["header"]["name"] for exp in result_dict["results"]],
+                list(job_payload),
+            )
+            self.assertEqual(len(result_dict["results"][0]["data"]["memory"]), 5)
+
+
+class SchedulingPolicyTest(TestCase):
+    """
+    The class that contains the tests for the order of the queue.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        """
+        A busy user submits many jobs, before two other users submit one job each.
+        """
+        User.objects.create(username="busy")
+        User.objects.create(username="calm", queue_weight=1.0)
+        User.objects.create(username="boss", queue_priority=2)
+        self.backend = Backend.objects.get(name="fermions")
+        policy = SCHEDULING_POLICIES["fifo"]
+        for index in range(5):
+            policy.enqueue(self.backend, "busy", "busy_" + str(index))
+        policy.enqueue(self.backend, "calm", "calm_0")
+        policy.enqueue(self.backend, "boss", "boss_0")
+
+    def test_fair_share(self):
+        """
+        Does the single job of the other users overtake the queue of the busy user ?
+        """
+        policy = SCHEDULING_POLICIES["fair_share"]
+        job_list = policy.next_jobs(None, self.backend, limit=4)
+        self.assertEqual(
+            job_list,
+            [
+                "job-busy_0.json",
+                "job-busy_1.json",
+                "job-calm_0.json",
+                "job-boss_0.json",
+            ],
+        )
+        policy.dequeue(self.backend, job_list[:3])
+        self.assertEqual(policy.next_jobs(None, self.backend), ["job-boss_0.json"])
+
+    def test_priority(self):
+        """
+        Do the jobs of the high priority class run first ?
+        """
+        policy = SCHEDULING_POLICIES["priority"]
+        job_list = policy.next_jobs(None, self.backend, limit=2)
+        self.assertEqual(job_list, ["job-boss_0.json", "job-busy_0.json"])
+
+    def test_failed_move(self):
+        """
+        Does a job stay in the queue if the spooler could not get its file ?
+        """
+        user = User.objects.create(username="spooler")
+        user.set_password("secret")
+        user.save()
+        self.backend.scheduling_policy = "priority"
+        self.backend.save()
+        original_storage = ac.storage
+        ac.storage = MemoryProvider(error_rate={"move_file": 1.0})
+        ac.storage.store.clear()
+        ac.storage.upload("{}", "/Backend_files/Queued_Jobs/fermions/job-boss_0.json")
+        QueueStats.objects.create(backend=self.backend, queued=7)
+        url = reverse("get_next_job_in_queue", kwargs={"backend_name": "fermions"})
+        spooler_params = {"username": "spooler", "password": "secret"}
+        try:
+            req = self.client.get(url, spooler_params)
+            self.assertEqual(req.status_code, 406)
+            self.assertTrue(QueueEntry.objects.filter(job_id="boss_0").exists())
+
+            ac.storage.error_rate = {}
+            req = self.client.get(url, spooler_params)
+            self.assertEqual(req.json()["job_id"], "boss_0")
+            self.assertFalse(QueueEntry.objects.filter(job_id="boss_0").exists())
+
+            # the entries of jobs without a file are dropped
+            ac.storage.delete_file(req.json()["job_json"])
+            req = self.client.get(url, spooler_params)
+            self.assertEqual(req.status_code, 406)
+            self.assertFalse(QueueEntry.objects.filter(job_id="busy_0").exists())
+            # the counter of the queue follows the index
+            self.assertEqual(get_queue_stats(self.backend).queued, 5)
+            self.assertEqual(
+                get_queue_stats(self.backend).queued,
+                QueueEntry.objects.filter(backend=self.backend).count(),
+            )
+        finally:
+            ac.storage = original_storage
+
+
+class AdmissionControlTest(TestCase):
+    """
+    The class that contains the tests for the protection of the queues.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.backend = Backend.objects.get(name="fermions")
+        self.original_storage = ac.storage
+        ac.storage = MemoryProvider()
+        ac.storage.store.clear()
+
+    def tearDown(self):
+        ac.storage.store.clear()
+        ac.storage = self.original_storage
+
+    def test_full_queue(self):
+        """
+        Is a job rejected with a Retry-After once the queue is full ?
+        """
+        self.backend.max_queue_depth = 2
+        self.backend.save()
+        record_enqueue(self.backend)
+        record_enqueue(self.backend)
+
+        url = reverse("post_job", kwargs={"backend_name": "fermions"})
+        req = self.client.post(
+            url,
+            {"json": "{}", "username": self.username, "password": self.password},
+        )
+        self.assertEqual(req.status_code, 429)
+        self.assertEqual(req["Retry-After"], "60")
+        data = json.loads(req.content)
+        self.assertEqual(data["status"], "ERROR")
+
+        record_dequeue(self.backend, "job", ["job"])
+        stats = get_queue_stats(self.backend)
+        self.assertEqual(stats.queued, 1)
+        self.assertIsNotNone(stats.drain_interval)
+
+    def test_submit_rate(self):
+        """
+        Does the token bucket limit the burst of a user ?
+        """
+        self.backend.submit_rate = 0.5
+        self.backend.submit_burst = 2
+        self.backend.save()
+        self.assertEqual(take_submit_token(self.backend, self.username), 0)
+        self.assertEqual(take_submit_token(self.backend, self.username), 0)
+        wait = take_submit_token(self.backend, self.username)
+        self.assertGreater(wait, 1.9)
+        self.assertLessEqual(wait, 2)
+
+    def test_rejected_jobs_keep_tokens(self):
+        """
+        Do only the stored jobs use up the tokens of the user ?
+        """
+        self.backend.submit_rate = 0.01
+        self.backend.submit_burst = 1
+        self.backend.save()
+        url = reverse("post_job", kwargs={"backend_name": "fermions"})
+        form = {"username": self.username, "password": self.password}
+        req = self.client.post(url, dict(form, json="{"))
+        self.assertEqual(req.status_code, 406)
+        job_payload = json.dumps(sample_job("fermions"))
+        req = self.client.post(url, dict(form, json=job_payload))
+        self.assertEqual(req.status_code, 200)
+        req = self.client.post(url, dict(form, json=job_payload))
+        self.assertEqual(req.status_code, 429)
+        self.assertEqual(req["Retry-After"], "100")
+
+    def test_batch_submission_limits(self):
+        """
+        Does every job of a batch submission count towards the limits ?
+        """
+        url = "/api/v1/fermions/post_jobs"
+        form = {"username": self.username, "password": self.password}
+        job_list = [sample_job("fermions")] * 3
+
+        self.backend.max_queue_depth = 5
+        self.backend.save()
+        req = self.client.post(url, dict(form, json=json.dumps(job_list * 2)))
+        self.assertEqual(req.status_code, 429)
+        self.assertEqual(get_queue_stats(self.backend).queued, 0)
+
+        self.backend.max_jobs_per_user = 2
+        self.backend.save()
+        req = self.client.post(url, dict(form, json=json.dumps(job_list)))
+        self.assertEqual(req.status_code, 429)
+
+        self.backend.max_jobs_per_user = None
+        self.backend.submit_rate = 0.01
+        self.backend.submit_burst = 4
+        self.backend.save()
+        req = self.client.post(url, dict(form, json=json.dumps(job_list * 2)))
+        self.assertEqual(req.status_code, 429)
+        req = self.client.post(url, dict(form, json=json.dumps(job_list)))
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(get_queue_stats(self.backend).queued, 3)
+        # the stored jobs used up three of the four tokens
+        req = self.client.post(url, dict(form, json=json.dumps(job_list[:2])))
+        self.assertEqual(req.status_code, 429)
+        req = self.client.post(url, dict(form, json=json.dumps(job_list[:1])))
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(get_queue_stats(self.backend).queued, 4)
+
+    def test_running_jobs_count(self):
+        """
+        Do the running jobs of a user count towards `max_jobs_per_user` ?
+        """
+        self.backend.max_jobs_per_user = 2
+        self.backend.save()
+        job_id = "20220101_120000-fermions-" + self.username + "-abcde"
+        record_enqueue(self.backend)
+        record_dequeue(self.backend, job_id, [job_id])
+        other_id = "20220101_120000-fermions-other-abcde"
+        record_enqueue(self.backend)
+        record_enqueue(self.backend)
+        record_dequeue(
+            self.backend, "20220101_120000-fermions-_batch-abcde", [other_id, job_id]
+        )
+        self.assertEqual(count_running_jobs(get_queue_stats(self.backend), "other"), 1)
+
+        url = reverse("post_job", kwargs={"backend_name": "fermions"})
+        req = self.client.post(
+            url,
+            {
+                "json": json.dumps(sample_job("fermions")),
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 429)
+        record_completion(self.backend, [job_id])
+        for status_code in (200, 429):
+            req = self.client.post(
+                url,
+                {
+                    "json": json.dumps(sample_job("fermions")),
+                    "username": self.username,
+                    "password": self.password,
+                },
+            )
+            self.assertEqual(req.status_code, status_code)
+        record_completion(self.backend, ["20220101_120000-fermions-_batch-abcde"])
+        self.assertEqual(count_running_jobs(get_queue_stats(self.backend), "other"), 0)
+
+
+class QueueStatsTest(TestCase):
+    """
+    The class that contains the tests for the statistics of the queues.
+    """
+
+    fixtures = ["backend.json"]
+
+    def test_queue_stats(self):
+        """
+        Do the statistics follow a job through the queue ?
+        """
+        backend = Backend.objects.get(name="fermions")
+        job_id = "20220101_120000-fermions-user-abcde"
+        record_enqueue(backend)
+        record_enqueue(backend)
+        record_dequeue(backend, job_id, [job_id])
+
+        url = "/api/v1/fermions/queue_stats"
+        req = self.client.get(url)
+        self.assertEqual(req.status_code, 200)
+        data = json.loads(req.content)
+        self.assertEqual(data["queue_depth"], 1)
+        self.assertEqual(data["running"], 1)
+        self.assertGreater(data["queue_wait_p50"], 3600)
+        self.assertIsNone(data["execution_time_p95"])
+        self.assertIsNotNone(data["estimated_start"])
+
+        record_completion(backend, [job_id])
+        record_completion(backend, [job_id])
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual(data["running"], 0)
+        self.assertIsNotNone(data["execution_time_p95"])
+        self.assertAlmostEqual(data["jobs_per_minute"], 60 / 900)
+
+        req = self.client.get("/api/v1/nobackend/queue_stats")
+        self.assertEqual(req.status_code, 404)
+
+    def test_completion_on_poll(self):
+        """
+        Does a poll of the spooler only count the jobs that left the running jobs ?
+        """
+        user = User.objects.create(username="spooler")
+        user.set_password("secret")
+        user.save()
+        original_storage = ac.storage
+        ac.storage = MemoryProvider()
+        ac.storage.store.clear()
+        self.addCleanup(setattr, ac, "storage", original_storage)
+        self.addCleanup(ac.storage.store.clear)
+
+        backend = Backend.objects.get(name="fermions")
+        running_id = "20220101_120000-fermions-user-abcde"
+        finished_id = "20220101_120000-fermions-user-fghij"
+        for job_id in (running_id, finished_id):
+            record_enqueue(backend)
+            record_dequeue(backend, job_id, [job_id])
+        ac.storage.upload(
+            "{}", "/Backend_files/Running_Jobs/job-" + running_id + ".json"
+        )
+
+        url = reverse("get_next_job_in_queue", kwargs={"backend_name": "fermions"})
+        spooler_params = {"username": "spooler", "password": "secret"}
+        for _ in range(2):
+            req = self.client.get(url, spooler_params)
+            self.assertEqual(req.json()["job_id"], running_id)
+        stats = get_queue_stats(backend)
+        self.assertEqual(list(stats.running), [running_id])
+        self.assertEqual(len(stats.execution_times), 1)
+
+
+class JobValidationTest(TestCase):
+    """
+    The class that contains the tests for the validation of the submitted jobs.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+
+    def test_validate_job(self):
+        """
+        Are jobs beyond the capabilities of the backend rejected ?
+        """
+        backend = Backend.objects.get(name="fermions")
+        job_payload = {
+            "experiment_"
+            + str(ii): {
+                "instructions": [
+                    ["load", [7], []],
+                    ["fhop", [0, 1, 2, 3], [0.1 * ii]],
+                    ["measure", [7], []],
+                ],
+                "num_wires": 8,
+                "shots": 4,
+            }
+            for ii in range(100)
+        }
+        self.assertIsNone(validate_job(backend, job_payload))
+
+        job_payload["experiment_3"]["instructions"][1] = ["fhop", [1, 2, 3, 4], [0]]
+        self.assertIn("experiment_3/instructions/1", validate_job(backend, job_payload))
+        job_payload["experiment_3"]["instructions"][1] = ["rlx", [1], [0]]
+        self.assertIn("rlx", validate_job(backend, job_payload))
+        job_payload["experiment_3"]["instructions"][1] = ["load", [8], []]
+        self.assertIsNotNone(validate_job(backend, job_payload))
+        job_payload["experiment_3"]["instructions"][1] = ["load", [1], []]
+        job_payload["experiment_3"]["shots"] = backend.max_shots + 1
+        self.assertIn("experiment_3/shots", validate_job(backend, job_payload))
+
+        backend.max_experiments = 10
+        backend.save()
+        self.assertIn("10", validate_job(backend, job_payload))
+
+    def test_post_invalid_job(self):
+        """
+        Is an invalid job rejected before it is stored ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [9], []), ("measure", [9], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        url = reverse("post_job", kwargs={"backend_name": "fermions"})
+        req = self.client.post(
+            url,
+            {
+                "json": json.dumps(job_payload),
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 406)
+        data = json.loads(req.content)
+        self.assertEqual(data["status"], "ERROR")
+        self.assertIn("experiment_0/instructions/0/1/0", data["detail"])
+
+
+class JobArchiveTest(TestCase):
+    """
+    The class that contains the tests for the archival of old jobs.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.root_dir = tempfile.mkdtemp()
+        self.original_storage = ac.storage
+        ac.storage = LocalFileProvider(self.root_dir)
+
+    def tearDown(self):
+        ac.storage = self.original_storage
+        shutil.rmtree(self.root_dir)
+
+    def add_finished_job(self, job_id: str) -> None:
+        """
+        Put the files of a finished job on the storage.
+        """
+        ac.storage.upload(
+            "{}",
+            "/Backend_files/Finished_Jobs/fermions/"
+            + self.username
+            + "/job-"
+            + job_id
+            + ".json",
+        )
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "status": "DONE"}),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json",
+        )
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "results": [{"data": {"memory": ["0"]}}]}),
+            "/Backend_files/Result/fermions/"
+            + self.username
+            + "/result-"
+            + job_id
+            + ".json",
+        )
+
+    def test_archive_jobs(self):
+        """
+        Are old jobs archived and can we still get their results ?
+        """
+        old_id = "20200101_000000-fermions-" + self.username + "-abcde"
+        new_id = "29990101_000000-fermions-" + self.username + "-abcde"
+        self.add_finished_job(old_id)
+        self.add_finished_job(new_id)
+
+        # nothing happens without a retention
+        call_command("archive_jobs", stdout=io.StringIO())
+        self.assertFalse(ArchivedJob.objects.exists())
+
+        Backend.objects.filter(name="fermions").update(retention_days=30)
+        output = io.StringIO()
+        call_command("archive_jobs", stdout=output)
+        self.assertIn("fermions: archived 1 jobs", output.getvalue())
+        self.assertEqual(
+            list(ArchivedJob.objects.values_list("job_id", flat=True)), [old_id]
+        )
+        self.assertEqual(
+            ac.storage.get_file_queue(
+                "/Backend_files/Finished_Jobs/fermions/" + self.username + "/"
+            ),
+            ["job-" + new_id + ".json"],
+        )
+        self.assertEqual(
+            len(ac.storage.get_file_queue("/Backend_files/Archive/fermions/")), 1
+        )
+
+        query = {"job_id": old_id, "username": self.username, "password": self.password}
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(json.loads(req.content)["results"][0]["data"]["memory"], ["0"])
+        req = self.client.get("/api/v1/fermions/get_job_status", query)
+        self.assertEqual(json.loads(req.content)["status"], "DONE")
+        req = self.client.get("/api/v1/fermions/get_user_jobs", query)
+        self.assertEqual(json.loads(req.content)["job_ids"], [old_id, new_id])
+
+    def test_archive_with_missing_chunk(self):
+        """
+        Is a chunked result with a missing chunk left on the storage ?
+        """
+        old_id = "20200101_000000-fermions-" + self.username + "-abcde"
+        self.add_finished_job(old_id)
+        ac.storage.upload(
+            json.dumps(
+                {"job_id": old_id, "status": "DONE", "result_layout": "chunked"}
+            ),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + old_id
+            + ".json",
+        )
+        manifest = {}
+        for index in range(2):
+            manifest = write_result_chunk(
+                ac.storage,
+                "fermions",
+                old_id,
+                manifest,
+                {"header": {"name": "exp_" + str(index)}},
+                complete=index == 1,
+            )
+        ac.storage.delete_file(chunk_path("fermions", old_id, 0))
+        Backend.objects.filter(name="fermions").update(retention_days=30)
+        output = io.StringIO()
+        call_command("archive_jobs", stdout=output)
+        self.assertIn("fermions: archived 0 jobs", output.getvalue())
+        self.assertFalse(ArchivedJob.objects.exists())
+        self.assertEqual(
+            json.loads(ac.storage.get_file_content(chunk_path("fermions", old_id, 1))),
+            {"header": {"name": "exp_1"}},
+        )
+
+    def test_archive_with_failing_storage(self):
+        """
+        Are jobs left alone if the storage fails while they are read ?
+        """
+
+        class FailingProvider(LocalFileProvider):
+            """
+            A storage that cannot read the status of the jobs.
+            """
+
+            def get_file_content(self, storage_path: str) -> str:
+                if "/Status/" in storage_path:
+                    raise StorageUnavailable("The storage is down")
+                return super().get_file_content(storage_path)
+
+        old_id = "20200101_000000-fermions-" + self.username + "-abcde"
+        self.add_finished_job(old_id)
+        Backend.objects.filter(name="fermions").update(retention_days=30)
+        ac.storage = FailingProvider(self.root_dir)
+        output = io.StringIO()
+        call_command("archive_jobs", stdout=output)
+        self.assertIn("fermions: archived 0 jobs", output.getvalue())
+        self.assertFalse(ArchivedJob.objects.exists())
+        self.assertEqual(
+            json.loads(
+                ac.storage.get_file_content(
+                    "/Backend_files/Result/fermions/"
+                    + self.username
+                    + "/result-"
+                    + old_id
+                    + ".json"
+                )
+            )["job_id"],
+            old_id,
+        )
+
+        ac.storage = LocalFileProvider(self.root_dir)
+        output = io.StringIO()
+        call_command("archive_jobs", stdout=output)
+        self.assertIn("fermions: archived 1 jobs", output.getvalue())
+
+    def test_export_jobs(self):
+        """
+        Can we download the stored and the archived jobs as a single archive ?
+        """
+        old_id = "20200101_000000-fermions-" + self.username + "-abcde"
+        new_id = "29990101_000000-fermions-" + self.username + "-abcde"
+        self.add_finished_job(old_id)
+        self.add_finished_job(new_id)
+        Backend.objects.filter(name="fermions").update(retention_days=30)
+        call_command("archive_jobs", stdout=io.StringIO())
+
+        query = {"username": self.username, "password": self.password}
+        req = self.client.get("/api/v1/fermions/export_jobs", query)
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(req["Content-Type"], "application/zip")
+        self.assertNotIn("Content-Length", req)
+        # the archive is sent job by job while it is built
+        parts = list(req.streaming_content)
+        self.assertGreater(len(parts), 2)
+        archive = b"".join(parts)
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            self.assertEqual(
+                sorted(zip_file.namelist()),
+                sorted(
+                    [
+                        job_id + "/" + name
+                        for job_id in (old_id, new_id)
+                        for name in ("job.json", "status.json", "result.json")
+                    ]
+                    + ["manifest.json"]
+                ),
+            )
+            result_dict = json.loads(zip_file.read(old_id + "/result.json"))
+            self.assertEqual(result_dict["results"][0]["data"]["memory"], ["0"])
+            manifest = json.loads(zip_file.read("manifest.json"))
+            self.assertEqual(
+                [job["job_id"] for job in manifest["jobs"]], [old_id, new_id]
+            )
+
+        # only the selected jobs of the user are exported
+        query["job_ids"] = new_id
+        req = self.client.get("/api/v1/fermions/export_jobs", query)
+        with zipfile.ZipFile(io.BytesIO(b"".join(req.streaming_content))) as zip_file:
+            self.assertIn(new_id + "/result.json", zip_file.namelist())
+            self.assertNotIn(old_id + "/result.json", zip_file.namelist())
+        query["job_ids"] = "20200101_000000-fermions-other-abcde"
+        req = self.client.get("/api/v1/fermions/export_jobs", query)
+        self.assertEqual(req.status_code, 404)
+
+
+class CallbackReceiver(http.server.BaseHTTPRequestHandler):
+    """
+    The stand-in for the server of a user that receives the notifications.
+    """
+
+    def do_POST(self):  # pylint: disable=C0103
+        """
+        Keep the notification and answer with the status of the server.
+        """
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.received.append((dict(self.headers), body))
+        self.send_response(self.server.answer)
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        """
+        Keep the test output clean.
+        """
+
+
+class WebhookTest(TestCase):
+    """
+    The class that contains the tests for the notifications about finished jobs.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.root_dir = tempfile.mkdtemp()
+        self.original_storage = ac.storage
+        ac.storage = LocalFileProvider(self.root_dir)
+        self.receiver = http.server.HTTPServer(("127.0.0.1", 0), CallbackReceiver)
+        self.receiver.received = []
+        self.receiver.answer = 200
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        self.callback_url = (
+            "http://127.0.0.1:" + str(self.receiver.server_address[1]) + "/hook"
+        )
+        # the receiver runs on the loopback interface
+        self.settings_override = override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.receiver.shutdown()
+        self.receiver.server_close()
+        ac.storage = self.original_storage
+        shutil.rmtree(self.root_dir)
+
+    def submit_and_finish(self) -> WebhookDelivery:
+        """
+        Submit a job with a callback and let the spooler finish it.
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [7], []), ("measure", [7], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        req = self.client.post(
+            "/api/v1/fermions/post_job",
+            {
+                "json": json.dumps(job_payload),
+                "username": self.username,
+                "password": self.password,
+                "callback_url": self.callback_url,
+                "callback_secret": "secret",
+            },
+        )
+        self.assertEqual(req.status_code, 200)
+        job_id = json.loads(req.content)["job_id"]
+        delivery = WebhookDelivery.objects.get(job_id=job_id)
+        self.assertEqual(delivery.state, "WAITING")
+
+        backend = Backend.objects.get(name="fermions")
+        get_scheduling_policy(backend).dequeue(backend, ["job-" + job_id + ".json"])
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "status": "DONE"}),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json",
+        )
+        release_finished_deliveries(backend)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.state, "PENDING")
+        return delivery
+
+    def test_delivery(self):
+        """
+        Is the signed notification posted once the job is finished ?
+        """
+        delivery = self.submit_and_finish()
+        self.assertIsNone(deliver_webhook(delivery.id))
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.state, "DELIVERED")
+
+        self.assertEqual(len(self.receiver.received), 1)
+        headers, body = self.receiver.received[0]
+        self.assertEqual(json.loads(body)["job_id"], delivery.job_id)
+        self.assertEqual(json.loads(body)["status"], "DONE")
+        key = hmac.new(b"secret", b"qlue-webhook", hashlib.sha256).hexdigest()
+        expected = hmac.new(
+            key.encode("utf-8"),
+            headers[TIMESTAMP_HEADER].encode("utf-8") + b"." + body,
+            hashlib.sha256,
+        ).hexdigest()
+        self.assertEqual(headers[SIGNATURE_HEADER], "sha256=" + expected)
+        self.assertNotEqual(delivery.secret, "secret")
+
+        # nothing is sent twice
+        self.assertIsNone(deliver_webhook(delivery.id))
+        self.assertEqual(len(self.receiver.received), 1)
+
+    def test_dead_letter(self):
+        """
+        Are failed deliveries retried until they become dead letters ?
+        """
+        self.receiver.answer = 500
+        delivery = self.submit_and_finish()
+        for _ in range(MAX_DELIVERY_ATTEMPTS - 1):
+            self.assertGreater(deliver_webhook(delivery.id), 0)
+        self.assertIsNone(deliver_webhook(delivery.id))
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.state, "FAILED")
+        self.assertEqual(delivery.attempts, MAX_DELIVERY_ATTEMPTS)
+        self.assertIn("500", delivery.last_error)
+
+    def test_invalid_callback(self):
+        """
+        Are submissions with a callback that cannot be used rejected ?
+        """
+        credentials = {"username": self.username, "password": self.password}
+        req = self.client.post(
+            "/api/v1/fermions/post_job",
+            {"json": "{}", "callback_url": "ftp://example.com", **credentials},
+        )
+        self.assertEqual(req.status_code, 406)
+        req = self.client.post(
+            "/api/v1/fermions/post_job",
+            {"json": "{}", "callback_url": self.callback_url, **credentials},
+        )
+        self.assertEqual(req.status_code, 406)
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_internal_callback(self):
+        """
+        Are callbacks to the internal network rejected and redirects not followed ?
+        """
+        credentials = {"username": self.username, "password": self.password}
+        with override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False):
+            for callback_url in (
+                self.callback_url,
+                "http://169.254.169.254/latest/meta-data/",
+                "http://10.0.0.1/hook",
+                "http://[::ffff:127.0.0.1]/hook",
+            ):
+                req = self.client.post(
+                    "/api/v1/fermions/post_job",
+                    {
+                        "json": "{}",
+                        "callback_url": callback_url,
+                        "callback_secret": "secret",
+                        **credentials,
+                    },
+                )
+                self.assertEqual(req.status_code, 406)
+                self.assertIn("public host", req.json()["detail"])
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+        # the host is checked again before the notification is sent
+        delivery = self.submit_and_finish()
+        with override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False):
+            self.assertGreater(deliver_webhook(delivery.id), 0)
+        self.assertEqual(self.receiver.received, [])
+        delivery.refresh_from_db()
+        self.assertIn("public host", delivery.last_error)
+
+        self.receiver.answer = 302
+        self.assertGreater(deliver_webhook(delivery.id), 0)
+        delivery.refresh_from_db()
+        self.assertIn("302", delivery.last_error)
+
+    def test_pinned_address(self):
+        """
+        Is the notification sent to the address that was checked instead of resolving
+        the host again ?
+        """
+        delivery = self.submit_and_finish()
+        port = str(self.receiver.server_address[1])
+        # the name cannot be resolved, so only the checked address leads to the receiver
+        delivery.url = "http://qlue-callback.invalid:" + port + "/hook"
+        delivery.save()
+        with mock.patch(
+            "backends.webhooks.check_callback_host", return_value=["127.0.0.1"]
+        ):
+            self.assertIsNone(deliver_webhook(delivery.id))
+        headers, _ = self.receiver.received[0]
+        self.assertEqual(headers["Host"], "qlue-callback.invalid:" + port)
+
+
+class MetricsTest(TestCase):
+    """
+    The class that contains the tests for the latency metrics.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.root_dir = tempfile.mkdtemp()
+        self.original_storage = ac.storage
+        ac.storage = InstrumentedProvider(LocalFileProvider(self.root_dir))
+        REGISTRY.reset()
+
+    def tearDown(self):
+        ac.storage = self.original_storage
+        shutil.rmtree(self.root_dir)
+
+    def test_server_timing(self):
+        """
+        Do we get the phases of a request if we ask for them ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [7], []), ("measure", [7], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        data = {
+            "json": json.dumps(job_payload),
+            "username": self.username,
+            "password": self.password,
+        }
+        req = self.client.post("/api/v1/fermions/post_job", data)
+        self.assertEqual(req.status_code, 200)
+        self.assertFalse(req.has_header("Server-Timing"))
+        req = self.client.post(
+            "/api/v1/fermions/post_job", data, HTTP_X_SERVER_TIMING="1"
+        )
+        for phase in ("auth", "db", "storage", "total"):
+            self.assertIn(phase + ";dur=", req["Server-Timing"])
+
+        for prefix in ("Queued_Jobs", "Status"):
+            self.assertEqual(
+                REGISTRY.counter_value(
+                    "qlue_storage_calls_total", {"method": "upload", "prefix": prefix}
+                ),
+                2,
+            )
+        self.assertEqual(
+            REGISTRY.histogram_count(
+                "qlue_request_duration_seconds",
+                {"view": "api/v1/<backend_name>/post_job", "method": "POST"},
+            ),
+            2,
+        )
+
+    @override_settings(METRICS_TOKEN="token")
+    def test_metrics_endpoint(self):
+        """
+        Can only admins read the metrics ?
+        """
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        req = self.client.get(url, HTTP_AUTHORIZATION="Bearer token")
+        self.assertEqual(req.status_code, 200)
+        self.assertIn(
+            "# TYPE qlue_request_duration_seconds histogram", req.content.decode()
+        )
+        self.assertIn(
+            'qlue_request_duration_seconds_count{method="GET"', req.content.decode()
+        )
+
+        User.objects.filter(username=self.username).update(is_staff=True)
+        self.client.login(username=self.username, password=self.password)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        req = self.client.get(reverse("slow_storage_calls"))
+        self.assertEqual(json.loads(req.content), {"slow_calls": []})
+
+    def test_instrumented_provider(self):
+        """
+        Are failures, retries and slow calls of the storage recorded ?
+        """
+        storage_provider = InstrumentedProvider(
+            LocalFileProvider(self.root_dir), slow_call_seconds=0
+        )
+        storage_path = "/Backend_files/Result/fermions/test/result-test.json"
+        for _ in range(2):
+            with self.assertRaises(FileNotFoundError):
+                storage_provider.get_file_content(storage_path)
+        storage_provider.upload("{}", storage_path)
+        self.assertEqual(storage_provider.get_file_content(storage_path), "{}")
+        self.assertEqual(storage_provider.root_dir, self.root_dir)
+
+        labels = {"method": "get_file_content", "prefix": "Result"}
+        self.assertEqual(REGISTRY.counter_value("qlue_storage_calls_total", labels), 3)
+        self.assertEqual(
+            REGISTRY.counter_value(
+                "qlue_storage_errors_total", dict(labels, error="FileNotFoundError")
+            ),
+            2,
+        )
+        self.assertEqual(
+            REGISTRY.counter_value("qlue_storage_retries_total", labels), 2
+        )
+        self.assertEqual(
+            REGISTRY.counter_value(
+                "qlue_storage_bytes_total", {"method": "upload", "prefix": "Result"}
+            ),
+            2,
+        )
+        self.assertEqual(len(storage_provider.slow_calls), 4)
+        self.assertEqual(storage_provider.slow_calls[0]["error"], "FileNotFoundError")
+
+
+class BenchmarkTest(TestCase):
+    """
+    The tests for the parts of the load test that do not need a server.
+    """
+
+    fixtures = ["backend.json"]
+
+    def test_sample_jobs(self):
+        """
+        Are the sample jobs accepted by their backends ?
+        """
+        for backend in Backend.objects.all():
+            job_payload = sample_job(backend.name, num_experiments=3, shots=5)
+            self.assertIsNone(validate_job(backend, job_payload))
+            result_dict = sample_result(backend.name, "job", job_payload)
+            self.assertEqual(len(result_dict["results"]), 3)
+            self.assertEqual(len(result_dict["results"][0]["data"]["memory"]), 5)
+
+    def test_report(self):
+        """
+        Test the summary of the latencies and the comparison of two runs.
+        """
+        self.assertEqual(parse_mix("post_job=1,get_config=3")["get_config"], 3)
+        with self.assertRaises(ValueError):
+            parse_mix("post_jobs=1")
+        numbers = summarize([0.001 * ii for ii in range(1, 101)], 2, 10)
+        self.assertEqual(numbers["requests"], 100)
+        self.assertEqual(numbers["rps"], 10)
+        self.assertAlmostEqual(numbers["p50_ms"], 50)
+        self.assertAlmostEqual(numbers["p99_ms"], 99)
+        lines = compare_reports(
+            {"total": numbers}, {"total": dict(numbers, rps=12), "operations": {}}
+        )
+        self.assertIn("+20.0%", lines[0])
+
+    def test_measure(self):
+        """
+        Test the timing of the microbenchmarks.
+        """
+        timing = measure(lambda: sum(range(100)), repeat=2)
+        self.assertGreater(timing["number"], 1)
+        self.assertLessEqual(timing["best_us"], timing["median_us"])
+        entry = dict({"suite": "test", "name": "sum", "params": {"n": 100}}, **timing)
+        slower = dict(entry, median_us=2 * entry["median_us"])
+        lines = compare_results({"results": [entry]}, {"results": [slower]})
+        self.assertIn("+100.0%", lines[0])
+
+
+class ProfilingTest(TestCase):
+    """
+    The tests for the profiles of single requests.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username, is_staff=True)
+        user.set_password(self.password)
+        user.save()
+        other_user = User.objects.create(username="other")
+        other_user.set_password(self.password)
+        other_user.save()
+
+    def test_profile_request(self):
+        """
+        Is the request of a staff user profiled if it asks for it ?
+        """
+        url = reverse("get_config", kwargs={"backend_name": "fermions"})
+        req = self.client.get(
+            url,
+            {"username": self.username, "password": self.password, "profile": "1"},
+        )
+        self.assertEqual(req.status_code, 200)
+        profile = RequestProfile.objects.get(id=int(req[PROFILE_ID_HEADER]))
+        self.assertEqual(profile.username, self.username)
+        self.assertEqual(profile.status_code, 200)
+        self.assertNotIn("password", profile.path)
+        self.assertIn("function calls", profile.summary)
+        self.assertTrue(marshal.loads(bytes(profile.stats)))
+
+        # the password is only checked by the view
+        with mock.patch.object(
+            User, "check_password", autospec=True, side_effect=User.check_password
+        ) as check_password:
+            req = self.client.get(
+                url,
+                {"username": self.username, "password": self.password, "profile": "1"},
+            )
+        self.assertIn(PROFILE_ID_HEADER, req)
+        self.assertEqual(check_password.call_count, 1)
+
+        # the api v1 with the session of the admin
+        self.client.force_login(User.objects.get(username=self.username))
+        req = self.client.get("/api/v1/backends", HTTP_X_QLUE_PROFILE="1")
+        self.assertIn(PROFILE_ID_HEADER, req)
+
+    def test_no_profile(self):
+        """
+        Are requests without the flag or of other users left alone ?
+        """
+        url = reverse("get_config", kwargs={"backend_name": "fermions"})
+        req = self.client.get(url, {"username": "other", "password": self.password})
+        self.assertNotIn(PROFILE_ID_HEADER, req)
+        req = self.client.get(
+            url, {"username": "other", "password": self.password, "profile": "1"}
+        )
+        self.assertEqual(req.status_code, 200)
+        self.assertNotIn(PROFILE_ID_HEADER, req)
+        self.assertEqual(RequestProfile.objects.count(), 0)
+
+    def test_admin_downloads(self):
+        """
+        Can the files of a profile be downloaded from the admin ?
+        """
+        url = reverse("get_config", kwargs={"backend_name": "fermions"})
+        req = self.client.get(
+            url,
+            {"username": self.username, "password": self.password},
+            **{"HTTP_" + PROFILE_HEADER.upper().replace("-", "_"): "1"},
+        )
+        profile_id = int(req[PROFILE_ID_HEADER])
+        User.objects.create_superuser("admin", password=self.password)
+        self.client.login(username="admin", password=self.password)
+        req = self.client.get(
+            reverse("admin:backends_requestprofile_cprofile", args=[profile_id])
+        )
+        self.assertEqual(req.status_code, 200)
+        self.assertTrue(marshal.loads(req.content))
+        req = self.client.get(
+            reverse("admin:backends_requestprofile_change", args=[profile_id])
+        )
+        self.assertContains(req, "stacks for flamegraphs")
+
+
+class TracingTest(TestCase):
+    """
+    The tests for the traces of the jobs.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        for username in (self.username, "spooler"):
+            user = User.objects.create(username=username)
+            user.set_password(self.password)
+            user.save()
+        self.original_storage = ac.storage
+        ac.storage = InstrumentedProvider(MemoryProvider())
+        ac.storage.store.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.trace_file = self.tmp_dir + "/traces.jsonl"
+
+    def tearDown(self):
+        ac.storage.store.clear()
+        ac.storage = self.original_storage
+        shutil.rmtree(self.tmp_dir)
+
+    def read_spans(self) -> list:
+        """
+        The spans that were exported so far.
+        """
+        flush_traces()
+        with open(self.trace_file, encoding="utf-8") as trace_file:
+            return list(read_spans(trace_file))
+
+    def test_job_trace(self):
+        """
+        Do all the spans of a job end up in the trace of its submission ?
+        """
+        client_trace_id = "ab" * 16
+        with override_settings(TRACING_FILE=self.trace_file):
+            req = self.client.post(
+                "/api/v1/fermions/post_job",
+                {
+                    "json": json.dumps(sample_job("fermions")),
+                    "username": self.username,
+                    "password": self.password,
+                },
+                HTTP_TRACEPARENT="00-" + client_trace_id + "-" + "cd" * 8 + "-01",
+            )
+            self.assertEqual(req.status_code, 200)
+            self.assertEqual(req.json()["trace_id"], client_trace_id)
+            job_id = req.json()["job_id"]
+
+            spooler_params = {"username": "spooler", "password": self.password}
+            url = reverse("get_next_job_in_queue", kwargs={"backend_name": "fermions"})
+            job_msg_dict = self.client.get(url, spooler_params).json()
+            self.assertEqual(job_msg_dict["job_id"], job_id)
+            self.assertIn(client_trace_id, job_msg_dict["traceparent"])
+
+            now = time.time()
+            req = self.client.post(
+                reverse("post_spans", kwargs={"backend_name": "fermions"}),
+                dict(
+                    spooler_params,
+                    spans=json.dumps(
+                        [
+                            {
+                                "name": "storage.upload",
+                                "traceparent": job_msg_dict["traceparent"],
+                                "start_time": now - 0.5,
+                                "end_time": now,
+                            }
+                        ]
+                    ),
+                ),
+            )
+            self.assertEqual(req.json(), {"accepted": 1})
+            # the spooler moved the job on, so it finished it
+            ac.storage.delete_file(job_msg_dict["job_json"])
+            self.client.get(url, spooler_params)
+
+        spans = self.read_spans()
+        job_spans = [span for span in spans if span["traceId"] == client_trace_id]
+        names = {span["name"] for span in job_spans}
+        for name in ("POST api/v1/<backend_name>/post_job", "storage.upload"):
+            self.assertIn(name, names)
+        self.assertIn("job.queued", names)
+        self.assertIn("job.running", names)
+        running_span = next(span for span in job_spans if span["name"] == "job.running")
+        self.assertIn(running_span["spanId"], job_msg_dict["traceparent"])
+
+        breakdown = job_latency_breakdown(spans)
+        self.assertEqual(breakdown[0]["job_ids"], [job_id])
+        self.assertGreaterEqual(breakdown[0]["transfer"], 0.5)
+        out = io.StringIO()
+        call_command("trace_breakdown", self.trace_file, "--job", job_id, stdout=out)
+        self.assertIn(job_id, out.getvalue())
+
+    def test_post_spans_checks(self):
+        """
+        Are malformed spans and other users turned away ?
+        """
+        url = reverse("post_spans", kwargs={"backend_name": "fermions"})
+        span_dict = {
+            "name": "execution",
+            "traceparent": "00-" + "ab" * 16 + "-" + "cd" * 8 + "-01",
+            "start_time": 2.0,
+            "end_time": 1.0,
+        }
+        with override_settings(TRACING_FILE=self.trace_file):
+            req = self.client.post(
+                url,
+                {
+                    "username": "spooler",
+                    "password": self.password,
+                    "spans": json.dumps([span_dict]),
+                },
+            )
+            self.assertEqual(req.status_code, 406)
+            span_dict["end_time"] = 3.0
+            req = self.client.post(
+                url,
+                {
+                    "username": self.username,
+                    "password": self.password,
+                    "spans": json.dumps([span_dict]),
+                },
+            )
+            self.assertEqual(req.status_code, 406)
+        # nothing is traced without the settings
+        num_spans = len(self.read_spans())
+        req = self.client.get("/api/v1/backends")
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(len(self.read_spans()), num_spans)
+
+
+class StorageRegistryTest(TestCase):
+    """
+    The tests for the storage providers of the settings.
+    """
+
+    def test_build_from_settings(self):
+        """
+        Are the providers and their wrappers built once from the settings ?
+        """
+        storage_providers = {
+            "default": {
+                "BACKEND": "backends.storage_providers.LocalFileProvider",
+                "OPTIONS": {"root_dir": "/tmp/qlue-registry"},
+                "WRAPPERS": [
+                    {
+                        "BACKEND": "backends.storage_providers.InstrumentedProvider",
+                        "OPTIONS": {"slow_call_seconds": 0.5},
+                    }
+                ],
+            },
+            "memory": {"BACKEND": "backends.memory_storage.MemoryProvider"},
+        }
+
+        class Holder:
+            """
+            A class with a lazy storage like the app.
+            """
+
+            # pylint: disable=R0903
+            storage = LazyProvider()
+
+        with override_settings(STORAGE_PROVIDERS=storage_providers):
+            storage_provider = Holder.storage
+            self.assertIsInstance(storage_provider, InstrumentedProvider)
+            self.assertEqual(storage_provider.slow_call_seconds, 0.5)
+            self.assertIsInstance(storage_provider.provider, LocalFileProvider)
+            self.assertEqual(storage_provider.root_dir, "/tmp/qlue-registry")
+            self.assertIs(Holder.storage, storage_provider)
+            self.assertIsInstance(get_provider("memory"), MemoryProvider)
+            with self.assertRaises(ImproperlyConfigured):
+                get_provider("missing")
+        with override_settings(
+            STORAGE_PROVIDERS={"default": {"BACKEND": "backends.NoProvider"}}
+        ):
+            with self.assertRaises(ImproperlyConfigured):
+                get_provider()
+
+
+class StorageRoutingTest(TestCase):
+    """
+    The tests for backends with their own storage.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.app_dir = tempfile.mkdtemp()
+        self.backend_dir = tempfile.mkdtemp()
+        self.original_storage = ac.storage
+        ac.storage = LocalFileProvider(self.app_dir)
+        self.settings_override = override_settings(
+            STORAGE_PROVIDERS={
+                "simulators": {
+                    "BACKEND": "backends.storage_providers.LocalFileProvider",
+                    "OPTIONS": {"root_dir": self.backend_dir},
+                }
+            }
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        ac.storage = self.original_storage
+        shutil.rmtree(self.app_dir)
+        shutil.rmtree(self.backend_dir)
+
+    def test_backend_storage(self):
+        """
+        Are the jobs of a backend kept in its own storage ?
+        """
+        backend = Backend.objects.get(name="fermions")
+        backend.storage_config = "simulators"
+        backend.full_clean()
+        backend.save()
+        backend_provider = LocalFileProvider(self.backend_dir)
+        for backend_name in ("fermions", "singlequdit"):
+            req = self.client.post(
+                "/api/v1/" + backend_name + "/post_job",
+                {
+                    "json": json.dumps(sample_job(backend_name)),
+                    "username": self.username,
+                    "password": self.password,
+                },
+            )
+            self.assertEqual(req.status_code, 200)
+            job_id = req.json()["job_id"]
+            req = self.client.get(
+                reverse("get_job_status", kwargs={"backend_name": backend_name}),
+                {
+                    "json": json.dumps({"job_id": job_id}),
+                    "username": self.username,
+                    "password": self.password,
+                },
+            )
+            self.assertEqual(req.json()["status"], "INITIALIZING")
+            queue_dir = "/Backend_files/Queued_Jobs/" + backend_name + "/"
+            in_backend_store = bool(backend_provider.get_file_queue(queue_dir))
+            self.assertEqual(in_backend_store, backend_name == "fermions")
+            self.assertEqual(
+                bool(ac.storage.get_file_queue(queue_dir)), backend_name != "fermions"
+            )
+
+        backend.storage_config = "missing"
+        with self.assertRaises(ValidationError):
+            backend.full_clean()
+
+
+class ResilientStorageTest(TestCase):
+    """
+    The tests for the retries, the hedged reads and the circuit breaker.
+    """
+
+    fixtures = ["backend.json"]
+
+    def test_retries_and_breaker(self):
+        """
+        Are failed reads repeated and does the breaker fail fast until the storage is
+        back ?
+        """
+        memory_provider = MemoryProvider()
+        storage_provider = ResilientProvider(
+            memory_provider,
+            retries=2,
+            backoff=0.001,
+            hedge_quantile=None,
+            failure_threshold=3,
+            reset_seconds=0.2,
+        )
+        storage_provider.upload("Hello world", "/test/world.txt")
+        with self.assertRaises(StorageNotFoundError):
+            storage_provider.get_file_content("/test/missing.txt")
+
+        labels = {"method": "get_file_content", "prefix": "other"}
+        retries = REGISTRY.counter_value("qlue_storage_retries_total", labels)
+        memory_provider.error_rate = {"*": 1.0}
+        with self.assertRaises(StorageUnavailable):
+            storage_provider.get_file_content("/test/world.txt")
+        self.assertEqual(
+            REGISTRY.counter_value("qlue_storage_retries_total", labels), retries + 2
+        )
+        self.assertEqual(storage_provider.breaker.state, "open")
+
+        memory_provider.error_rate = {}
+        with self.assertRaises(StorageUnavailable) as context:
+            storage_provider.upload("Hello again", "/test/again.txt")
+        self.assertLessEqual(context.exception.retry_after, 0.2)
+        self.assertEqual(memory_provider.get_file_queue("/test"), ["world.txt"])
+        time.sleep(0.2)
+        self.assertEqual(storage_provider.breaker.state, "half_open")
+        self.assertEqual(
+            asyncio.run(storage_provider.aget_file_content("/test/world.txt")),
+            "Hello world",
+        )
+        self.assertEqual(storage_provider.breaker.state, "closed")
+
+    def test_timeout_and_hedge(self):
+        """
+        Are slow calls given up after the timeout and slow reads sent twice ?
+        """
+        storage_provider = ResilientProvider(
+            MemoryProvider(latency={"get_file_content": 0.3}),
+            timeout={"get_file_content": 0.05, "*": 1.0},
+            retries=0,
+        )
+        storage_provider.upload("Hello world", "/test/world.txt")
+        start = time.perf_counter()
+        with self.assertRaises(StorageUnavailable):
+            storage_provider.get_file_content("/test/world.txt")
+        self.assertLess(time.perf_counter() - start, 0.3)
+
+        storage_provider = ResilientProvider(
+            MemoryProvider(latency={"get_file_content": 0.02}), retries=0
+        )
+        storage_provider.upload("Hello world", "/test/world.txt")
+        self.assertIsNone(storage_provider.hedge_delay("get_file_content"))
+        for _ in range(20):
+            storage_provider.get_file_content("/test/world.txt")
+        self.assertIsNotNone(storage_provider.hedge_delay("get_file_content"))
+        self.assertIsNone(storage_provider.hedge_delay("upload"))
+
+        labels = {"method": "get_file_content", "prefix": "other"}
+        hedges = REGISTRY.counter_value("qlue_storage_hedges_total", labels)
+        storage_provider.provider.latency = {"get_file_content": 0.1}
+        self.assertEqual(
+            storage_provider.get_file_content("/test/world.txt"), "Hello world"
+        )
+        self.assertEqual(
+            asyncio.run(storage_provider.aget_file_content("/test/world.txt")),
+            "Hello world",
+        )
+        self.assertEqual(
+            REGISTRY.counter_value("qlue_storage_hedges_total", labels), hedges + 2
+        )
+
+    def test_unavailable_response(self):
+        """
+        Do the views answer with 503 and Retry-After while the storage is down ?
+        """
+        username = config("USERNAME_TEST")
+        password = config("PASSWORD_TEST")
+        user = User.objects.create(username=username)
+        user.set_password(password)
+        user.save()
+        original_storage = ac.storage
+        ac.storage = ResilientProvider(
+            MemoryProvider(error_rate={"*": 1.0}),
+            retries=0,
+            failure_threshold=1,
+            reset_seconds=30.0,
+        )
+        try:
+            req = self.client.post(
+                "/api/v1/fermions/post_job",
+                {
+                    "json": json.dumps(sample_job("fermions")),
+                    "username": username,
+                    "password": password,
+                },
+            )
+            self.assertEqual(req.status_code, 503)
+            self.assertEqual(req.json()["status"], "ERROR")
+            req = self.client.get(
+                reverse("get_job_status", kwargs={"backend_name": "fermions"}),
+                {
+                    "json": json.dumps({"job_id": "20220101-fermions-user-1"}),
+                    "username": username,
+                    "password": password,
+                },
+            )
+            self.assertEqual(req.status_code, 503)
+            self.assertLessEqual(int(req["Retry-After"]), 30)
+        finally:
+            ac.storage = original_storage
+
+
 class DropboxProvideTest(TestCase):
     """
     The class that contains all the tests for the dropbox provider.
@@ -447,3 +2189,608 @@ class DropboxProvideTest(TestCase):
 
         # clean up our mess
         self.storage_provider.delete_file(f"/test_folder/copied_world-{file_id}.txt")
+
+
+class LocalFileProviderTest(TestCase):
+    """
+    The class that contains all the tests for the local file provider.
+    """
+
+    def setUp(self):
+        """
+        set up the test.
+        """
+        self.root_dir = tempfile.mkdtemp()
+        self.storage_provider = LocalFileProvider(self.root_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_upload_etc(self):
+        """
+        Test that it is possible to upload, move and delete a file.
+        """
+        self.storage_provider.upload("Hello world", "/test_folder/world.txt")
+        world_str = self.storage_provider.get_file_content("/test_folder/world.txt")
+        self.assertEqual("Hello world", world_str)
+
+        self.storage_provider.move_file(
+            "/test_folder/world.txt", "/other_folder/copied_world.txt"
+        )
+        self.assertEqual(self.storage_provider.get_file_queue("/test_folder/"), [])
+        self.assertEqual(
+            self.storage_provider.get_file_queue("/other_folder/"),
+            ["copied_world.txt"],
+        )
+        self.storage_provider.delete_file("/other_folder/copied_world.txt")
+        self.assertEqual(self.storage_provider.get_file_queue("/other_folder/"), [])
+        self.assertEqual(self.storage_provider.get_file_queue("/missing/"), [])
+
+    def test_async_upload_etc(self):
+        """
+        Test the asynchronous access to the files.
+        """
+
+        async def upload_and_read():
+            await asyncio.gather(
+                *(
+                    self.storage_provider.aupload(str(ii), f"/test/file-{ii}.txt")
+                    for ii in range(10)
+                )
+            )
+            await self.storage_provider.amove_file("/test/file-0.txt", "/moved.txt")
+            return (
+                await self.storage_provider.aget_file_queue("/test/"),
+                await self.storage_provider.aget_file_content("/moved.txt"),
+            )
+
+        file_list, content = asyncio.run(upload_and_read())
+        self.assertEqual(len(file_list), 9)
+        self.assertEqual(content, "0")
+
+
+class MemoryProviderTest(TestCase):
+    """
+    The class that contains all the tests for the storage in memory.
+    """
+
+    def test_upload_etc(self):
+        """
+        Test that it is possible to upload, move and delete a file.
+        """
+        storage_provider = MemoryProvider()
+        storage_provider.upload("Hello world", "/test_folder/world.txt")
+        storage_provider.upload_bytes(b"\x00", "/test_folder/bytes.bin")
+        self.assertEqual(
+            storage_provider.get_file_queue("/test_folder/"),
+            ["bytes.bin", "world.txt"],
+        )
+        storage_provider.move_file(
+            "/test_folder/world.txt", "/other_folder/copied_world.txt"
+        )
+        self.assertEqual(
+            storage_provider.get_file_content("/other_folder/copied_world.txt"),
+            "Hello world",
+        )
+        self.assertEqual(
+            storage_provider.get_file_bytes("/test_folder/bytes.bin"), b"\x00"
+        )
+        storage_provider.delete_files(
+            ["/test_folder/bytes.bin", "/other_folder/copied_world.txt"]
+        )
+        self.assertEqual(storage_provider.get_file_queue("/test_folder/"), [])
+        with self.assertRaises(FileNotFoundError):
+            storage_provider.get_file_content("/test_folder/world.txt")
+
+    def test_injected_latency_and_failures(self):
+        """
+        Test that the operations wait and fail as they are told to.
+        """
+        storage_provider = MemoryProvider(
+            latency={"upload": 0.05, "*": parse_latency("uniform:0:0.001")},
+            error_rate={"delete_file": 1.0},
+            seed=1,
+        )
+        start = time.perf_counter()
+        storage_provider.upload("Hello world", "/test/world.txt")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        with self.assertRaises(ConnectionError):
+            storage_provider.delete_file("/test/world.txt")
+        with self.assertRaises(ConnectionError):
+            asyncio.run(storage_provider.adelete_file("/test/world.txt"))
+        self.assertEqual(storage_provider.get_file_queue("/test"), ["world.txt"])
+
+        self.assertEqual(parse_latency("0.2"), 0.2)
+        with self.assertRaises(ValueError):
+            parse_latency("gauss:1")
+
+    def test_shared_store(self):
+        """
+        Test that two providers see the same files through the manager.
+        """
+        with MemoryStoreManager(address=("127.0.0.1", 0), authkey=b"qlue") as manager:
+            writer = MemoryProvider(address=manager.address, authkey=b"qlue")
+            reader = MemoryProvider(address=manager.address, authkey=b"qlue")
+            writer.upload("Hello world", "/test/world.txt")
+            self.assertEqual(reader.get_file_content("/test/world.txt"), "Hello world")
+            with self.assertRaises(FileNotFoundError):
+                reader.get_file_content("/test/missing.txt")
+
+
+class EncodingsTest(TestCase):
+    """
+    The class that contains the tests for the encodings of jobs and results.
+    """
+
+    def test_pack_result(self):
+        """
+        Is the packed shot memory restored exactly ?
+        """
+        result_dict = {
+            "job_id": "abc",
+            "results": [
+                {"data": {"memory": ["0 3 1", "2 0 0"]}, "shots": 2},
+                {"data": {"memory": ["0110", "1001"]}, "shots": 2},
+                {"data": {"memory": ["0x3", "0x1"]}, "shots": 2},
+            ],
+        }
+        packed_result = pack_result(result_dict)
+        self.assertTrue(is_packed(packed_result["results"][0]))
+        self.assertTrue(is_packed(packed_result["results"][1]))
+        self.assertEqual(packed_result["results"][2], result_dict["results"][2])
+        self.assertEqual(unpack_result(packed_result), result_dict)
+
+    def test_negotiate_media_type(self):
+        """
+        Is the media type of the response chosen from the Accept header ?
+        """
+        self.assertEqual(negotiate_media_type(None), "application/json")
+        self.assertEqual(
+            negotiate_media_type("text/html, */*;q=0.1"), "application/json"
+        )
+        self.assertIsNone(negotiate_media_type("text/html"))
+        if MSGPACK_MEDIA_TYPE in CODECS:
+            self.assertEqual(
+                negotiate_media_type("application/json;q=0.5, application/msgpack"),
+                MSGPACK_MEDIA_TYPE,
+            )
+
+
+class ResultShapingTest(TestCase):
+    """
+    The class that contains the tests for the counts and the selection of experiments.
+    """
+
+    def test_count_memory(self):
+        """
+        Are the outcomes counted in the format of the memory, packed or not ?
+        """
+        memory = ["0 1 2", "0 1 2", "1 0 0"]
+        self.assertEqual(count_memory(memory), {"0 1 2": 2, "1 0 0": 1})
+        packed = pack_result({"results": [{"data": {"memory": memory}}]})
+        self.assertEqual(
+            count_memory(packed["results"][0]["data"]["memory"]),
+            {"0 1 2": 2, "1 0 0": 1},
+        )
+        self.assertEqual(count_memory(["0x1", "0x1", "0x3"]), {"0x1": 2, "0x3": 1})
+
+    def test_select_experiments(self):
+        """
+        Can experiments be selected by index and by name ?
+        """
+        result_dict = {
+            "results": [
+                {"header": {"name": "experiment_" + str(ii)}} for ii in range(4)
+            ]
+        }
+        selected = select_experiments(result_dict, "3,experiment_1")
+        self.assertEqual(
+            [exp["header"]["name"] for exp in selected["results"]],
+            ["experiment_3", "experiment_1"],
+        )
+        self.assertEqual(select_experiments(result_dict, None), result_dict)
+        with self.assertRaises(ValueError):
+            select_experiments(result_dict, "4")
+
+
+class AsyncJobApiTest(TestCase):
+    """
+    The class that contains the tests for the asynchronous job endpoints of the api v1.
+    They run against the local file provider.
+    """
+
+    fixtures = ["backend.json"]
+
+    def setUp(self):
+        self.username = config("USERNAME_TEST")
+        self.password = config("PASSWORD_TEST")
+        user = User.objects.create(username=self.username)
+        user.set_password(self.password)
+        user.save()
+        self.root_dir = tempfile.mkdtemp()
+        self.original_storage = ac.storage
+        ac.storage = LocalFileProvider(self.root_dir)
+
+    def tearDown(self):
+        ac.storage = self.original_storage
+        shutil.rmtree(self.root_dir)
+
+    def test_job_lifecycle(self):
+        """
+        Can we submit a job and follow it until its result through the api v1 ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [7], []), ("measure", [7], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        req = self.client.post(
+            "/api/v1/fermions/post_job",
+            {
+                "json": json.dumps(job_payload),
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 200)
+        job_id = json.loads(req.content)["job_id"]
+        self.assertEqual(
+            ac.storage.get_file_queue("/Backend_files/Queued_Jobs/fermions/"),
+            ["job-" + job_id + ".json"],
+        )
+
+        credentials = {"username": self.username, "password": self.password}
+        req = self.client.get(
+            "/api/v1/fermions/get_job_status", {"job_id": job_id, **credentials}
+        )
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(json.loads(req.content)["status"], "INITIALIZING")
+
+        # let us pretend that the spooler did its job
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "status": "DONE"}),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json",
+        )
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "results": []}),
+            "/Backend_files/Result/fermions/"
+            + self.username
+            + "/result-"
+            + job_id
+            + ".json",
+        )
+        ac.storage.move_file(
+            "/Backend_files/Queued_Jobs/fermions/job-" + job_id + ".json",
+            "/Backend_files/Finished_Jobs/fermions/"
+            + self.username
+            + "/job-"
+            + job_id
+            + ".json",
+        )
+        req = self.client.get(
+            "/api/v1/fermions/get_job_result", {"job_id": job_id, **credentials}
+        )
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(json.loads(req.content)["results"], [])
+
+        req = self.client.get("/api/v1/fermions/get_user_jobs", credentials)
+        self.assertEqual(json.loads(req.content)["job_ids"], [job_id])
+
+    def test_idempotent_post_job(self):
+        """
+        Does a retry with the same Idempotency-Key return the original job ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [7], []), ("measure", [7], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        form = {
+            "json": json.dumps(job_payload),
+            "username": self.username,
+            "password": self.password,
+        }
+        first_req = self.client.post(
+            "/api/v1/fermions/post_job", form, HTTP_IDEMPOTENCY_KEY="sweep-1"
+        )
+        retry_req = self.client.post(
+            "/api/v1/fermions/post_job", form, HTTP_IDEMPOTENCY_KEY="sweep-1"
+        )
+        self.assertEqual(retry_req.status_code, 200)
+        self.assertEqual(retry_req["Idempotent-Replayed"], "true")
+        self.assertEqual(
+            json.loads(first_req.content)["job_id"],
+            json.loads(retry_req.content)["job_id"],
+        )
+        other_req = self.client.post(
+            "/api/v1/fermions/post_job", form, HTTP_IDEMPOTENCY_KEY="sweep-2"
+        )
+        self.assertNotEqual(
+            json.loads(first_req.content)["job_id"],
+            json.loads(other_req.content)["job_id"],
+        )
+        self.assertEqual(
+            len(ac.storage.get_file_queue("/Backend_files/Queued_Jobs/fermions/")), 2
+        )
+        # a different request must not get the job of the key
+        changed_req = self.client.post(
+            "/api/v1/fermions/post_job",
+            dict(form, json=json.dumps({"experiment_1": job_payload["experiment_0"]})),
+            HTTP_IDEMPOTENCY_KEY="sweep-1",
+        )
+        self.assertEqual(changed_req.status_code, 422)
+        changed_req = self.client.post(
+            "/api/v1/singlequdit/post_job", form, HTTP_IDEMPOTENCY_KEY="sweep-1"
+        )
+        self.assertEqual(changed_req.status_code, 422)
+
+        # a submission that is still running blocks the key, a failed one frees it
+        fingerprint = request_fingerprint("fermions", form["json"])
+        self.assertIsNone(claim_idempotency_key(self.username, "sweep-3", fingerprint))
+        self.assertEqual(
+            claim_idempotency_key(self.username, "sweep-3", fingerprint).status_code,
+            409,
+        )
+        settle_idempotency_key(self.username, "sweep-3", None)
+        self.assertIsNone(claim_idempotency_key(self.username, "sweep-3", fingerprint))
+
+        # the answer expires, such that the key can be used again
+        IdempotencyKey.objects.filter(key="sweep-1").update(
+            created=timezone.now() - IDEMPOTENCY_TTL * 2
+        )
+        self.assertIsNone(claim_idempotency_key(self.username, "sweep-1", fingerprint))
+        IdempotencyKey.objects.filter(key="sweep-2").update(
+            created=timezone.now() - IDEMPOTENCY_TTL * 2
+        )
+        self.assertEqual(purge_idempotency_keys(), 1)
+        self.assertFalse(IdempotencyKey.objects.filter(key="sweep-2").exists())
+
+    def test_post_jobs(self):
+        """
+        Can we submit many jobs at once without an invalid one failing the others ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [("load", [7], []), ("measure", [7], [])],
+                "num_wires": 8,
+                "shots": 4,
+            },
+        }
+        invalid_payload = {
+            "experiment_0": {"instructions": [("load", [9], [])], "shots": 4}
+        }
+        job_list = [job_payload] * 200 + [invalid_payload]
+        req = self.client.post(
+            "/api/v1/fermions/post_jobs",
+            {
+                "json": json.dumps(job_list),
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 200)
+        data = json.loads(req.content)
+        self.assertEqual(len(set(data["job_ids"])), 200)
+        self.assertEqual(data["jobs"][-1]["status"], "ERROR")
+        self.assertIn("experiment_0/instructions/0", data["jobs"][-1]["detail"])
+        self.assertEqual(
+            len(ac.storage.get_file_queue("/Backend_files/Queued_Jobs/fermions/")),
+            200,
+        )
+        self.assertEqual(
+            get_queue_stats(Backend.objects.get(name="fermions")).queued, 200
+        )
+
+        req = self.client.post(
+            "/api/v1/fermions/post_jobs",
+            {"json": "{}", "username": self.username, "password": self.password},
+        )
+        self.assertEqual(req.status_code, 406)
+
+    @unittest.skipIf(MSGPACK_MEDIA_TYPE not in CODECS, "msgpack is not installed")
+    def test_msgpack_job_and_result(self):
+        """
+        Can we submit a job and get its result as MessagePack ?
+        """
+        job_payload = {
+            "experiment_0": {
+                "instructions": [["load", [7], []], ["measure", [7], []]],
+                "num_wires": 8,
+                "shots": 3,
+            },
+        }
+        job_file = SimpleUploadedFile(
+            "job.msgpack",
+            CODECS[MSGPACK_MEDIA_TYPE][0](job_payload),
+            content_type=MSGPACK_MEDIA_TYPE,
+        )
+        req = self.client.post(
+            "/api/v1/fermions/post_job",
+            {
+                "job_file": job_file,
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 200)
+        job_id = json.loads(req.content)["job_id"]
+        self.assertEqual(
+            json.loads(
+                ac.storage.get_file_content(
+                    "/Backend_files/Queued_Jobs/fermions/job-" + job_id + ".json"
+                )
+            ),
+            job_payload,
+        )
+
+        memory = ["0 0 1 0 0 0 0 1", "0 0 0 0 0 0 0 1", "0 0 1 0 0 0 0 1"]
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "status": "DONE"}),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json",
+        )
+        ac.storage.upload(
+            json.dumps(pack_result({"results": [{"data": {"memory": memory}}]})),
+            "/Backend_files/Result/fermions/"
+            + self.username
+            + "/result-"
+            + job_id
+            + ".json",
+        )
+        req = self.client.get(
+            "/api/v1/fermions/get_job_result",
+            {"job_id": job_id, "username": self.username, "password": self.password},
+            HTTP_ACCEPT="application/msgpack, application/json;q=0.5",
+        )
+        self.assertEqual(req["Content-Type"], MSGPACK_MEDIA_TYPE)
+        result_dict = CODECS[MSGPACK_MEDIA_TYPE][1](req.content)
+        self.assertEqual(result_dict["results"][0]["data"]["memory"], memory)
+
+    def test_result_counts(self):
+        """
+        Can we get the counts of a single experiment, also once they are cached ?
+        """
+        clear_counts_cache()
+        job_id = "20220101_000000-fermions-" + self.username + "-abcde"
+        ac.storage.upload(
+            json.dumps({"job_id": job_id, "status": "DONE"}),
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json",
+        )
+        result_path = (
+            "/Backend_files/Result/fermions/"
+            + self.username
+            + "/result-"
+            + job_id
+            + ".json"
+        )
+        ac.storage.upload(
+            json.dumps(
+                {
+                    "job_id": job_id,
+                    "results": [
+                        {
+                            "header": {"name": "experiment_" + str(ii)},
+                            "data": {"memory": ["0 1"] * ii + ["1 1"]},
+                        }
+                        for ii in range(5)
+                    ],
+                }
+            ),
+            result_path,
+        )
+        query = {
+            "job_id": job_id,
+            "username": self.username,
+            "password": self.password,
+            "experiments": "3",
+            "counts": True,
+        }
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(req.status_code, 200)
+        results = json.loads(req.content)["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["data"], {"counts": {"0 1": 3, "1 1": 1}})
+
+        query["experiments"] = "experiment_2"
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(
+            json.loads(req.content)["results"][0]["data"]["counts"],
+            {"0 1": 2, "1 1": 1},
+        )
+
+        # the counts come from the cache now
+        ac.storage.delete_file(result_path)
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(req.status_code, 200)
+        query["experiments"] = "7"
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(req.status_code, 406)
+        clear_counts_cache()
+
+    def test_chunked_result(self):
+        """
+        Can we read the experiments of a chunked result while the job is running ?
+        """
+        job_id = "20220101_000000-fermions-" + self.username + "-abcde"
+        status_path = (
+            "/Backend_files/Status/fermions/"
+            + self.username
+            + "/status-"
+            + job_id
+            + ".json"
+        )
+        ac.storage.upload(
+            json.dumps(
+                {"job_id": job_id, "status": "RUNNING", "result_layout": "chunked"}
+            ),
+            status_path,
+        )
+        manifest = {"result": {"job_id": job_id, "success": True}}
+        for index in range(3):
+            manifest = write_result_chunk(
+                ac.storage,
+                "fermions",
+                job_id,
+                manifest,
+                {"header": {"name": "exp_" + str(index)}, "data": {"memory": ["0 1"]}},
+            )
+        query = {"job_id": job_id, "username": self.username, "password": self.password}
+        req = self.client.get("/api/v1/fermions/get_job_result", query)
+        self.assertEqual(json.loads(req.content)["status"], "RUNNING")
+
+        req = self.client.get(
+            "/api/v1/fermions/get_job_result", {"partial": True, **query}
+        )
+        result_dict = json.loads(req.content)
+        self.assertTrue(result_dict["partial"])
+        self.assertEqual(len(result_dict["results"]), 3)
+
+        # a targeted fetch only reads the chunks that it needs
+        ac.storage.delete_file(chunk_path("fermions", job_id, 0))
+        req = self.client.get(
+            "/api/v1/fermions/get_job_result",
+            {"partial": True, "experiments": "exp_2", **query},
+        )
+        self.assertEqual(
+            json.loads(req.content)["results"][0]["header"]["name"], "exp_2"
+        )
+        req = self.client.get(
+            "/api/v1/fermions/get_job_result",
+            {"partial": True, "experiments": "exp_3", **query},
+        )
+        self.assertEqual(req.status_code, 406)
+
+    def test_bad_requests(self):
+        """
+        Are wrong credentials and unknown jobs rejected ?
+        """
+        req = self.client.get(
+            "/api/v1/fermions/get_job_status",
+            {"job_id": "abc", "username": self.username, "password": "wrong"},
+        )
+        self.assertEqual(req.status_code, 401)
+        req = self.client.get(
+            "/api/v1/fermions/get_job_status",
+            {
+                "job_id": "20220101_000000-fermions-" + self.username + "-abcde",
+                "username": self.username,
+                "password": self.password,
+            },
+        )
+        self.assertEqual(req.status_code, 406)
+        self.assertEqual(json.loads(req.content)["status"], "ERROR")
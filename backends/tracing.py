@@ -0,0 +1,572 @@
+"""
+The module that traces jobs from their submission until the spooler finished them. A
+trace is a tree of spans, each of which is a timed step with a name and attributes:
+
+    the request spans of the `tracing_middleware`, one for every view
+    the `storage.<method>` spans of the `InstrumentedProvider`, one for every call to
+        the storage
+    the `job.queued` and `job.running` spans, one for every state of a job that is
+        tracked by the queue
+    the spans that the spooler reports through `post_spans` while it works on a job
+
+The trace of a job starts with the request that submitted it. Its trace id is part of
+the status of the job and the queue keeps the `traceparent` of the submission, such that
+the later spans of the job join the same trace. The ids follow the W3C trace context and
+requests that come with a `traceparent` header continue the trace of the caller.
+
+The finished spans are written in batches by a background thread in the JSON encoding of
+OTLP, one `resourceSpans` document per line to the file `TRACING_FILE` and/or to the
+OTLP/HTTP endpoint `TRACING_OTLP_ENDPOINT` of a collector. Tracing is off if neither is
+set and then it costs a single check of the settings per span.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+# the kinds of the spans in OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+# the status codes of the spans in OTLP
+STATUS_OK = 1
+STATUS_ERROR = 2
+# the time in seconds between two exports
+EXPORT_INTERVAL = 1.0
+# the number of spans that wait for the export, further spans are dropped
+MAX_QUEUED_SPANS = 10000
+# the number of spans that the spooler may report at once
+MAX_REPORTED_SPANS = 1000
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# the span in which the current code runs, None outside of traces
+_CURRENT_SPAN: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "qlue_current_span", default=None
+)
+
+
+def enabled() -> bool:
+    """
+    Is tracing switched on ?
+    """
+    return bool(
+        getattr(settings, "TRACING_FILE", "")
+        or getattr(settings, "TRACING_OTLP_ENDPOINT", "")
+    )
+
+
+def new_trace_id() -> str:
+    """
+    A random trace id of 32 hex digits.
+    """
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    """
+    A random span id of 16 hex digits.
+    """
+    return secrets.token_hex(8)
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    """
+    The `traceparent` of a sampled span.
+    """
+    return "00-" + trace_id + "-" + span_id + "-01"
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    The trace id and the span id of a `traceparent`.
+
+    Args:
+        traceparent: The value of the header
+
+    Returns:
+        Both ids or None if the value is missing or malformed
+    """
+    if not traceparent:
+        return None
+    match = _TRACEPARENT_RE.match(traceparent.strip().lower())
+    if match is None or not int(match.group(1), 16) or not int(match.group(2), 16):
+        return None
+    return match.group(1), match.group(2)
+
+
+class Span:
+    """
+    A timed step within a trace.
+
+    Args:
+        name: The name of the step
+        trace_id: The id of the trace
+        parent_id: The id of the parent span, empty for the root of the trace
+        kind: The kind of the span in OTLP
+        attributes: The attributes of the span
+        start: The start as unix timestamp, now if it is not given
+        span_id: The id of the span, a new one if it is not given
+    """
+
+    # pylint: disable=R0902, R0913
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str = "",
+        kind: int = SPAN_KIND_INTERNAL,
+        *,
+        attributes: Optional[Dict[str, Any]] = None,
+        start: Optional[float] = None,
+        span_id: Optional[str] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id or new_span_id()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = time.time() if start is None else start
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        """
+        The `traceparent` under which children of the span are created.
+        """
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def finish(self, end: Optional[float] = None, error: Optional[str] = None) -> None:
+        """
+        End the span and hand it to the exporter.
+        """
+        self.end = time.time() if end is None else end
+        if error is not None:
+            self.error = error
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self.to_otlp())
+
+    def to_otlp(self) -> dict:
+        """
+        The span in the JSON encoding of OTLP.
+        """
+        span_dict = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int((self.end or self.start) * 1e9)),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": STATUS_OK}
+            if self.error is None
+            else {"code": STATUS_ERROR, "message": self.error},
+        }
+        if self.parent_id:
+            span_dict["parentSpanId"] = self.parent_id
+        return span_dict
+
+
+def _otlp_value(value: Any) -> dict:
+    """
+    An attribute value in the JSON encoding of OTLP.
+    """
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def current_span() -> Optional[Span]:
+    """
+    The span in which the current code runs.
+    """
+    return _CURRENT_SPAN.get()
+
+
+def current_traceparent() -> str:
+    """
+    The `traceparent` of the current span, empty outside of traces.
+    """
+    span_now = _CURRENT_SPAN.get()
+    return "" if span_now is None else span_now.traceparent
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    The id of the current trace, None outside of traces.
+    """
+    span_now = _CURRENT_SPAN.get()
+    return None if span_now is None else span_now.trace_id
+
+
+@contextmanager
+def span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: int = SPAN_KIND_INTERNAL,
+    traceparent: Optional[str] = None,
+) -> Iterator[Optional[Span]]:
+    """
+    Trace the block as span. It is the child of the current span or of the given
+    `traceparent` and it starts a new trace if there is neither. Exceptions mark the
+    span as failed. Nothing happens if tracing is off.
+
+    Args:
+        name: The name of the span
+        attributes: The attributes of the span
+        kind: The kind of the span in OTLP
+        traceparent: The parent of the span from outside of the process
+
+    Yields:
+        The span, which can still be renamed and annotated, or None if tracing is off
+    """
+    if not enabled():
+        yield None
+        return
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        span_now = _CURRENT_SPAN.get()
+        if span_now is not None:
+            parent = (span_now.trace_id, span_now.span_id)
+    trace_id, parent_id = parent if parent is not None else (new_trace_id(), "")
+    new_span = Span(name, trace_id, parent_id, kind, attributes=attributes)
+    token = _CURRENT_SPAN.set(new_span)
+    try:
+        yield new_span
+    except BaseException as err:
+        new_span.error = type(err).__name__
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        new_span.finish()
+
+
+def record_span(
+    name: str,
+    traceparent: str,
+    start: float,
+    end: float,
+    attributes: Optional[Dict[str, Any]] = None,
+    *,
+    span_id: Optional[str] = None,
+) -> None:
+    """
+    Export a span whose times are known after the fact, like the time that a job
+    spent in the queue. Nothing happens if tracing is off or the parent is malformed.
+
+    Args:
+        name: The name of the span
+        traceparent: The parent of the span
+        start: The start as unix timestamp
+        end: The end as unix timestamp
+        attributes: The attributes of the span
+        span_id: The id of the span if it was handed out before
+    """
+    # pylint: disable=R0913
+    parent = parse_traceparent(traceparent)
+    if parent is None or not enabled():
+        return
+    Span(
+        name, parent[0], parent[1], attributes=attributes, start=start, span_id=span_id
+    ).finish(end)
+
+
+def import_spans(span_list: Any) -> int:
+    """
+    Export the spans that the spooler reports. Each span is a dict with
+
+        name: The name of the span
+        traceparent: The parent of the span, e.g. the one that came with the job
+        start_time: The start as unix timestamp
+        end_time: The end as unix timestamp
+        span_id: The id of the span if the spooler created children of it (optional)
+        attributes: A flat dict of strings, numbers and booleans (optional)
+        error: The description of the failure if the step failed (optional)
+
+    Args:
+        span_list: The decoded json of the report
+
+    Returns:
+        The number of exported spans
+
+    Raises:
+        ValueError: If the report is malformed, then no span is exported
+    """
+    if not isinstance(span_list, list):
+        raise ValueError("The spans have to be a list!")
+    if len(span_list) > MAX_REPORTED_SPANS:
+        raise ValueError(f"At most {MAX_REPORTED_SPANS} spans can be sent at once!")
+    spans = []
+    for span_dict in span_list:
+        if not isinstance(span_dict, dict):
+            raise ValueError("Every span has to be a dict!")
+        parent = parse_traceparent(span_dict.get("traceparent"))
+        if parent is None:
+            raise ValueError("Every span needs a valid traceparent!")
+        span_id = span_dict.get("span_id") or new_span_id()
+        attributes = span_dict.get("attributes") or {}
+        try:
+            start = float(span_dict["start_time"])
+            end = float(span_dict["end_time"])
+        except (KeyError, TypeError, ValueError) as err:
+            raise ValueError("Every span needs a start_time and an end_time!") from err
+        if (
+            not isinstance(span_dict.get("name"), str)
+            or not re.fullmatch("[0-9a-f]{16}", str(span_id))
+            or not isinstance(attributes, dict)
+            or end < start
+        ):
+            raise ValueError("The span " + str(span_dict.get("name")) + " is invalid!")
+        reported = Span(
+            span_dict["name"],
+            parent[0],
+            parent[1],
+            attributes=dict(attributes, **{"qlue.source": "spooler"}),
+            start=start,
+            span_id=span_id,
+        )
+        reported.end = end
+        if span_dict.get("error"):
+            reported.error = str(span_dict["error"])
+        spans.append(reported)
+    for reported in spans:
+        reported.finish(reported.end)
+    return len(spans)
+
+
+class SpanExporter:
+    """
+    The exporter that collects finished spans and writes them in batches from a
+    background thread.
+
+    Args:
+        file_path: The file to which the spans are appended, none if empty
+        endpoint: The url of the OTLP/HTTP endpoint, none if empty
+        interval: The time in seconds between two exports
+    """
+
+    def __init__(
+        self, file_path: str = "", endpoint: str = "", interval=EXPORT_INTERVAL
+    ):
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.interval = interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(MAX_QUEUED_SPANS)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, span_dict: dict) -> None:
+        """
+        Queue a finished span for the next export. The span is dropped if the queue is
+        full, such that a slow collector never blocks the requests.
+        """
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="qlue-tracing", daemon=True
+                    )
+                    self._thread.start()
+                    atexit.register(self.flush)
+        try:
+            self._queue.put_nowait(span_dict)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """
+        Write all queued spans now.
+        """
+        with self._lock:
+            spans = []
+            while True:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if spans:
+                self._write(spans)
+
+    def _run(self) -> None:
+        """
+        Export the spans until the process ends.
+        """
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def _write(self, spans: List[dict]) -> None:
+        """
+        Send a batch of spans to the file and to the collector.
+        """
+        document = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": [
+                                {
+                                    "key": "service.name",
+                                    "value": {"stringValue": "qlue"},
+                                }
+                            ]
+                        },
+                        "scopeSpans": [
+                            {"scope": {"name": "backends.tracing"}, "spans": spans}
+                        ],
+                    }
+                ]
+            }
+        )
+        try:
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(document + "\n")
+            if self.endpoint:
+                request = urllib.request.Request(
+                    self.endpoint,
+                    data=document.encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                )
+                with urllib.request.urlopen(request, timeout=5):
+                    pass
+        except OSError as err:
+            logger.warning("Could not export %s spans: %s", len(spans), err)
+
+
+_EXPORTERS: Dict[Tuple[str, str], SpanExporter] = {}
+_EXPORTERS_LOCK = threading.Lock()
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    """
+    The exporter for the current settings, None if tracing is off.
+    """
+    key = (
+        getattr(settings, "TRACING_FILE", ""),
+        getattr(settings, "TRACING_OTLP_ENDPOINT", ""),
+    )
+    if not any(key):
+        return None
+    if key not in _EXPORTERS:
+        with _EXPORTERS_LOCK:
+            if key not in _EXPORTERS:
+                _EXPORTERS[key] = SpanExporter(*key)
+    return _EXPORTERS[key]
+
+
+def flush() -> None:
+    """
+    Write the queued spans of all exporters now, e.g. before the process ends.
+    """
+    for exporter in list(_EXPORTERS.values()):
+        exporter.flush()
+
+
+def read_spans(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    The spans of a file that the exporter wrote.
+
+    Args:
+        lines: The lines of the file
+
+    Yields:
+        The spans in the JSON encoding of OTLP
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        for resource_spans in json.loads(line).get("resourceSpans", []):
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                yield from scope_spans.get("spans", [])
+
+
+def _seconds(span_dict: dict) -> float:
+    """
+    The duration of a span in the JSON encoding of OTLP in seconds.
+    """
+    return (
+        int(span_dict["endTimeUnixNano"]) - int(span_dict["startTimeUnixNano"])
+    ) / 1e9
+
+
+def job_latency_breakdown(spans: Iterable[dict]) -> List[dict]:
+    """
+    Split the latency of the traced jobs into their parts. For every trace with jobs
+    it gives
+
+        job_ids: The jobs of the trace, more than one for batch submissions
+        submission: The duration of the request that submitted the jobs
+        queue_wait: The longest time that a job spent in the queue
+        execution: The longest time that the spooler worked on a job
+        transfer: The time of all calls to the storage within the trace, including
+            the `storage.*` spans that the spooler reported
+
+    Args:
+        spans: The spans in the JSON encoding of OTLP
+
+    Returns:
+        The parts in seconds per trace, ordered by the start of the trace
+    """
+    traces: Dict[str, dict] = {}
+    for span_dict in spans:
+        trace = traces.setdefault(
+            span_dict["traceId"],
+            {
+                "trace_id": span_dict["traceId"],
+                "job_ids": [],
+                "submission": 0.0,
+                "queue_wait": 0.0,
+                "execution": 0.0,
+                "transfer": 0.0,
+                "start": int(span_dict["startTimeUnixNano"]),
+            },
+        )
+        trace["start"] = min(trace["start"], int(span_dict["startTimeUnixNano"]))
+        attributes = {
+            attribute["key"]: next(iter(attribute["value"].values()))
+            for attribute in span_dict.get("attributes", [])
+        }
+        seconds = _seconds(span_dict)
+        if span_dict["name"] in ("job.queued", "job.running"):
+            part = "queue_wait" if span_dict["name"] == "job.queued" else "execution"
+            trace[part] = max(trace[part], seconds)
+            job_id = attributes.get("qlue.job_id")
+            if job_id and job_id not in trace["job_ids"]:
+                trace["job_ids"].append(job_id)
+        elif span_dict["name"].startswith("storage."):
+            trace["transfer"] += seconds
+        elif span_dict["kind"] == SPAN_KIND_SERVER and "post_job" in span_dict["name"]:
+            trace["submission"] = max(trace["submission"], seconds)
+    breakdown = sorted(
+        (trace for trace in traces.values() if trace["job_ids"]),
+        key=lambda trace: trace["start"],
+    )
+    for trace in breakdown:
+        del trace["start"]
+    return breakdown
@@ -26,8 +26,15 @@ urlpatterns = [
         views.get_next_job_in_queue,
         name="get_next_job_in_queue",
     ),
+    path("<str:backend_name>/post_spans/", views.post_spans, name="post_spans"),
     path(
         "<str:backend_name>/get_user_jobs/", views.get_user_jobs, name="get_user_jobs"
     ),
+    path("metrics/", views.metrics, name="metrics"),
+    path(
+        "metrics/slow_storage_calls/",
+        views.slow_storage_calls,
+        name="slow_storage_calls",
+    ),
     path("v1/", api.urls),
 ]
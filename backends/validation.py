@@ -0,0 +1,210 @@
+"""
+The module that checks submitted jobs against the capabilities of the backend, such that
+jobs which the spooler cannot run are rejected right away instead of after their time
+in the queue.
+
+The checks are expressed as json schemas, which are built from the `Backend` and
+compiled once. The compiled validators are cached until one of the fields of the
+backend that enter the schema changes.
+"""
+import json
+from typing import Dict, Optional, Tuple
+
+from jsonschema import Draft7Validator, ValidationError
+from jsonschema.validators import extend
+
+from .models import Backend
+
+
+def _coupling_map(validator, coupling_map, instance, schema):
+    """
+    Check that a gate only acts on the wires of one of the entries of its coupling map.
+    """
+    # pylint: disable=W0613
+    if not isinstance(instance, list) or len(instance) < 2:
+        return
+    allowed_wires = coupling_map.get(instance[0])
+    if allowed_wires is None or not isinstance(instance[1], list):
+        return
+    if tuple(instance[1]) not in allowed_wires:
+        yield ValidationError(
+            f"{instance[0]} cannot act on the wires {instance[1]}. The coupling map "
+            f"allows {sorted(list(wires) for wires in allowed_wires)}."
+        )
+
+
+JobValidator = extend(Draft7Validator, {"couplingMap": _coupling_map})
+
+# the compiled validators, keyed by the primary key of the backend
+_VALIDATORS: Dict[int, Tuple[str, JobValidator, JobValidator]] = {}
+
+
+def backend_fingerprint(backend: Backend) -> str:
+    """
+    Summarize all the fields of the backend that enter the validation.
+
+    Args:
+        backend: The backend
+
+    Returns:
+        A string that changes whenever the validation of the backend changes
+    """
+    return json.dumps(
+        [
+            backend.max_experiments,
+            backend.max_shots,
+            backend.num_wires,
+            backend.gates,
+            backend.supported_instructions,
+        ],
+        sort_keys=True,
+    )
+
+
+def build_schemas(backend: Backend) -> Tuple[dict, dict]:
+    """
+    Build the json schemas for the experiments and for the instructions of a backend.
+
+    Args:
+        backend: The backend
+
+    Returns:
+        The schema of an experiment without its instructions and the schema of a
+        single instruction
+    """
+    experiment_schema = {
+        "type": "object",
+        "required": ["instructions", "shots"],
+        "properties": {
+            "instructions": {"type": "array"},
+            "shots": {"type": "integer", "minimum": 0, "maximum": backend.max_shots},
+            "num_wires": {
+                "type": "integer",
+                "minimum": 1,
+                "maximum": backend.num_wires,
+            },
+            "wire_order": {"enum": ["interleaved", "sequential"]},
+        },
+    }
+    coupling_map = {}
+    for gate in backend.gates or []:
+        if "coupling_map" in gate:
+            coupling_map[gate["name"]] = {
+                tuple(wires) for wires in gate["coupling_map"]
+            }
+    instruction_schema = {
+        "type": "array",
+        "minItems": 3,
+        "maxItems": 3,
+        "items": [
+            {"enum": backend.supported_instructions or []},
+            {
+                "type": "array",
+                "items": {
+                    "type": "integer",
+                    "minimum": 0,
+                    "maximum": backend.num_wires - 1,
+                },
+            },
+            {"type": "array"},
+        ],
+        "couplingMap": coupling_map,
+    }
+    return experiment_schema, instruction_schema
+
+
+def get_validators(backend: Backend) -> Tuple[JobValidator, JobValidator]:
+    """
+    Get the compiled validators of a backend.
+
+    Args:
+        backend: The backend
+
+    Returns:
+        The validator of an experiment without its instructions and the validator of a
+        single instruction
+    """
+    fingerprint = backend_fingerprint(backend)
+    cached = _VALIDATORS.get(backend.pk)
+    if cached is None or cached[0] != fingerprint:
+        experiment_schema, instruction_schema = build_schemas(backend)
+        cached = (
+            fingerprint,
+            JobValidator(experiment_schema),
+            JobValidator(instruction_schema),
+        )
+        _VALIDATORS[backend.pk] = cached
+    return cached[1], cached[2]
+
+
+def validate_job(backend: Backend, job_dict) -> Optional[str]:
+    """
+    Check that a job can run on the backend.
+
+    Parameter sweeps repeat the same experiment settings and the same instructions
+    over and over again. Therefore, every distinct experiment setting and every
+    distinct instruction is only validated once per job.
+
+    Args:
+        backend: The backend to which the job was submitted
+        job_dict: The job
+
+    Returns:
+        None if the job is valid and a description of the first problem otherwise
+    """
+    # pylint: disable=R0912
+    if not isinstance(job_dict, dict):
+        return "The job has to be a dictionary of experiments."
+    if len(job_dict) > backend.max_experiments:
+        return (
+            f"The job has {len(job_dict)} experiments, but the backend only allows "
+            f"{backend.max_experiments}."
+        )
+    experiment_validator, instruction_validator = get_validators(backend)
+    valid_settings = set()
+    valid_instructions = set()
+    for exp_name, exp_dict in job_dict.items():
+        settings = None
+        if isinstance(exp_dict, dict) and isinstance(
+            exp_dict.get("instructions"), list
+        ):
+            try:
+                settings = frozenset(
+                    item for item in exp_dict.items() if item[0] != "instructions"
+                )
+            except TypeError:
+                # settings that are not hashable are validated every time
+                pass
+        if settings is None or settings not in valid_settings:
+            error = next(experiment_validator.iter_errors(exp_dict), None)
+            if error is not None:
+                return _describe(error, [exp_name])
+            if settings is not None:
+                valid_settings.add(settings)
+
+        for index, instruction in enumerate(exp_dict["instructions"]):
+            try:
+                key = (
+                    len(instruction),
+                    instruction[0],
+                    tuple(instruction[1]),
+                    type(instruction[2]),
+                )
+                if key in valid_instructions:
+                    continue
+            except (TypeError, IndexError, KeyError):
+                key = None
+            error = next(instruction_validator.iter_errors(instruction), None)
+            if error is not None:
+                return _describe(error, [exp_name, "instructions", index])
+            if key is not None:
+                valid_instructions.add(key)
+    return None
+
+
+def _describe(error: ValidationError, path: list) -> str:
+    """
+    Describe a validation error together with its place in the job.
+    """
+    location = "/".join(str(item) for item in path + list(error.absolute_path))
+    return error.message + " (at " + location + ")"
@@ -1,21 +1,67 @@
 """
 Module that defines the user api.
 """
-import datetime
+import hmac
 import json
-import uuid
 from typing import Tuple
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth import authenticate
 
 from dropbox.exceptions import ApiError, AuthError
 
 from .models import Backend
 from .apps import BackendsConfig as ac
-
-# pylint: disable=E1101
+from .coalescing import (
+    MAX_JOBS_PER_BATCH,
+    coalesce_queued_jobs,
+    split_finished_batches,
+)
+from .scheduling import SchedulingPolicy, get_scheduling_policy
+from .idempotency import (
+    IDEMPOTENCY_HEADER,
+    claim_idempotency_key,
+    request_fingerprint,
+    settle_idempotency_key,
+)
+from .queue_stats import finished_job_ids, record_completion, record_drop
+from .encodings import (
+    UNACCEPTABLE_MESSAGE,
+    encoded_response,
+    negotiate_media_type,
+    unpack_result,
+)
+from .archive import (
+    archived_job_ids,
+    is_archived,
+    load_archived_result,
+    load_job_status,
+)
+from .result_chunks import is_chunked, load_chunked_result
+from .storage_providers import StorageError, StorageProvider, StorageUnavailable
+from .storage_registry import built_providers
+from .storage_routing import backend_storage
+from .webhooks import release_finished_deliveries, resolve_callback
+from .metrics import REGISTRY
+from .tracing import import_spans
+from .jobs import (
+    admit_job,
+    annotate_status,
+    check_credentials,
+    dequeue_jobs,
+    error_response,
+    finished_jobs_dir,
+    make_job_id,
+    new_job_response,
+    queued_job_path,
+    register_job,
+    result_json_path,
+    status_json_path,
+    unavailable_response,
+)
+
+# pylint: disable=E1101, R0914
 
 
 def check_request(
@@ -31,14 +77,8 @@ def check_request(
     Returns:
         status, json_dict that has the appropiate answers
     """
-    job_response_dict = {
-        "job_id": "None",
-        "status": "None",
-        "detail": "None",
-        "error_message": "None",
-    }
-
     if not request.method == req_method:
+        job_response_dict = new_job_response()
         job_response_dict["status"] = "ERROR"
         job_response_dict["error_message"] = "Only " + req_method + " request allowed!"
         job_response_dict["detail"] = "Only " + req_method + " request allowed!"
@@ -52,22 +92,7 @@ def check_request(
         password = request.GET["password"]
     else:
         raise NotImplementedError("Your method is unknown")
-    user = authenticate(username=username, password=password)
-
-    if user is None:
-        job_response_dict["status"] = "ERROR"
-        job_response_dict["error_message"] = "Invalid credentials!"
-        job_response_dict["detail"] = "Invalid credentials!"
-        return job_response_dict, 401
-
-    try:
-        _ = Backend.objects.get(name=backend_name)
-    except Backend.DoesNotExist:
-        job_response_dict["status"] = "ERROR"
-        job_response_dict["detail"] = "Unknown back-end!"
-        job_response_dict["error_message"] = "Unknown back-end!"
-        return job_response_dict, 404
-    return job_response_dict, 200
+    return check_credentials(backend_name, username, password)
 
 
 # Create your views here.
@@ -144,6 +169,37 @@ def post_job(request, backend_name: str) -> JsonResponse:
     if job_response_dict["status"] == "ERROR":
         return JsonResponse(job_response_dict, status=html_status)
 
+    username = request.POST["username"]
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key is None:
+        return _submit_job(request, backend_name, job_response_dict)
+    earlier_response = claim_idempotency_key(
+        username,
+        idempotency_key,
+        request_fingerprint(backend_name, request.POST.get("json", "")),
+    )
+    if earlier_response is not None:
+        return earlier_response
+    response = None
+    try:
+        response = _submit_job(request, backend_name, job_response_dict)
+        return response
+    finally:
+        settle_idempotency_key(username, idempotency_key, response)
+
+
+def _submit_job(request, backend_name: str, job_response_dict: dict) -> JsonResponse:
+    """
+    Store the job of an authenticated submission and put it into the queue.
+
+    Args:
+        request: The request coming in
+        backend_name (str): The name of the backend
+        job_response_dict: The answer to the submission
+
+    Returns:
+        JsonResponse : send back a response with the dict if successful
+    """
     username = request.POST["username"]
     try:
         data = request.POST["json"].encode("utf-8")
@@ -155,33 +211,39 @@ def post_job(request, backend_name: str) -> JsonResponse:
         ] = "The encoding of your json seems non utf-8!"
         return JsonResponse(job_response_dict, status=406)
     try:
-        job_id = (
-            (datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S"))
-            + "-"
-            + backend_name
-            + "-"
-            + username
-            + "-"
-            + (uuid.uuid4().hex)[:5]
+        callback = resolve_callback(
+            username,
+            request.POST.get("callback_url"),
+            request.POST.get("callback_secret"),
         )
-        job_json_dir = "/Backend_files/Queued_Jobs/" + backend_name + "/"
-        job_json_name = "job-" + job_id + ".json"
-        job_json_path = job_json_dir + job_json_name
+    except ValueError as err:
+        return error_response(job_response_dict, str(err), 406)
+    backend = Backend.objects.get(name=backend_name)
+    rejection = admit_job(backend, username, job_response_dict, data.decode("utf-8"))
+    if rejection is not None:
+        return rejection
+    try:
+        job_id = make_job_id(backend_name, username)
+        job_json_path = queued_job_path(backend_name, job_id)
 
-        storage_provider = getattr(ac, "storage")
+        storage_provider = backend_storage(backend_name)
         storage_provider.upload(
             dump_str=data.decode("utf-8"), storage_path=job_json_path
         )
-        status_json_dir = "/Backend_files/Status/" + backend_name + "/" + username + "/"
-        status_json_name = "status-" + job_id + ".json"
-        status_json_path = status_json_dir + status_json_name
+        status_path = status_json_path(backend_name, job_id)
         job_response_dict["job_id"] = job_id
         job_response_dict["status"] = "INITIALIZING"
         job_response_dict["detail"] = "Got your json."
         status_str = json.dumps(job_response_dict)
-        storage_provider.upload(dump_str=status_str, storage_path=status_json_path)
+        storage_provider.upload(dump_str=status_str, storage_path=status_path)
+
+        job_response_dict["estimated_start"] = register_job(
+            backend, username, job_id, callback
+        )
         return JsonResponse(job_response_dict)
-    except (AuthError, ApiError):
+    except StorageUnavailable as err:
+        return unavailable_response(job_response_dict, err)
+    except (AuthError, ApiError, StorageError):
         job_response_dict["status"] = "ERROR"
         job_response_dict["detail"] = "Error saving json data to database!"
         job_response_dict["error_message"] = "Error saving json data to database!"
@@ -212,24 +274,20 @@ def get_job_status(request, backend_name: str) -> JsonResponse:
         data = json.loads(request.GET["json"])
         job_id = data["job_id"]
         status_msg_dict["job_id"] = job_id
-        extracted_username = job_id.split("-")[2]
+        _ = job_id.split("-")[2]
     except:
         status_msg_dict["status"] = "ERROR"
         status_msg_dict["detail"] = "Error loading json data from input request!"
         status_msg_dict["error_message"] = "Error loading json data from input request!"
         return JsonResponse(status_msg_dict, status=406)
     try:
-        status_json_dir = (
-            "/Backend_files/Status/" + backend_name + "/" + extracted_username + "/"
-        )
-        status_json_name = "status-" + job_id + ".json"
-        status_json_path = status_json_dir + status_json_name
 
-        storage_provider = getattr(ac, "storage")
-        status_msg_dict = json.loads(
-            storage_provider.get_file_content(storage_path=status_json_path)
-        )
+        storage_provider = backend_storage(backend_name)
+        status_msg_dict = load_job_status(storage_provider, backend_name, job_id)
+        status_msg_dict = annotate_status(backend_name, status_msg_dict)
         return JsonResponse(status_msg_dict, status=200)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
     except:
         status_msg_dict["status"] = "ERROR"
         status_msg_dict[
@@ -253,9 +311,13 @@ def get_job_result(request, backend_name: str) -> JsonResponse:
     Returns:
         JsonResponse : send back a response with the dict if successful
     """
+    # pylint: disable=R0911
     status_msg_dict, html_status = check_request(request, backend_name)
     if status_msg_dict["status"] == "ERROR":
         return JsonResponse(status_msg_dict, status=html_status)
+    media_type = negotiate_media_type(request.headers.get("Accept"))
+    if media_type is None:
+        return error_response(status_msg_dict, UNACCEPTABLE_MESSAGE, 406)
 
     # We should really handle these exceptions cleaner, but this seems a bit
     # complicated right now
@@ -266,7 +328,7 @@ def get_job_result(request, backend_name: str) -> JsonResponse:
         data = json.loads(request.GET["json"])
         job_id = data["job_id"]
         status_msg_dict["job_id"] = job_id
-        extracted_username = job_id.split("-")[2]
+        _ = job_id.split("-")[2]
     except:
         status_msg_dict["detail"] = "Error loading json data from input request!"
         status_msg_dict["error_message"] = "Error loading json data from input request!"
@@ -274,17 +336,12 @@ def get_job_result(request, backend_name: str) -> JsonResponse:
 
     # request the data from the queue
     try:
-        status_json_dir = (
-            "/Backend_files/Status/" + backend_name + "/" + extracted_username + "/"
-        )
-        status_json_name = "status-" + job_id + ".json"
-        status_json_path = status_json_dir + status_json_name
-        storage_provider = getattr(ac, "storage")
-        status_msg_dict = json.loads(
-            storage_provider.get_file_content(storage_path=status_json_path)
-        )
+        storage_provider = backend_storage(backend_name)
+        status_msg_dict = load_job_status(storage_provider, backend_name, job_id)
         if status_msg_dict["status"] != "DONE":
             return JsonResponse(status_msg_dict, status=200)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
     except:
         status_msg_dict[
             "detail"
@@ -296,27 +353,72 @@ def get_job_result(request, backend_name: str) -> JsonResponse:
     # and if the status is switched to done, we can also obtain the result
     # one might attempt to connect this to the code above
     try:
-        result_json_dir = (
-            "/Backend_files/Result/" + backend_name + "/" + extracted_username + "/"
-        )
-        result_json_name = "result-" + job_id + ".json"
-        result_json_path = result_json_dir + result_json_name
-        storage_provider = getattr(ac, "storage")
-        result_dict = json.loads(
-            storage_provider.get_file_content(storage_path=result_json_path)
-        )
-        return JsonResponse(result_dict, status=200)
+        storage_provider = backend_storage(backend_name)
+        if is_archived(status_msg_dict):
+            result_dict = load_archived_result(storage_provider, job_id)
+        elif is_chunked(status_msg_dict):
+            result_dict = load_chunked_result(storage_provider, backend_name, job_id)
+        else:
+            result_dict = json.loads(
+                storage_provider.get_file_content(
+                    storage_path=result_json_path(backend_name, job_id)
+                )
+            )
+        return encoded_response(unpack_result(result_dict), media_type)
+    except StorageUnavailable as err:
+        return unavailable_response(status_msg_dict, err)
     except:
         status_msg_dict["detail"] = "Error getting result from database!"
         status_msg_dict["error_message"] = "Error getting result from database!"
         return JsonResponse(status_msg_dict, status=406)
 
 
+def _hand_out_job(
+    storage_provider: StorageProvider,
+    policy: SchedulingPolicy,
+    backend: Backend,
+    job_json_name: str,
+) -> dict:
+    """
+    Move a queued job to the running jobs and take it out of the index of the queue.
+    The job only leaves the index once its file left the queue, such that a job whose
+    file could not be moved stays queued.
+
+    Args:
+        storage_provider: The storage of the backend
+        policy: The scheduling policy of the backend
+        backend: The backend
+        job_json_name: The name of the job file
+
+    Returns:
+        The job_msg_dict for the spooler
+    """
+    job_json_final_path = "/Backend_files/Running_Jobs/" + job_json_name
+    try:
+        storage_provider.move_file(
+            start_path="/Backend_files/Queued_Jobs/"
+            + backend.name
+            + "/"
+            + job_json_name,
+            final_path=job_json_final_path,
+        )
+    except FileNotFoundError:
+        # the index still lists a job that is not queued anymore
+        record_drop(backend, policy.dequeue(backend, [job_json_name]))
+        raise
+    job_msg_dict = {"job_id": job_json_name[4:-5], "job_json": job_json_final_path}
+    traceparent = dequeue_jobs(policy, backend, [job_json_name], job_msg_dict["job_id"])
+    if traceparent:
+        job_msg_dict["traceparent"] = traceparent
+    return job_msg_dict
+
+
 @csrf_exempt
 def get_next_job_in_queue(request, backend_name: str) -> JsonResponse:
     """
     A view that obtains the next job in the queue. It is only allowed for the
-    user, which is named `spooler`
+    user, which is named `spooler`. If the job is traced, the answer has the
+    `traceparent` under which the spooler reports its spans to `post_spans`.
 
     Args:
         request: The request coming in
@@ -325,6 +427,7 @@ def get_next_job_in_queue(request, backend_name: str) -> JsonResponse:
     Returns:
         JsonResponse : send back a response with the dict if successful
     """
+    # pylint: disable=R0911, R0912
     status_msg_dict, html_status = check_request(request, backend_name)
     if status_msg_dict["status"] == "ERROR":
         return JsonResponse(status_msg_dict, status=html_status)
@@ -343,37 +446,73 @@ def get_next_job_in_queue(request, backend_name: str) -> JsonResponse:
     try:
         ###_Checking already queued files for a possible freeze_##
         job_json_dir = "/Backend_files/Running_Jobs/"
-        storage_provider = getattr(ac, "storage")
+        storage_provider = backend_storage(backend_name)
         job_list = storage_provider.get_file_queue(job_json_dir)
-        if job_list:
-            job_id_list = [name[4:-5] for name in job_list]
-            for job_id_el in job_id_list:
-                split_job_id = job_id_el.split("-")
-                if backend_name == split_job_id[1]:
-                    job_msg_dict["job_id"] = job_id_el
-                    job_msg_dict["job_json"] = (
-                        job_json_dir + job_list[job_id_list.index(job_id_el)]
-                    )
-                    return JsonResponse(job_msg_dict, status=200)
+        running_ids = [
+            name[4:-5] for name in job_list if name[4:-5].split("-")[1] == backend_name
+        ]
+        backend = Backend.objects.get(name=backend_name)
+        # only the jobs that left the running jobs are finished
+        record_completion(backend, finished_job_ids(backend, running_ids))
+        if running_ids:
+            job_msg_dict["job_id"] = running_ids[0]
+            job_msg_dict["job_json"] = job_json_dir + "job-" + running_ids[0] + ".json"
+            return JsonResponse(job_msg_dict, status=200)
         ###_Now proceed as usual_##
-        job_json_dir = "/Backend_files/Queued_Jobs/" + backend_name + "/"
-        storage_provider = getattr(ac, "storage")
-        job_list = storage_provider.get_file_queue(job_json_dir)
+        # the spooler has no running job anymore, so it finished all of them
+        split_finished_batches(storage_provider, backend_name)
+        release_finished_deliveries(backend)
+        policy = get_scheduling_policy(backend)
+        if backend.coalesce_jobs:
+            job_list = policy.next_jobs(storage_provider, backend, MAX_JOBS_PER_BATCH)
+        else:
+            job_list = policy.next_jobs(storage_provider, backend)
         assert len(job_list) != 0
-        job_json_name = job_list[0]
-        job_msg_dict["job_id"] = job_json_name[4:-5]
-        job_json_start_path = job_json_dir + job_json_name
-        job_json_final_path = "/Backend_files/Running_Jobs/" + job_json_name
-
-        storage_provider.move_file(
-            start_path=job_json_start_path, final_path=job_json_final_path
-        )
-        job_msg_dict["job_json"] = job_json_final_path
+        if len(job_list) > 1:
+            batch_msg_dict, batch_list = coalesce_queued_jobs(
+                storage_provider, backend, job_list
+            )
+            if batch_msg_dict:
+                traceparent = dequeue_jobs(
+                    policy, backend, batch_list, batch_msg_dict["job_id"]
+                )
+                if traceparent:
+                    batch_msg_dict["traceparent"] = traceparent
+                return JsonResponse(batch_msg_dict, status=200)
+        job_msg_dict = _hand_out_job(storage_provider, policy, backend, job_list[0])
         return JsonResponse(job_msg_dict, status=200)
+    except StorageUnavailable as err:
+        return unavailable_response(job_msg_dict, err)
     except:
         return JsonResponse(job_msg_dict, status=406)
 
 
+@csrf_exempt
+def post_spans(request, backend_name: str) -> JsonResponse:
+    """
+    A view that takes the spans that the spooler recorded while it worked on traced
+    jobs, e.g. the execution and the upload of the result, see `tracing.import_spans`.
+    It is only allowed for the user, which is named `spooler`
+
+    Args:
+        request: The request coming in
+        backend_name (str): The name of the backend
+
+    Returns:
+        JsonResponse : send back the number of accepted spans if successful
+    """
+    status_msg_dict, html_status = check_request(request, backend_name, "POST")
+    if status_msg_dict["status"] == "ERROR":
+        return JsonResponse(status_msg_dict, status=html_status)
+    if not request.POST["username"] == "spooler":
+        return error_response(status_msg_dict, "This is for the spooler only", 406)
+    try:
+        num_spans = import_spans(json.loads(request.POST.get("spans", "")))
+    except ValueError as err:
+        return error_response(status_msg_dict, str(err), 406)
+    return JsonResponse({"accepted": num_spans})
+
+
 @csrf_exempt
 def get_user_jobs(request, backend_name: str) -> JsonResponse:
     """
@@ -396,14 +535,67 @@ def get_user_jobs(request, backend_name: str) -> JsonResponse:
     # complicated right now
     # pylint: disable=W0702
     try:
-        job_json_dir = (
-            "/Backend_files/Finished_Jobs/" + backend_name + "/" + username + "/"
+        storage_provider = backend_storage(backend_name)
+        job_list = storage_provider.get_file_queue(
+            finished_jobs_dir(backend_name, username)
         )
-        storage_provider = getattr(ac, "storage")
-        job_list = storage_provider.get_file_queue(job_json_dir)
-        assert len(job_list) != 0
         job_list = [job_json_name[4:-5] for job_json_name in job_list]
-        user_job_dict["job_ids"] = job_list
+        job_list += archived_job_ids(backend_name, username)
+        assert len(job_list) != 0
+        user_job_dict["job_ids"] = sorted(job_list)
         return JsonResponse(user_job_dict)
+    except StorageUnavailable as err:
+        return unavailable_response(user_job_dict, err)
     except:
         return JsonResponse(user_job_dict)
+
+
+def metrics(request) -> HttpResponse:
+    """
+    A view that sends the metrics of the process in the text format of Prometheus. It
+    is only allowed for staff users and for requests with the `METRICS_TOKEN` as
+    bearer token.
+
+    Args:
+        request: The request coming in
+
+    Returns:
+        HttpResponse : the metrics or 403 if the request is not allowed
+    """
+    if not _may_read_metrics(request):
+        return HttpResponse("Only for admins!", status=403)
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4")
+
+
+def slow_storage_calls(request) -> JsonResponse:
+    """
+    A view that sends the latest calls to the storage which took longer than
+    `STORAGE_SLOW_CALL_SECONDS`, from the storage of the app and from the storage of
+    every backend. Like the metrics it is only allowed for admins.
+
+    Args:
+        request: The request coming in
+
+    Returns:
+        JsonResponse : the slow calls or 403 if the request is not allowed
+    """
+    if not _may_read_metrics(request):
+        return JsonResponse({"detail": "Only for admins!"}, status=403)
+    storage_providers = [getattr(ac, "storage")] + list(built_providers().values())
+    slow_calls = []
+    for storage_provider in {id(item): item for item in storage_providers}.values():
+        slow_calls += getattr(storage_provider, "slow_calls", [])
+    return JsonResponse(
+        {"slow_calls": sorted(slow_calls, key=lambda slow_call: slow_call["time"])}
+    )
+
+
+def _may_read_metrics(request) -> bool:
+    """
+    Is the request from a staff user or does it have the `METRICS_TOKEN` ?
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    authorization = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(authorization, "Bearer " + token):
+        return True
+    return request.user.is_staff
@@ -0,0 +1,430 @@
+"""
+The module that notifies users about their finished jobs, such that they do not have to
+poll `get_job_status`. A job that is submitted with a callback url, or by a user with a
+default one, gets a `WebhookDelivery`, which waits until the job reaches "DONE" or
+"ERROR". qlue learns about this when the spooler asks for its next job, since it has
+finished all the jobs it obtained before. The notification is then posted by a small
+pool of background threads, such that no request ever waits for it.
+
+The body of a notification is the status of the job together with the name of the
+backend. It is signed with a key that is derived from the secret of the callback:
+
+    key = hex of HMAC-SHA256(secret, "qlue-webhook")
+    X-Qlue-Timestamp: <unix time>
+    X-Qlue-Signature: sha256=<hex of HMAC-SHA256(key, "<timestamp>.<body>")>
+
+The key is stored with the delivery and the default secret of a user is stored as it
+was entered, so both are enough to forge notifications and the database has to be
+protected like the secrets themselves.
+
+Callbacks may only point to public hosts. The host is resolved when the callback is
+registered and again before every attempt, and the notification is sent to the address
+that was checked, such that a name that resolves differently on the second lookup
+cannot reach another host. Redirects are not followed, so nobody can make qlue post to
+the internal network. `WEBHOOK_ALLOW_PRIVATE_HOSTS` lifts
+this for local setups.
+
+Failed deliveries are retried with exponential backoff. After `MAX_DELIVERY_ATTEMPTS`
+they are kept as "FAILED" dead letters, which can be sent again from the admin.
+"""
+import datetime
+import functools
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .archive import load_job_status
+from .models import Backend, QueueEntry, WebhookDelivery
+from .storage_routing import backend_storage
+
+# pylint: disable=E1101
+
+SIGNATURE_HEADER = "X-Qlue-Signature"
+TIMESTAMP_HEADER = "X-Qlue-Timestamp"
+# the number of notifications that are posted at the same time
+MAX_DELIVERY_WORKERS = 4
+# the number of attempts after which a notification becomes a dead letter
+MAX_DELIVERY_ATTEMPTS = 8
+# the wait after the first failed attempt, which doubles with every further one
+RETRY_BASE_DELAY = 30.0
+RETRY_MAX_DELAY = 3600.0
+# the time that the receiver has to answer
+DELIVERY_TIMEOUT = 10.0
+# the time for which a notification belongs to the worker that is sending it
+DELIVERY_LEASE = datetime.timedelta(minutes=2)
+# the message from which the signing key is derived with the secret of the callback
+SIGNING_KEY_CONTEXT = b"qlue-webhook"
+
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def resolve_callback(
+    username: str, callback_url: Optional[str], callback_secret: Optional[str]
+) -> Optional[Tuple[str, str]]:
+    """
+    Find the callback of a submission. The url and the secret of the submission win
+    over the defaults of the user.
+
+    Args:
+        username: The user that submits the job
+        callback_url: The callback url of the submission
+        callback_secret: The secret of the submission
+
+    Returns:
+        The url of the callback and the key with which the notifications are signed,
+        None if there is no callback
+
+    Raises:
+        ValueError: If the url is invalid, its host is not public or there is no
+            secret.
+    """
+    user = get_user_model().objects.get(username=username)
+    url = callback_url or user.callback_url
+    if not url:
+        return None
+    try:
+        URLValidator(schemes=["http", "https"])(url)
+    except ValidationError as err:
+        raise ValueError("The callback url " + url + " is not valid!") from err
+    check_callback_host(url)
+    secret = callback_secret or user.callback_secret
+    if not secret:
+        raise ValueError(
+            "A callback needs a callback_secret to sign the notifications!"
+        )
+    return url, signing_key(secret)
+
+
+def check_callback_host(url: str) -> List[str]:
+    """
+    Make sure that a callback url points to a public host. Every address of the host
+    is checked, such that a name cannot hide an internal address among public ones.
+
+    Args:
+        url: The callback url
+
+    Returns:
+        The checked addresses of the host, empty if private hosts are allowed
+
+    Raises:
+        ValueError: If the host cannot be resolved or one of its addresses is
+            loopback, private, link-local, multicast or reserved.
+    """
+    if getattr(settings, "WEBHOOK_ALLOW_PRIVATE_HOSTS", False):
+        return []
+    split_url = urllib.parse.urlsplit(url)
+    try:
+        port = split_url.port or (443 if split_url.scheme == "https" else 80)
+        address_infos = socket.getaddrinfo(
+            split_url.hostname, port, proto=socket.IPPROTO_TCP
+        )
+    except (OSError, UnicodeError, ValueError) as err:
+        raise ValueError(
+            "The host of the callback url " + url + " is unknown!"
+        ) from err
+    addresses = []
+    for address_info in address_infos:
+        address = ipaddress.ip_address(address_info[4][0].split("%")[0])
+        if getattr(address, "ipv4_mapped", None) is not None:
+            address = address.ipv4_mapped
+        # private, loopback, link-local and reserved networks are not global
+        if not address.is_global or address.is_multicast:
+            raise ValueError(
+                "The callback url " + url + " does not point to a public host!"
+            )
+        addresses.append(address_info[4][0])
+    return addresses
+
+
+def signing_key(secret: str) -> str:
+    """
+    The key with which the notifications of a callback are signed. The receiver
+    derives it from its secret in the same way.
+    """
+    return hmac.new(
+        secret.encode("utf-8"), SIGNING_KEY_CONTEXT, hashlib.sha256
+    ).hexdigest()
+
+
+def release_finished_deliveries(backend: Backend) -> None:
+    """
+    Send the notifications about all jobs that left the queue of the backend. It is
+    called once the spooler has finished every job that it obtained.
+    """
+    queued_ids = QueueEntry.objects.filter(backend=backend).values("job_id")
+    WebhookDelivery.objects.filter(backend=backend, state="WAITING").exclude(
+        job_id__in=queued_ids
+    ).update(state="PENDING", next_attempt=timezone.now())
+    # this also picks up notifications whose worker got lost
+    transaction.on_commit(lambda: _get_pool().submit(_dispatch_in_background))
+
+
+def dispatch_due_deliveries() -> int:
+    """
+    Hand every pending notification that is due to the pool of workers.
+
+    Returns:
+        The number of notifications that were handed over
+    """
+    now = timezone.now()
+    due_ids = WebhookDelivery.objects.filter(
+        state="PENDING", next_attempt__lte=now
+    ).values_list("id", flat=True)
+    dispatched = 0
+    for delivery_id in list(due_ids):
+        # the lease keeps other processes from sending the same notification
+        claimed = WebhookDelivery.objects.filter(
+            id=delivery_id, state="PENDING", next_attempt__lte=now
+        ).update(next_attempt=now + DELIVERY_LEASE)
+        if claimed:
+            _get_pool().submit(_deliver_in_background, delivery_id)
+            dispatched += 1
+    return dispatched
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    """
+    Treat redirects as failures, since they could lead to a host that is not public.
+    """
+
+    def redirect_request(self, *_args, **_kwargs):
+        return None
+
+
+_OPENER = urllib.request.build_opener(_NoRedirects)
+
+
+class _PinnedConnection:
+    """
+    Connect to a checked address of the host instead of resolving the host again. The
+    host is still sent in the Host header and, with TLS, as SNI and is checked against
+    the certificate.
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+        self._create_connection = self._connect_to_address
+
+    def _connect_to_address(self, host_port, *args):
+        return socket.create_connection((self.address, host_port[1]), *args)
+
+
+class _PinnedHTTPConnection(_PinnedConnection, http.client.HTTPConnection):
+    """
+    A connection to a checked address.
+    """
+
+
+class _PinnedHTTPSConnection(_PinnedConnection, http.client.HTTPSConnection):
+    """
+    A TLS connection to a checked address.
+    """
+
+
+class _PinnedHTTPHandler(urllib.request.HTTPHandler):
+    """
+    Open http urls at a checked address.
+    """
+
+    def __init__(self, address):
+        super().__init__()
+        self.address = address
+
+    def http_open(self, req):
+        return self.do_open(
+            functools.partial(_PinnedHTTPConnection, address=self.address), req
+        )
+
+
+class _PinnedHTTPSHandler(urllib.request.HTTPSHandler):
+    """
+    Open https urls at a checked address.
+    """
+
+    def __init__(self, address):
+        super().__init__()
+        self.address = address
+
+    def https_open(self, req):
+        return self.do_open(
+            functools.partial(_PinnedHTTPSConnection, address=self.address),
+            req,
+            context=self._context,
+            check_hostname=self._check_hostname,
+        )
+
+
+def _pinned_opener(address: str) -> urllib.request.OpenerDirector:
+    """
+    An opener that connects to the given address whatever the host of the url
+    resolves to. Proxies are skipped, since they would resolve the host themselves.
+    """
+    return urllib.request.build_opener(
+        _NoRedirects,
+        urllib.request.ProxyHandler({}),
+        _PinnedHTTPHandler(address),
+        _PinnedHTTPSHandler(address),
+    )
+
+
+def sign_notification(key: str, timestamp: str, body: bytes) -> str:
+    """
+    The signature of a notification as it is sent in `SIGNATURE_HEADER`.
+
+    Args:
+        key: The signing key of the callback as in `signing_key`
+        timestamp: The value of `TIMESTAMP_HEADER`
+        body: The body of the notification
+    """
+    digest = hmac.new(
+        key.encode("utf-8"), timestamp.encode("utf-8") + b"." + body, hashlib.sha256
+    ).hexdigest()
+    return "sha256=" + digest
+
+
+def deliver_webhook(delivery_id: int) -> Optional[float]:
+    """
+    Make a single attempt to post a notification and record its outcome.
+
+    Args:
+        delivery_id: The id of the `WebhookDelivery`
+
+    Returns:
+        The seconds until the next attempt, None if no further attempt is needed
+    """
+    delivery = WebhookDelivery.objects.select_related("backend").get(id=delivery_id)
+    if delivery.state != "PENDING":
+        return None
+    # pylint: disable=W0702
+    try:
+        status_msg_dict = _final_status(delivery.backend.name, delivery.job_id)
+    except:
+        status_msg_dict = None
+    if status_msg_dict is None:
+        return _record_failure(delivery, "The job is not finished yet.")
+    # the host might point somewhere else since the callback was registered
+    try:
+        addresses = check_callback_host(delivery.url)
+    except ValueError as err:
+        return _record_failure(delivery, str(err))
+    opener = _pinned_opener(addresses[0]) if addresses else _OPENER
+
+    body = json.dumps(dict(status_msg_dict, backend=delivery.backend.name)).encode(
+        "utf-8"
+    )
+    timestamp = str(int(time.time()))
+    request = urllib.request.Request(
+        delivery.url,
+        data=body,
+        headers={
+            "Content-Type": "application/json",
+            "User-Agent": "qlue-webhooks",
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign_notification(delivery.secret, timestamp, body),
+        },
+        method="POST",
+    )
+    try:
+        with opener.open(request, timeout=DELIVERY_TIMEOUT):
+            pass
+    except urllib.error.HTTPError as err:
+        return _record_failure(delivery, "The receiver answered " + str(err.code))
+    except (urllib.error.URLError, OSError) as err:
+        return _record_failure(delivery, "The receiver is unreachable: " + str(err))
+
+    delivery.state = "DELIVERED"
+    delivery.delivered = timezone.now()
+    delivery.next_attempt = None
+    delivery.save()
+    return None
+
+
+def _final_status(backend_name: str, job_id: str) -> Optional[dict]:
+    """
+    The status of a job if it reached "DONE" or "ERROR", None otherwise.
+    """
+    storage_provider = backend_storage(backend_name)
+    status_msg_dict = load_job_status(storage_provider, backend_name, job_id)
+    if status_msg_dict.get("status") not in ("DONE", "ERROR"):
+        return None
+    return status_msg_dict
+
+
+def _record_failure(delivery: WebhookDelivery, error: str) -> Optional[float]:
+    """
+    Count a failed attempt and decide when to make the next one.
+    """
+    delivery.attempts += 1
+    delivery.last_error = error[:500]
+    if delivery.attempts >= MAX_DELIVERY_ATTEMPTS:
+        delivery.state = "FAILED"
+        delivery.next_attempt = None
+        delivery.save()
+        return None
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (delivery.attempts - 1))
+    # the jitter keeps the retries of many jobs from arriving all at once
+    delay *= random.uniform(0.5, 1.0)
+    delivery.next_attempt = timezone.now() + datetime.timedelta(seconds=delay)
+    delivery.save()
+    return delay
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """
+    The pool of workers, which is started with the first notification.
+    """
+    global _POOL  # pylint: disable=W0603
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(
+                max_workers=MAX_DELIVERY_WORKERS, thread_name_prefix="qlue-webhook"
+            )
+        return _POOL
+
+
+def _dispatch_in_background() -> None:
+    """
+    Run `dispatch_due_deliveries` in a worker.
+    """
+    try:
+        dispatch_due_deliveries()
+    finally:
+        close_old_connections()
+
+
+def _deliver_in_background(delivery_id: int) -> None:
+    """
+    Run `deliver_webhook` in a worker and come back once the next attempt is due.
+    """
+    try:
+        delay = deliver_webhook(delivery_id)
+    finally:
+        close_old_connections()
+    if delay is not None:
+        timer = threading.Timer(
+            delay, lambda: _get_pool().submit(_dispatch_in_background)
+        )
+        timer.daemon = True
+        timer.start()
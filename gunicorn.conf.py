@@ -0,0 +1,25 @@
+"""
+The configuration of gunicorn for the deployment of qlue.
+
+By default qlue runs as WSGI app (`main.wsgi`) in sync workers. To run it as ASGI app
+in uvicorn workers instead, set `GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker`
+and start `main.asgi:application`.
+"""
+import multiprocessing
+
+from decouple import config
+
+worker_class = config("GUNICORN_WORKER_CLASS", default="sync")
+
+# Heroku sets WEB_CONCURRENCY according to the memory of the dyno. Otherwise, the
+# asynchronous workers need about one process per core, while the sync workers mostly
+# wait for the storage and the usual 2 * cores + 1 applies.
+if worker_class == "sync":
+    DEFAULT_WORKERS = 2 * multiprocessing.cpu_count() + 1
+else:
+    DEFAULT_WORKERS = multiprocessing.cpu_count() + 1
+workers = config("WEB_CONCURRENCY", default=DEFAULT_WORKERS, cast=int)
+
+# load django once in the master, such that the workers start fast and share memory
+preload_app = True
+timeout = config("GUNICORN_TIMEOUT", default=30, cast=int)
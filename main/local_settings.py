@@ -44,11 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "backends.middleware.metrics_middleware",
+    "backends.middleware.tracing_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "backends.middleware.profiling_middleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -130,3 +133,30 @@ STATIC_URL = "/static/"
 
 LOGIN_REDIRECT_URL = "index"
 LOGOUT_REDIRECT_URL = "index"
+
+# the bearer token with which Prometheus may read /api/metrics/ besides staff users
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+# send the Server-Timing header with every response, not only if it is asked for
+SERVER_TIMING = config("SERVER_TIMING", default=False, cast=bool)
+# the storage providers, which are built on first use, see backends/storage_registry.py
+STORAGE_PROVIDERS = {
+    "default": {
+        "BACKEND": config(
+            "STORAGE_PROVIDER", default="backends.storage_providers.DropboxProvider"
+        ),
+        "OPTIONS": {},
+        "WRAPPERS": [
+            "backends.resilient_storage.ResilientProvider",
+            "backends.storage_providers.InstrumentedProvider",
+        ],
+    },
+}
+# the file to which the spans of the traces are appended as OTLP/JSON, off if empty
+TRACING_FILE = config("TRACING_FILE", default="")
+# the OTLP/HTTP endpoint of a collector for the traces, e.g.
+# http://localhost:4318/v1/traces, off if empty
+TRACING_OTLP_ENDPOINT = config("TRACING_OTLP_ENDPOINT", default="")
+# allow callback urls on loopback, private and link-local hosts, e.g. for local tests
+WEBHOOK_ALLOW_PRIVATE_HOSTS = config(
+    "WEBHOOK_ALLOW_PRIVATE_HOSTS", default=False, cast=bool
+)